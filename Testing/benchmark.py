@@ -0,0 +1,204 @@
+"""
+Benchmarks the TO2A analysis on synthetic phantom images.
+
+Each stage run by the GUI is timed headless through the kernels it calls:
+the automatic context (`TO2AContextManager.get_context`),
+`draw_rois` and `analyse` of each module, and the full collection for an image.
+Times are reported for each matrix size with the throughput of the full collection
+and the scaling of each stage with the number of pixels.
+
+Results can be saved with `--output` and compared against a saved run with `--baseline`,
+the exit code is 1 if any stage is slower than the baseline by more than `--tolerance`.
+"""
+import sys
+import json
+import math
+import time
+import argparse
+import statistics
+from pathlib import Path
+from collections.abc import Callable
+
+import numpy as np
+
+if str(Path(__file__).resolve().parent.parent) not in sys.path:
+    sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from pumpia_to2a.synthetic import phantom_image
+from pumpia_to2a.batch import analyse_slice
+from pumpia_to2a.kernels.context import TO2AContext, detect_context
+from pumpia_to2a.kernels.profiles import box_profile, line_profile
+from pumpia_to2a.kernels import slice_width as sw
+from pumpia_to2a.kernels import phantom_width as pw
+from pumpia_to2a.kernels import resolution as res
+from pumpia_to2a.kernels import mtf as mt
+
+DEFAULT_SIZES = (256, 512, 1024, 2048)
+DEFAULT_REPEATS = 5
+DEFAULT_TOLERANCE = 1.25
+
+
+def time_call(function: Callable[[], object], repeats: int) -> float:
+    """
+    Returns the median time in seconds of `repeats` calls of `function`, after one warm up call.
+    """
+    function()
+    times: list[float] = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def stages(image: np.ndarray,
+           pixel_size: tuple[float, float, float],
+           context: TO2AContext) -> dict[str, Callable[[], object]]:
+    """
+    Returns the stages to time for an image, keyed by name.
+    """
+    wedge_dir, inside_bounds, outside_bounds = sw.wedge_rois(context, pixel_size)
+    pix_size = pixel_size[1] if wedge_dir == "Vertical" else pixel_size[2]
+    lines = pw.spoke_lines(context, pixel_size)
+    inserts = res.insert_rois(context, pixel_size)
+    edges = mt.mtf_rois(context, pixel_size)
+
+    def slice_width_analyse():
+        sw.slice_widths(box_profile(image, inside_bounds, wedge_dir, context.rotation, pixel_size),
+                        box_profile(image, outside_bounds, wedge_dir, context.rotation, pixel_size),
+                        pixel_size[0],
+                        pix_size)
+
+    def phantom_width_analyse():
+        for name, ends in lines.items():
+            pw.spoke_width(line_profile(image, ends),
+                           pw.spoke_unit_length(name, pixel_size, context.rotation))
+        pw.dense_widths(image, context, pixel_size)
+
+    def resolution_analyse():
+        res.analyse_inserts(res.insert_profiles(image, inserts, context.rotation, pixel_size))
+
+    def mtf_analyse():
+        for name, bounds in edges.items():
+            mt.box_mtf(image, bounds, name.capitalize(), pixel_size)  # type: ignore
+
+    return {"get_context": lambda: detect_context(image, pixel_size),
+            "slice_width.draw_rois": lambda: sw.wedge_rois(context, pixel_size),
+            "slice_width.analyse": slice_width_analyse,
+            "phantom_width.draw_rois": lambda: pw.spoke_lines(context, pixel_size),
+            "phantom_width.analyse": phantom_width_analyse,
+            "resolution.draw_rois": lambda: res.insert_rois(context, pixel_size),
+            "resolution.analyse": resolution_analyse,
+            "mtf.draw_rois": lambda: mt.mtf_rois(context, pixel_size),
+            "mtf.analyse": mtf_analyse,
+            "collection": lambda: analyse_slice(image, pixel_size, "ROW")}
+
+
+def run_benchmark(sizes: tuple[int, ...] = DEFAULT_SIZES,
+                  repeats: int = DEFAULT_REPEATS,
+                  rotation: float = 0,
+                  noise: float = 10,
+                  blur: float = 0.5) -> dict:
+    """
+    Times every stage for each matrix size.
+
+    Returns
+    -------
+    dict
+        {"times": {stage: {size: seconds}}, "throughput": {size: images per second},
+        "scaling": {stage: exponent of the time against the number of pixels}}
+    """
+    times: dict[str, dict[str, float]] = {}
+    for size in sizes:
+        image, pixel_size = phantom_image(size, rotation=rotation, noise=noise, blur=blur, seed=size)
+        context = detect_context(image, pixel_size)
+        for name, function in stages(image, pixel_size, context).items():
+            times.setdefault(name, {})[str(size)] = time_call(function, repeats)
+
+    throughput = {size: 1 / seconds for size, seconds in times["collection"].items()}
+
+    scaling: dict[str, float] = {}
+    if len(sizes) > 1:
+        log_pixels = np.log([size**2 for size in sizes])
+        for name, stage_times in times.items():
+            log_times = np.log([stage_times[str(size)] for size in sizes])
+            scaling[name] = float(np.polyfit(log_pixels, log_times, 1)[0])
+
+    return {"sizes": list(sizes),
+            "repeats": repeats,
+            "times": times,
+            "throughput": throughput,
+            "scaling": scaling}
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns a description of each stage and size slower than `baseline` by more than `tolerance`.
+    """
+    slower: list[str] = []
+    for name, stage_times in results["times"].items():
+        for size, seconds in stage_times.items():
+            base = baseline.get("times", {}).get(name, {}).get(size)
+            if base is not None and seconds > base * tolerance:
+                slower.append(f"{name} at {size}: {seconds * 1000:.2f} ms "
+                              f"(baseline {base * 1000:.2f} ms)")
+    return slower
+
+
+def print_results(results: dict) -> None:
+    """
+    Prints the results as a table of milliseconds.
+    """
+    sizes = [str(size) for size in results["sizes"]]
+    name_width = max(len(name) for name in results["times"])
+    print(f"{'stage':<{name_width}}" + "".join(f"{size:>10}" for size in sizes) + "   scaling")
+    for name, stage_times in results["times"].items():
+        scaling = results["scaling"].get(name, math.nan)
+        print(f"{name:<{name_width}}"
+              + "".join(f"{stage_times[size] * 1000:>10.2f}" for size in sizes)
+              + f"{scaling:>10.2f}")
+    print(f"{'images/s':<{name_width}}"
+          + "".join(f"{results['throughput'][size]:>10.1f}" for size in sizes))
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Command line entry point for the benchmark.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the TO2A analysis on synthetic images.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="matrix sizes to benchmark")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS,
+                        help="number of timed repeats of each stage")
+    parser.add_argument("--rotation", type=float, default=0, help="phantom rotation in degrees")
+    parser.add_argument("--noise", type=float, default=10, help="noise standard deviation")
+    parser.add_argument("--blur", type=float, default=0.5, help="blur standard deviation in mm")
+    parser.add_argument("-o", "--output", type=Path, default=None,
+                        help="JSON file to save the results to")
+    parser.add_argument("--baseline", type=Path, default=None,
+                        help="JSON file of saved results to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slow down relative to the baseline")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(tuple(args.sizes), args.repeats, args.rotation, args.noise, args.blur)
+    print_results(results)
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        slower = regressions(results, baseline, args.tolerance)
+        for line in slower:
+            print("Slower than baseline: " + line)
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
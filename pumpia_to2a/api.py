@@ -0,0 +1,391 @@
+"""
+GUI free analysis of TO2A images given as arrays, returning plain dataclasses.
+
+Importing this module is fast, numpy, scipy, pydicom and pumpia are only imported
+the first time an analysis is run, so it can be embedded in other programs and workers::
+
+    from pumpia_to2a import api as to2a
+
+    context = to2a.detect_context(image_array, pixel_size)
+    result = to2a.slice_width(image_array, context, pixel_size)
+
+`pixel_size` is (slice_thickness, row_spacing, column_spacing) in mm as given by `Instance.pixel_size`.
+Default settings match the collection modules.
+The batch analysis uses this module, see `batch.analyse_slice`.
+No tkinter is imported.
+"""
+from collections.abc import Hashable
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    import numpy as np
+    from pumpia_to2a.kernels.context import TO2AContext
+    from pumpia_to2a.kernels.resolution import InsertResult
+    from pumpia_to2a.kernels.mtf import EdgeMTF
+
+PixelSize = tuple[float, float, float]
+# (xmin, xmax, ymin, ymax) in pixels, max values are non-inclusive
+BoxBounds = tuple[int, int, int, int]
+# (x1, y1, x2, y2) in pixels
+LineEnds = tuple[int, int, int, int]
+
+
+@dataclass
+class SliceWidthResult:
+    """
+    The result of `slice_width`.
+
+    Attributes
+    ----------
+    wedge_dir : str
+        The direction of the wedge profiles, "Horizontal" or "Vertical".
+    inside_bounds : BoxBounds
+    outside_bounds : BoxBounds
+    expected_width : float
+    inside_wedge_width : float
+    outside_wedge_width : float
+    slice_width : float
+    """
+    wedge_dir: str
+    inside_bounds: BoxBounds
+    outside_bounds: BoxBounds
+    expected_width: float
+    inside_wedge_width: float
+    outside_wedge_width: float
+    slice_width: float
+
+
+@dataclass
+class PhantomWidthResult:
+    """
+    The result of `phantom_width`.
+
+    Attributes
+    ----------
+    lines : dict[str, LineEnds]
+        The lines across the phantom keyed by clock positions, e.g. "12_6".
+    widths : dict[str, float]
+        The width along each line, keyed as `lines`.
+    average_width : float
+    spoke_widths : list[float]
+        The widths along the equally spaced spokes, nan where no edges are found.
+    """
+    lines: dict[str, LineEnds]
+    widths: dict[str, float]
+    average_width: float
+    spoke_widths: list[float] = field(default_factory=list)
+
+
+@dataclass
+class ResolutionResult:
+    """
+    The result of `resolution`.
+
+    Attributes
+    ----------
+    phase_dir : str
+    phase_pix : float
+    freq_pix : float
+    bounds : dict[str, BoxBounds]
+        The insert ROIs, keyed as `kernels.resolution.insert_rois`.
+    inserts : dict[str, InsertResult]
+        The result of each insert, keyed as `bounds`.
+    resolved : dict[str, bool]
+        If each insert is resolved, keyed by direction and size e.g. "phase_2".
+    modulation : dict[str, float]
+        The modulation depth of each insert, keyed as `resolved`.
+    """
+    phase_dir: str
+    phase_pix: float
+    freq_pix: float
+    bounds: dict[str, BoxBounds]
+    inserts: "dict[str, InsertResult]"
+    resolved: dict[str, bool]
+    modulation: dict[str, float]
+
+
+@dataclass
+class MTFResult:
+    """
+    The result of `mtf`.
+
+    Attributes
+    ----------
+    phase_dir : str
+    bounds : dict[str, BoxBounds]
+        The edge ROIs, keyed as `kernels.mtf.mtf_rois`.
+    edges : dict[str, EdgeMTF]
+        The MTF from each edge, keyed as `bounds`.
+    mtf50 : dict[str, float]
+        The frequency in cycles per mm the MTF falls to 50%,
+        keyed by encode direction, "phase" or "freq".
+    mtf10 : dict[str, float]
+        The frequency in cycles per mm the MTF falls to 10%, keyed as `mtf50`.
+    """
+    phase_dir: str
+    bounds: dict[str, BoxBounds]
+    edges: "dict[str, EdgeMTF]"
+    mtf50: dict[str, float]
+    mtf10: dict[str, float]
+
+
+@dataclass
+class TO2AResult:
+    """
+    The result of `analyse`.
+
+    Attributes
+    ----------
+    context : TO2AContext
+    slice_width : SliceWidthResult
+    phantom_width : PhantomWidthResult
+    resolution : ResolutionResult
+    mtf : MTFResult
+    """
+    context: "TO2AContext"
+    slice_width: SliceWidthResult
+    phantom_width: PhantomWidthResult
+    resolution: ResolutionResult
+    mtf: MTFResult
+
+
+def detect_context(image_array: "np.ndarray",
+                   pixel_size: PixelSize,
+                   sensitivity: float = 3,
+                   top_perc: float = 95,
+                   iterations: int = 2,
+                   cull_perc: float = 80,
+                   rotation: bool = True,
+                   shapes: list[str] | None = None) -> "TO2AContext":
+    """
+    Finds the TO2A context of a 2D image array in the same way as the auto mode,
+    see `kernels.context.detect_context`.
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from pumpia_to2a.kernels.context import detect_context as _detect_context
+    return _detect_context(image_array,
+                           pixel_size,
+                           sensitivity,
+                           top_perc,
+                           iterations,
+                           cull_perc,
+                           rotation,
+                           shapes)
+
+
+def slice_width(image_array: "np.ndarray",
+                context: "TO2AContext",
+                pixel_size: PixelSize,
+                expected_width: float | None = None,
+                tan_theta: float = 0.25,
+                max_perc: float = 50,
+                warm_start_key: Hashable | None = None) -> SliceWidthResult:
+    """
+    Calculates the slice width from the wedges of a 2D image array.
+
+    Parameters
+    ----------
+    image_array : np.ndarray
+    context : TO2AContext
+    pixel_size : PixelSize
+    expected_width : float or None, optional
+        The expected slice width used to start the fits,
+        the slice thickness of `pixel_size` if None (default is None).
+    tan_theta : float, optional
+        The tangent of the wedge angle (default is 0.25).
+    max_perc : float, optional
+        The percent of the maximum the width is measured at (default is 50).
+    warm_start_key : Hashable or None, optional
+        If given the fits are started from the last fits with the same key,
+        see `kernels.slice_width.fit_key` (default is None).
+    """
+    # pylint: disable=import-outside-toplevel
+    from pumpia_to2a.kernels import slice_width as sw
+    from pumpia_to2a.kernels.profiles import box_profile
+
+    if expected_width is None:
+        expected_width = pixel_size[0]
+    wedge_dir, inside_bounds, outside_bounds = sw.wedge_rois(context, pixel_size)
+    if wedge_dir == "Vertical":
+        pix_size = pixel_size[1]
+    else:
+        pix_size = pixel_size[2]
+    inside_width, outside_width, width = sw.slice_widths(
+        box_profile(image_array, inside_bounds, wedge_dir, context.rotation, pixel_size),
+        box_profile(image_array, outside_bounds, wedge_dir, context.rotation, pixel_size),
+        expected_width,
+        pix_size,
+        tan_theta,
+        max_perc,
+        warm_start_key)
+    return SliceWidthResult(wedge_dir,
+                            inside_bounds,
+                            outside_bounds,
+                            expected_width,
+                            inside_width,
+                            outside_width,
+                            width)
+
+
+def phantom_width(image_array: "np.ndarray",
+                  context: "TO2AContext",
+                  pixel_size: PixelSize,
+                  max_perc: float = 20,
+                  num_spokes: int | None = None,
+                  include: dict[str, bool] | None = None) -> PhantomWidthResult:
+    """
+    Measures the width of the phantom along the 6 lines and the equally spaced spokes.
+
+    Parameters
+    ----------
+    image_array : np.ndarray
+    context : TO2AContext
+    pixel_size : PixelSize
+    max_perc : float, optional
+        The percent of the maximum the width is measured at (default is 20).
+    num_spokes : int or None, optional
+        The number of spokes, `kernels.phantom_width.DEFAULT_NUM_SPOKES` if None,
+        no spokes are measured if 0 (default is None).
+    include : dict[str, bool] or None, optional
+        The lines included in the average, all lines if None (default is None).
+    """
+    # pylint: disable=import-outside-toplevel
+    from pumpia_to2a.kernels import phantom_width as pw
+    from pumpia_to2a.kernels.profiles import line_profile
+
+    if num_spokes is None:
+        num_spokes = pw.DEFAULT_NUM_SPOKES
+    lines = pw.spoke_lines(context, pixel_size)
+    widths = {name: pw.spoke_width(line_profile(image_array, ends),
+                                   pw.spoke_unit_length(name, pixel_size, context.rotation),
+                                   max_perc)
+              for name, ends in lines.items()}
+
+    spoke_widths: list[float] = []
+    if num_spokes > 0:
+        spoke_widths = [float(width) for width in pw.dense_widths(image_array,
+                                                                  context,
+                                                                  pixel_size,
+                                                                  num_spokes,
+                                                                  max_perc)[1]]
+    return PhantomWidthResult(lines, widths, pw.average_width(widths, include), spoke_widths)
+
+
+def resolution(image_array: "np.ndarray",
+               context: "TO2AContext",
+               pixel_size: PixelSize,
+               phase_dir: str = "ROW",
+               max_perc: float = 50) -> ResolutionResult:
+    """
+    Analyses the resolution inserts.
+
+    Parameters
+    ----------
+    image_array : np.ndarray
+    context : TO2AContext
+    pixel_size : PixelSize
+    phase_dir : str, optional
+        The in-plane phase encoding direction, "ROW" or "COL" (default is "ROW").
+    max_perc : float, optional
+        The percent of the maximum troughs are counted below (default is 50).
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from pumpia_to2a.kernels import resolution as res
+
+    bounds = res.insert_rois(context, pixel_size)
+    inserts = res.analyse_inserts(res.insert_profiles(image_array,
+                                                      bounds,
+                                                      context.rotation,
+                                                      pixel_size),
+                                  max_perc)
+
+    if phase_dir == "ROW":
+        phase_pix, freq_pix = pixel_size[1], pixel_size[2]
+    else:
+        phase_pix, freq_pix = pixel_size[2], pixel_size[1]
+
+    directions = res.direction_inserts(phase_dir)
+    return ResolutionResult(phase_dir,
+                            phase_pix,
+                            freq_pix,
+                            bounds,
+                            inserts,
+                            {key: inserts[name].resolved for key, name in directions.items()},
+                            {key: inserts[name].modulation for key, name in directions.items()})
+
+
+def mtf(image_array: "np.ndarray",
+        context: "TO2AContext",
+        pixel_size: PixelSize,
+        phase_dir: str = "ROW") -> MTFResult:
+    """
+    Measures the MTF from the edges of the MTF block in both encode directions.
+
+    Parameters
+    ----------
+    image_array : np.ndarray
+    context : TO2AContext
+    pixel_size : PixelSize
+    phase_dir : str, optional
+        The in-plane phase encoding direction, "ROW" or "COL" (default is "ROW").
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from pumpia_to2a.kernels import mtf as mt
+
+    bounds = mt.mtf_rois(context, pixel_size)
+    edges = {name: mt.box_mtf(image_array, box, name.capitalize(), pixel_size)  # type: ignore
+             for name, box in bounds.items()}
+    directions = mt.direction_edges(phase_dir)
+    return MTFResult(phase_dir,
+                     bounds,
+                     edges,
+                     {key: edges[name].mtf50 for key, name in directions.items()},
+                     {key: edges[name].mtf10 for key, name in directions.items()})
+
+
+def analyse(image_array: "np.ndarray",
+            pixel_size: PixelSize,
+            phase_dir: str = "ROW",
+            context: "TO2AContext | None" = None,
+            warm_start_key: Hashable | None = None) -> TO2AResult:
+    """
+    Runs the context detection, if `context` is not given,
+    and the slice width, phantom width, resolution and MTF analyses with the default settings.
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from pumpia_to2a.instrumentation import profiler
+
+    if context is None:
+        with profiler.span("get_context"):
+            context = detect_context(image_array, pixel_size)
+    return TO2AResult(context,
+                      slice_width(image_array, context, pixel_size, warm_start_key=warm_start_key),
+                      phantom_width(image_array, context, pixel_size),
+                      resolution(image_array, context, pixel_size, phase_dir),
+                      mtf(image_array, context, pixel_size, phase_dir))
+
+
+def to_record(value: Any) -> Any:
+    """
+    Returns a result as JSON serialisable values, dataclasses become dicts,
+    tuples lists and nan None.
+    """
+    # pylint: disable=import-outside-toplevel
+    from pumpia_to2a.kernels.context import TO2AContext
+    from pumpia_to2a.context_cache import context_to_record
+
+    if isinstance(value, TO2AContext):
+        return context_to_record(value)
+    if hasattr(value, "__dataclass_fields__"):
+        return {name: to_record(getattr(value, name)) for name in value.__dataclass_fields__}
+    if isinstance(value, dict):
+        return {key: to_record(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_record(item) for item in value]
+    if isinstance(value, float) and value != value:
+        return None
+    if hasattr(value, "item"):
+        # numpy scalars
+        return to_record(value.item())
+    return value
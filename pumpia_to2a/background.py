@@ -0,0 +1,223 @@
+"""
+Running analysis stages on a worker thread.
+
+Work is split so nothing touching tkinter runs on the worker:
+a job is prepared on the main thread, reading the inputs and ROIs it needs,
+its work function runs on the worker and returns a function applying the results,
+which is called back on the main thread.
+Tasks report their progress and can be cancelled between stages.
+Independent jobs can be run together on a thread pool with `run_jobs`.
+No tkinter is imported.
+"""
+import threading
+import traceback
+from concurrent.futures import Future, Executor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections.abc import Callable
+from typing import Any
+
+# function run on the main thread to apply the results of a job
+ApplyFunction = Callable[[], None]
+# function run on the worker thread, returning the function applying its results
+JobFunction = Callable[[], ApplyFunction]
+# seconds between checks for cancelling while waiting for jobs running together
+CHECK_INTERVAL = 0.05
+
+
+class Cancelled(Exception):
+    """
+    Raised on the worker thread when a task is cancelled.
+    """
+
+
+class BackgroundTask:
+    """
+    A task running on the worker thread of a `BackgroundRunner`.
+
+    Attributes
+    ----------
+    name : str
+    future : Future
+        The future of the task, its result is the value returned by the work function
+        or its exception `Cancelled` if the task was cancelled.
+    fraction : float
+        The fraction of the task completed, between 0 and 1.
+    message : str
+        A description of the current stage.
+
+    Methods
+    -------
+    cancel()
+    check()
+    report(fraction: float, message: str = "")
+    progress() -> tuple[float, str]
+    """
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self.future: Future = Future()
+        self.fraction: float = 0
+        self.message: str = ""
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        Whether the task has been cancelled.
+        """
+        return self._cancel_event.is_set()
+
+    @property
+    def done(self) -> bool:
+        """
+        Whether the task has finished, been cancelled or raised an error.
+        """
+        return self.future.done()
+
+    def cancel(self) -> None:
+        """
+        Cancels the task, it stops at the next call to `check`.
+        """
+        self._cancel_event.set()
+
+    def check(self) -> None:
+        """
+        Raises `Cancelled` if the task has been cancelled, called by the work between stages.
+        """
+        if self._cancel_event.is_set():
+            raise Cancelled(self.name)
+
+    def report(self, fraction: float, message: str = "") -> None:
+        """
+        Sets the progress of the task and checks if it has been cancelled.
+        """
+        with self._lock:
+            self.fraction = min(max(fraction, 0), 1)
+            self.message = message
+        self.check()
+
+    def progress(self) -> tuple[float, str]:
+        """
+        Returns the (fraction, message) last reported.
+        """
+        with self._lock:
+            return self.fraction, self.message
+
+
+class BackgroundRunner:
+    """
+    Runs one task at a time on a worker thread,
+    submitting a task cancels the task already running.
+
+    Methods
+    -------
+    submit(name: str, work: Callable[[BackgroundTask], Any]) -> BackgroundTask
+    cancel()
+    shutdown()
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pumpia_to2a")
+        self.task: BackgroundTask | None = None
+
+    @property
+    def busy(self) -> bool:
+        """
+        Whether a task is running or waiting to run.
+        """
+        return self.task is not None and not self.task.done
+
+    def submit(self, name: str, work: Callable[[BackgroundTask], Any]) -> BackgroundTask:
+        """
+        Runs `work` with its task on the worker thread, cancelling any running task.
+        """
+        self.cancel()
+        task = BackgroundTask(name)
+
+        def run():
+            try:
+                task.check()
+                result = work(task)
+            # pylint: disable-next=broad-exception-caught
+            except Exception as exc:
+                task.future.set_exception(exc)
+            else:
+                task.future.set_result(result)
+
+        task.future.set_running_or_notify_cancel()
+        self.task = task
+        self._executor.submit(run)
+        return task
+
+    def cancel(self) -> None:
+        """
+        Cancels the running task, if there is one.
+        """
+        if self.task is not None and not self.task.done:
+            self.task.cancel()
+
+    def shutdown(self) -> None:
+        """
+        Cancels the running task and stops the worker thread.
+        """
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_jobs(jobs: list[tuple[str, JobFunction]],
+             task: BackgroundTask | None = None,
+             executor: Executor | None = None) -> list[ApplyFunction | Exception]:
+    """
+    Runs jobs, returning the function applying the results of each job
+    or the error it raised, in the order of `jobs`.
+
+    Parameters
+    ----------
+    jobs : list[tuple[str, JobFunction]]
+        The name shown in the progress of each job and the job.
+    task : BackgroundTask or None, optional
+        The task the jobs are run in, reporting the progress and checking for cancelling
+        as each job starts or finishes (default is None).
+    executor : Executor or None, optional
+        If given the jobs are run together on it, otherwise one after another (default is None).
+        Jobs not started are cancelled if the task is cancelled,
+        jobs already running finish and their results are discarded.
+
+    Raises
+    ------
+    Cancelled
+        If the task is cancelled.
+    """
+    results: list[ApplyFunction | Exception] = []
+
+    def run(job: JobFunction) -> ApplyFunction | Exception:
+        try:
+            return job()
+        except Cancelled:
+            raise
+        # pylint: disable-next=broad-exception-caught
+        except Exception as exc:
+            traceback.print_exc()
+            return exc
+
+    if executor is None:
+        for index, (name, job) in enumerate(jobs):
+            if task is not None:
+                task.report(index / len(jobs), name)
+            results.append(run(job))
+        return results
+
+    futures = [executor.submit(run, job) for _, job in jobs]
+    pending = set(futures)
+    try:
+        while pending:
+            if task is not None:
+                running = ", ".join(name for (name, _), future in zip(jobs, futures)
+                                    if future in pending)
+                task.report(1 - len(pending) / len(jobs), running)
+            _, pending = wait(pending, timeout=CHECK_INTERVAL, return_when=FIRST_COMPLETED)
+    except Cancelled:
+        for future in pending:
+            future.cancel()
+        raise
+    return [future.result() for future in futures]
@@ -0,0 +1,730 @@
+"""
+Headless batch analysis of TO2A series.
+
+Finds series in a folder tree and runs the context detection and the
+slice width, phantom width, resolution and MTF analyses in a process pool,
+writing one JSON record per series.
+No tkinter is imported so this can be ran on machines without a display.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import traceback
+from pathlib import Path
+from dataclasses import dataclass, field, asdict
+from functools import partial
+from contextlib import nullcontext, ExitStack
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import (Executor,
+                                Future,
+                                ProcessPoolExecutor,
+                                as_completed,
+                                wait,
+                                FIRST_COMPLETED,
+                                ALL_COMPLETED)
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pydicom
+from pydicom.errors import InvalidDicomError
+
+from pumpia_to2a.instrumentation import profiler
+from pumpia_to2a.dicom_frames import read_header, read_frame, read_frames, num_frames, frame_item
+from pumpia_to2a.results_store import ResultsStore, default_store_path, dicom_tags
+from pumpia_to2a.kernels.context import TO2AContext, detect_context, screen_context
+from pumpia_to2a.context_cache import (ContextCache,
+                                       context_to_record,
+                                       context_from_record,
+                                       default_cache_dir,
+                                       detection_params)
+from pumpia_to2a.kernels.profiles import stack_box_profiles
+from pumpia_to2a.kernels import slice_width as sw
+from pumpia_to2a.shared_arrays import SharedArray, share_array, attach_array, release
+from pumpia_to2a import api
+
+# header elements used by the analysis, the only ones sent to workers with shared arrays
+WORKER_HEADER_KEYWORDS = ("InPlanePhaseEncodingDirection",
+                          "StationName",
+                          "ProtocolName",
+                          "SeriesDescription")
+
+
+@dataclass
+class SeriesFiles:
+    """
+    The files of a DICOM series found on disk.
+
+    Attributes
+    ----------
+    series_uid : str
+    description : str
+    files : list[Path]
+        Sorted by instance number.
+    """
+    series_uid: str
+    description: str
+    files: list[Path] = field(default_factory=list)
+
+
+def find_series(folder: Path, series_filter: str | None = None) -> list[SeriesFiles]:
+    """
+    Finds all MR DICOM image series under `folder`, series of other modalities are left out.
+    Only the headers are read, series of other objects are skipped when they are analysed,
+    see `kernels.context.screen_context`.
+
+    Parameters
+    ----------
+    folder : Path
+        The root folder to search.
+    series_filter : str or None, optional
+        Regular expression matched against the series description and protocol name,
+        if given only matching series are returned (default is None).
+
+    Returns
+    -------
+    list[SeriesFiles]
+    """
+    pattern = None if series_filter is None else re.compile(series_filter, re.IGNORECASE)
+    found: dict[str, SeriesFiles] = {}
+    instance_numbers: dict[Path, int] = {}
+
+    for path in sorted(Path(folder).rglob("*")):
+        if not path.is_file():
+            continue
+        try:
+            ds = pydicom.dcmread(path, stop_before_pixels=True)
+        except (InvalidDicomError, OSError):
+            continue
+        if "Rows" not in ds or "SeriesInstanceUID" not in ds:
+            continue
+        if str(ds.get("Modality", "MR")) != "MR":
+            continue
+
+        description = str(ds.get("SeriesDescription", ""))
+        if (pattern is not None
+            and pattern.search(description) is None
+                and pattern.search(str(ds.get("ProtocolName", ""))) is None):
+            continue
+
+        series_uid = str(ds.SeriesInstanceUID)
+        if series_uid not in found:
+            found[series_uid] = SeriesFiles(series_uid, description)
+        found[series_uid].files.append(path)
+        instance_numbers[path] = int(ds.get("InstanceNumber", 0) or 0)
+
+    for series in found.values():
+        series.files.sort(key=lambda x: instance_numbers[x])
+
+    return list(found.values())
+
+
+def pixel_size_of(ds: pydicom.Dataset, frame: int = 0) -> tuple[float, float, float]:
+    """
+    Returns the pixel size as (slice_thickness, row_spacing, column_spacing),
+    matching `Instance.pixel_size`.
+    """
+    source = ds
+    if "PixelSpacing" not in ds:
+        measures = frame_item(ds, "PixelMeasuresSequence", frame)
+        if measures is not None:
+            source = measures
+
+    pixel_spacing = source.get("PixelSpacing", None) or (1, 1)
+    slice_thickness = source.get("SliceThickness", None) or 1
+    return (float(slice_thickness), float(pixel_spacing[0]), float(pixel_spacing[1]))
+
+
+def load_slice(series: SeriesFiles) -> tuple[np.ndarray, tuple[float, float, float], pydicom.Dataset]:
+    """
+    Loads the middle slice of a series, as used by the collection modules.
+    Only the middle file or frame is read,
+    rescale slope and intercept are applied as in `Instance.array`.
+
+    Returns
+    -------
+    tuple[np.ndarray, tuple[float, float, float], pydicom.Dataset]
+        (2D image array, pixel size, header of the file)
+    """
+    frame = 0
+    if len(series.files) == 1:
+        path = series.files[0]
+        ds = read_header(path)
+        frame = num_frames(ds) // 2
+    else:
+        path = series.files[len(series.files) // 2]
+        ds = read_header(path)
+
+    return read_frame(path, frame, ds), pixel_size_of(ds, frame), ds
+
+
+def load_stack(series: SeriesFiles) -> np.ndarray:
+    """
+    Loads every slice of a series as a 3D array (slices, rows, columns).
+    Rescale slope and intercept are applied to each slice as in `Series.array`.
+    """
+    return np.concatenate([read_frames(path) for path in series.files])
+
+
+def analyse_slice(image_array: np.ndarray,
+                  pixel_size: tuple[float, float, float],
+                  phase_dir: str,
+                  context: TO2AContext | None = None,
+                  dataset: pydicom.Dataset | None = None) -> dict:
+    """
+    Runs the context detection, if `context` is not given,
+    and the slice width, phantom width, resolution and MTF analyses on a 2D image array
+    with the default module settings, see `api.analyse`.
+    If `dataset` is given the wedge fits are warm started from previous fits
+    for the same scanner and protocol.
+
+    Returns
+    -------
+    dict
+        JSON serialisable results keyed by module, with output names matching the modules,
+        the context and the ROI coordinates.
+    """
+    if context is None:
+        with profiler.span("get_context"):
+            context = detect_context(image_array, pixel_size)
+    wedge_dir = sw.wedge_rois(context, pixel_size)[0]
+    result = api.analyse(image_array,
+                         pixel_size,
+                         phase_dir,
+                         context,
+                         sw.fit_key(dataset, wedge_dir))
+    slice_width = result.slice_width
+    phantom_width = result.phantom_width
+    resolution = result.resolution
+    mtf = result.mtf
+
+    return {"context": context_to_record(result.context),
+            "rois": {"inside_wedge": slice_width.inside_bounds,
+                     "outside_wedge": slice_width.outside_bounds,
+                     **{"spoke_" + name: ends for name, ends in phantom_width.lines.items()},
+                     **resolution.bounds,
+                     **{"mtf_" + name: bounds for name, bounds in mtf.bounds.items()}},
+            "slice_width": {"wedge_dir": slice_width.wedge_dir,
+                            "expected_width": slice_width.expected_width,
+                            "inside_wedge_width": slice_width.inside_wedge_width,
+                            "outside_wedge_width": slice_width.outside_wedge_width,
+                            "slice_width": slice_width.slice_width},
+            "phantom_width": {**{"width_" + name: width
+                                 for name, width in phantom_width.widths.items()},
+                              "average_width": phantom_width.average_width,
+                              "spoke_widths": api.to_record(phantom_width.spoke_widths)},
+            "resolution": {"phase_dir": phase_dir,
+                           "phase_pix": resolution.phase_pix,
+                           "freq_pix": resolution.freq_pix,
+                           **resolution.resolved,
+                           **{key + "_modulation": modulation
+                              for key, modulation in resolution.modulation.items()},
+                           "inserts": {name: asdict(insert)
+                                       for name, insert in resolution.inserts.items()}},
+            # an MTF that does not fall to a level is nan, stored as None
+            "mtf": api.to_record({"phase_dir": phase_dir,
+                                  **{key + "_mtf50": value for key, value in mtf.mtf50.items()},
+                                  **{key + "_mtf10": value for key, value in mtf.mtf10.items()},
+                                  **{name + "_edge_angle": edge.angle
+                                     for name, edge in mtf.edges.items()},
+                                  **{name + "_edge_oversampled": edge.oversampled
+                                     for name, edge in mtf.edges.items()}})}
+
+
+def analyse_stack_slice_width(image_stack: np.ndarray,
+                              pixel_size: tuple[float, float, float],
+                              context: TO2AContext) -> dict:
+    """
+    Calculates the slice width of every slice of a 3D image array
+    using the wedge ROIs of `context`, fitting all slices together.
+
+    Returns
+    -------
+    dict
+        JSON serialisable per slice widths and their summary.
+    """
+    wedge_dir, inside_bounds, outside_bounds = sw.wedge_rois(context, pixel_size)
+    if wedge_dir == "Vertical":
+        pix_size = pixel_size[1]
+    else:
+        pix_size = pixel_size[2]
+    inside_profs = stack_box_profiles(image_stack,
+                                      inside_bounds,
+                                      wedge_dir,
+                                      context.rotation,
+                                      pixel_size)
+    outside_profs = stack_box_profiles(image_stack,
+                                       outside_bounds,
+                                       wedge_dir,
+                                       context.rotation,
+                                       pixel_size)
+    _, _, widths = sw.slice_widths_stack(inside_profs,
+                                         outside_profs,
+                                         pixel_size[0],
+                                         pix_size)
+    # nan is not valid JSON so failed fits are stored as None
+    return {"slice_widths": [None if np.isnan(width) else float(width) for width in widths],
+            **sw.width_summary(widths)}
+
+
+def cached_context(image_array: np.ndarray,
+                   pixel_size: tuple[float, float, float],
+                   sop_uid: str,
+                   cache: ContextCache) -> TO2AContext:
+    """
+    Returns the context for an image from `cache`,
+    finding it with the default settings and storing it if it is not cached.
+    """
+    key = cache.key(sop_uid, image_array, detection_params(3, 95, 2, 80))
+    context = cache.get(key)
+    if context is None:
+        # the caller times the cache look up as "get_context", this is only the detection
+        with profiler.span("context.detect"):
+            context = detect_context(image_array, pixel_size)
+        cache.put(key, context)
+    return context
+
+
+def analyse_series(series: SeriesFiles,
+                   cache_dir: Path | None = None,
+                   all_slices: bool = False) -> dict:
+    """
+    Analyses the middle slice of a series.
+    Any error is caught and stored in the "error" field of the returned record.
+
+    Parameters
+    ----------
+    series : SeriesFiles
+    cache_dir : Path or None, optional
+        The folder of the context cache, the cache is not used if None (default is None).
+    all_slices : bool, optional
+        Whether to also calculate the slice width of every slice,
+        stored in the "slice_width_slices" field (default is False).
+    """
+    record = series_record(series)
+    with profiler.span("batch.analyse_series"):
+        _analyse_series(series, record, cache_dir, all_slices)
+    if profiler.enabled and profiler.records:
+        record["timings"] = profiler.records[-1].to_dict()
+    return record
+
+
+def _analyse_series(series: SeriesFiles,
+                    record: dict,
+                    cache_dir: Path | None,
+                    all_slices: bool) -> None:
+    """
+    Adds the results of `analyse_series` to `record`.
+    """
+    try:
+        with profiler.span("decode"):
+            image_array, pixel_size, ds = load_slice(series)
+        record.update(header_record(ds, pixel_size))
+        _analyse_image(record,
+                       image_array,
+                       pixel_size,
+                       ds,
+                       cache_dir,
+                       partial(load_stack, series) if all_slices else None)
+    # pylint: disable-next=broad-exception-caught
+    except Exception as exc:
+        record["error"] = f"{type(exc).__name__}: {exc}"
+        record["traceback"] = traceback.format_exc()
+
+
+def series_record(series: SeriesFiles) -> dict:
+    """
+    Returns the fields of a record describing the series analysed.
+    """
+    return {"series_uid": series.series_uid,
+            "series_description": series.description,
+            "num_files": len(series.files),
+            "skipped": None}
+
+
+def record_status(record: dict) -> str:
+    """
+    Returns the status of a record shown when it is finished,
+    "OK", why the series was skipped or the error.
+    """
+    if record["error"] is not None:
+        return record["error"]
+    if record.get("skipped") is not None:
+        return "skipped, " + record["skipped"]
+    return "OK"
+
+
+def header_record(ds: pydicom.Dataset, pixel_size: tuple[float, float, float]) -> dict:
+    """
+    Returns the fields of a record taken from the header of the file analysed.
+    """
+    return {"file": str(getattr(ds, "filename", None) or ""),
+            "sop_instance_uid": str(ds.get("SOPInstanceUID", "")),
+            "station_name": str(ds.get("StationName", "")),
+            "study_date": str(ds.get("StudyDate", "")),
+            "pixel_size": list(pixel_size),
+            "tags": dicom_tags(ds)}
+
+
+def _analyse_image(record: dict,
+                   image_array: np.ndarray,
+                   pixel_size: tuple[float, float, float],
+                   ds: pydicom.Dataset | None,
+                   cache_dir: Path | None,
+                   stack: Callable[[], np.ndarray] | None) -> None:
+    """
+    Adds the results of analysing a loaded image to `record`, which has the `header_record` fields.
+    `stack` returns every slice of the series if the slice width of every slice is wanted.
+    If no context is found, or the image does not look like a TO2A phantom,
+    the reason is stored in the "skipped" field and the image is not analysed.
+    """
+    try:
+        with profiler.span("get_context"):
+            if cache_dir is None:
+                context = detect_context(image_array, pixel_size)
+            else:
+                context = cached_context(image_array,
+                                         pixel_size,
+                                         record["sop_instance_uid"],
+                                         ContextCache(cache_dir))
+    except (ValueError, RuntimeError) as exc:
+        record["skipped"] = f"no phantom found ({exc})"
+    else:
+        record["skipped"] = screen_context(image_array, context, pixel_size)
+    if record["skipped"] is not None:
+        record["error"] = None
+        return
+
+    phase_dir = "" if ds is None else str(ds.get("InPlanePhaseEncodingDirection", ""))
+    record.update(analyse_slice(image_array, pixel_size, phase_dir, context, ds))
+    if stack is not None:
+        with profiler.span("decode"):
+            image_stack = stack()
+        record["slice_width_slices"] = analyse_stack_slice_width(
+            image_stack,
+            pixel_size,
+            context_from_record(record["context"]))
+    record["error"] = None
+
+
+@dataclass
+class ImageJob:
+    """
+    An image already loaded to be analysed by `analyse_arrays`.
+
+    Attributes
+    ----------
+    record : dict
+        The fields of the result record known before the analysis,
+        e.g. from `series_record` and `header_record`.
+    image_array : np.ndarray
+        The 2D image analysed.
+    pixel_size : tuple[float, float, float]
+    header : pydicom.Dataset or None
+        The header of the image, only the `WORKER_HEADER_KEYWORDS` elements are sent to the worker.
+    image_stack : np.ndarray or None
+        Every slice of the series if the slice width of every slice is wanted.
+    """
+    record: dict
+    image_array: np.ndarray
+    pixel_size: tuple[float, float, float]
+    header: pydicom.Dataset | None = None
+    image_stack: np.ndarray | None = None
+
+
+def worker_header(ds: pydicom.Dataset | None) -> pydicom.Dataset | None:
+    """
+    Returns a dataset with only the `WORKER_HEADER_KEYWORDS` elements of `ds`.
+    """
+    if ds is None:
+        return None
+    header = pydicom.Dataset()
+    for keyword in WORKER_HEADER_KEYWORDS:
+        if keyword in ds:
+            header[keyword] = ds[keyword]
+    return header
+
+
+def analyse_shared(record: dict,
+                   image: SharedArray,
+                   pixel_size: tuple[float, float, float],
+                   header: pydicom.Dataset | None,
+                   cache_dir: Path | None = None,
+                   stack: SharedArray | None = None) -> dict:
+    """
+    Analyses an image in shared memory, see `analyse_arrays`, run in the worker processes.
+    Any error is caught and stored in the "error" field of the returned record.
+    """
+    record = dict(record)
+    with profiler.span("batch.analyse_series"):
+        try:
+            with ExitStack() as attached:
+                image_array = attached.enter_context(attach_array(image))
+                load_stack = None
+                if stack is not None:
+                    load_stack = partial(attached.enter_context, attach_array(stack))
+                _analyse_image(record, image_array, pixel_size, header, cache_dir, load_stack)
+        # pylint: disable-next=broad-exception-caught
+        except Exception as exc:
+            record["error"] = f"{type(exc).__name__}: {exc}"
+            record["traceback"] = traceback.format_exc()
+    if profiler.enabled and profiler.records:
+        record["timings"] = profiler.records[-1].to_dict()
+    return record
+
+
+def submit_shared(executor: Executor,
+                  job: ImageJob,
+                  cache_dir: Path | None = None) -> tuple[Future, list[SharedMemory]]:
+    """
+    Copies the images of `job` into shared memory and submits their analysis to `executor`.
+
+    Returns
+    -------
+    tuple[Future, list[SharedMemory]]
+        The future of the record and the blocks holding the images,
+        which must be passed to `shared_arrays.release` once the future is done.
+    """
+    blocks: list[SharedMemory] = []
+    try:
+        block, image = share_array(job.image_array)
+        blocks.append(block)
+        stack = None
+        if job.image_stack is not None:
+            block, stack = share_array(job.image_stack)
+            blocks.append(block)
+        future = executor.submit(analyse_shared,
+                                 job.record,
+                                 image,
+                                 job.pixel_size,
+                                 worker_header(job.header),
+                                 cache_dir,
+                                 stack)
+    except BaseException:
+        for block in blocks:
+            release(block)
+        raise
+    return future, blocks
+
+
+def analyse_arrays(jobs: Iterable[ImageJob],
+                   executor: Executor,
+                   cache_dir: Path | None = None,
+                   max_pending: int | None = None) -> Iterator[dict]:
+    """
+    Analyses loaded images in a process pool, yielding each record as it finishes.
+    Each image is copied once into shared memory, see `shared_arrays`,
+    and the workers use it in place so only the records are sent between processes.
+
+    Parameters
+    ----------
+    jobs : Iterable[ImageJob]
+        Only taken from as images finish, so the images can be loaded as they are needed.
+    executor : Executor
+        A process pool, e.g. from `run_batch`.
+    cache_dir : Path or None, optional
+        The folder of the context cache, the cache is not used if None (default is None).
+    max_pending : int or None, optional
+        The most images shared at once, keeping the memory used flat,
+        twice the number of CPUs if None (default is None).
+    """
+    if max_pending is None:
+        max_pending = 2 * (os.cpu_count() or 1)
+    pending: dict[Future, list[SharedMemory]] = {}
+
+    def finished(return_when: str) -> Iterator[dict]:
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            for block in pending.pop(future):
+                release(block)
+            yield future.result()
+
+    try:
+        for job in jobs:
+            while len(pending) >= max_pending:
+                yield from finished(FIRST_COMPLETED)
+            future, blocks = submit_shared(executor, job, cache_dir)
+            pending[future] = blocks
+            # the pixels are now held in shared memory
+            del job
+        while pending:
+            yield from finished(ALL_COMPLETED)
+    finally:
+        for future in pending:
+            future.cancel()
+        wait(pending)
+        for blocks in pending.values():
+            for block in blocks:
+                release(block)
+
+
+def _load_jobs(series_list: list[SeriesFiles],
+               all_slices: bool,
+               failed: list[dict]) -> Iterator[ImageJob]:
+    """
+    Loads each series as an `ImageJob`, adding a record to `failed` for any that can not be loaded.
+    """
+    for series in series_list:
+        record = series_record(series)
+        try:
+            image_array, pixel_size, ds = load_slice(series)
+            record.update(header_record(ds, pixel_size))
+            image_stack = load_stack(series) if all_slices else None
+        # pylint: disable-next=broad-exception-caught
+        except Exception as exc:
+            record["error"] = f"{type(exc).__name__}: {exc}"
+            record["traceback"] = traceback.format_exc()
+            failed.append(record)
+            continue
+        yield ImageJob(record, image_array, pixel_size, ds, image_stack)
+
+
+def _shared_records(series_list: list[SeriesFiles],
+                    executor: Executor,
+                    cache_dir: Path | None,
+                    all_slices: bool,
+                    max_pending: int | None) -> Iterator[dict]:
+    """
+    Yields the record of each series, loaded in this process and analysed with `analyse_arrays`.
+    """
+    failed: list[dict] = []
+    for record in analyse_arrays(_load_jobs(series_list, all_slices, failed),
+                                 executor,
+                                 cache_dir,
+                                 max_pending):
+        yield from failed
+        failed.clear()
+        yield record
+    yield from failed
+
+
+def _init_worker(record_timings: bool) -> None:
+    """
+    Sets up the profiler of a worker process,
+    records are returned with the results so workers do not write to the timings file.
+    """
+    profiler.enabled = record_timings
+    profiler.log_path = None
+
+
+def run_batch(folder: Path,
+              output: Path,
+              workers: int | None = None,
+              series_filter: str | None = None,
+              cache_dir: Path | None = None,
+              all_slices: bool = False,
+              timings: Path | None = None,
+              store: Path | None = None,
+              shared: bool = False) -> int:
+    """
+    Analyses every series under `folder` in a process pool and
+    writes one JSON record per line to `output`.
+
+    Parameters
+    ----------
+    folder : Path
+        The root folder to search.
+    output : Path
+        The JSON lines file to write.
+    workers : int or None, optional
+        Number of worker processes, defaults to the number of CPUs (default is None).
+    series_filter : str or None, optional
+        Regular expression to select series, see `find_series` (default is None).
+    cache_dir : Path or None, optional
+        The folder of the context cache, the cache is not used if None (default is None).
+    all_slices : bool, optional
+        Whether to also calculate the slice width of every slice (default is False).
+    timings : Path or None, optional
+        JSON lines file the stage timings of each series are written to,
+        timings are not recorded if None (default is None).
+    store : Path or None, optional
+        The results database each record is added to, see `results_store`,
+        records are not stored if None (default is None).
+    shared : bool, optional
+        Whether to load the images in this process and pass them to the workers
+        in shared memory, see `analyse_arrays`,
+        otherwise each worker reads the files of its series (default is False).
+
+    Returns
+    -------
+    int
+        The number of series that failed, series skipped as not TO2A are not counted.
+    """
+    series_list = find_series(folder, series_filter)
+    analyse = partial(analyse_series, cache_dir=cache_dir, all_slices=all_slices)
+    failures = 0
+    with (open(output, "w", encoding="utf-8") as file,
+          (nullcontext() if timings is None
+           else open(timings, "a", encoding="utf-8")) as timings_file,
+          (nullcontext() if store is None else ResultsStore(store)) as results_store,
+          ProcessPoolExecutor(max_workers=workers,
+                              initializer=_init_worker,
+                              initargs=(timings is not None,)) as executor):
+        if shared:
+            records = _shared_records(series_list,
+                                      executor,
+                                      cache_dir,
+                                      all_slices,
+                                      None if workers is None else 2 * workers)
+        else:
+            futures = [executor.submit(analyse, series) for series in series_list]
+            records = (future.result() for future in as_completed(futures))
+        for record in records:
+            if record["error"] is not None:
+                failures += 1
+            run_timings = record.pop("timings", None)
+            if timings_file is not None and run_timings is not None:
+                run_timings["series_uid"] = record["series_uid"]
+                timings_file.write(json.dumps(run_timings) + "\n")
+                timings_file.flush()
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+            # skipped series are reported but are not results of a TO2A phantom
+            if results_store is not None and record.get("skipped") is None:
+                results_store.add_batch_record(record)
+            print(f"{record['series_description']} ({record['series_uid']}): "
+                  + record_status(record),
+                  file=sys.stderr)
+    return failures
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Command line entry point for the batch runner.
+    """
+    parser = argparse.ArgumentParser(description="Headless batch analysis of TO2A series.")
+    parser.add_argument("folder", type=Path, help="folder to search for DICOM series")
+    parser.add_argument("-o", "--output", type=Path, default=Path("to2a_results.jsonl"),
+                        help="JSON lines file for the results (default: to2a_results.jsonl)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("-f", "--series-filter", default=None,
+                        help="regular expression matched against series description/protocol")
+    parser.add_argument("--cache-dir", type=Path, default=default_cache_dir(),
+                        help="folder of the context cache (default: user cache folder)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always find the context, ignoring the context cache")
+    parser.add_argument("--all-slices", action="store_true",
+                        help="also calculate the slice width of every slice of each series")
+    parser.add_argument("--timings", type=Path, default=None,
+                        help="JSON lines file to append the stage timings of each series to")
+    parser.add_argument("--store", type=Path, default=default_store_path(),
+                        help="results database to add each record to (default: user data folder)")
+    parser.add_argument("--no-store", action="store_true",
+                        help="do not add the results to the results database")
+    parser.add_argument("--shared-memory", action="store_true",
+                        help="load the images in the main process and share them with the workers")
+    args = parser.parse_args(argv)
+
+    cache_dir = None if args.no_cache else args.cache_dir
+    failures = run_batch(args.folder,
+                         args.output,
+                         args.workers,
+                         args.series_filter,
+                         cache_dir,
+                         args.all_slices,
+                         args.timings,
+                         None if args.no_store else args.store,
+                         args.shared_memory)
+    return 1 if failures else 0
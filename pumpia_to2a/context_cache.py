@@ -0,0 +1,234 @@
+"""
+Persistent on disk cache of TO2A contexts.
+
+Entries are keyed by the SOP instance UID, a hash of the pixel data
+and the parameters used to find the context,
+so a change to any of them gives a different key.
+The least recently used entries are removed once the cache holds more than `max_entries`.
+"""
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from pumpia_to2a.kernels.context import TO2AContext
+
+# increase when the context detection changes so old entries are not used
+CACHE_VERSION = 3
+DEFAULT_MAX_ENTRIES = 1000
+# fraction of `max_entries` kept when evicting, so a full cache is not evicted on every put
+EVICT_FRACTION = 0.9
+
+# entries counted in each cache folder by this process, shared by all `ContextCache`s
+_entry_counts: dict[Path, int] = {}
+_counts_lock = threading.Lock()
+
+
+def default_cache_dir() -> Path:
+    """
+    Returns the default folder for the context cache,
+    under the users cache folder.
+    """
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA")
+        if base is None:
+            base = str(Path.home() / "AppData" / "Local")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME")
+        if base is None:
+            base = str(Path.home() / ".cache")
+    return Path(base) / "pumpia_to2a" / "contexts"
+
+
+def pixel_hash(image_array: np.ndarray) -> str:
+    """
+    Returns a hash of the pixel data of an image array.
+    """
+    array = np.ascontiguousarray(image_array)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(array.dtype).encode())
+    digest.update(str(array.shape).encode())
+    digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def detection_params(sensitivity: float,
+                     top_perc: float,
+                     iterations: int,
+                     cull_perc: float,
+                     shapes: list[str] | None = None,
+                     rotation: bool = True) -> dict:
+    """
+    Returns the parameters used to find a context in the form used for cache keys,
+    so the same settings from the GUI and `detect_context` give the same key.
+    """
+    if shapes is None:
+        shapes = ["ellipse"]
+    return {"sensitivity": float(sensitivity),
+            "top_perc": float(top_perc),
+            "iterations": int(iterations),
+            "cull_perc": float(cull_perc),
+            "shapes": sorted(shapes),
+            "rotation": bool(rotation)}
+
+
+def context_to_record(context: TO2AContext) -> dict:
+    """
+    Returns a JSON serialisable record of a context.
+    """
+    return {"xmin": context.xmin,
+            "xmax": context.xmax,
+            "ymin": context.ymin,
+            "ymax": context.ymax,
+            "mtf_side": context.mtf_side,
+            "wedges_side": context.wedges_side,
+            "rotation": context.rotation}
+
+
+def context_from_record(record: dict) -> TO2AContext:
+    """
+    Creates a context from a record given by `context_to_record`.
+    """
+    return TO2AContext(record["xmin"],
+                       record["xmax"],
+                       record["ymin"],
+                       record["ymax"],
+                       record["wedges_side"],
+                       record["mtf_side"],
+                       record.get("rotation", 0))
+
+
+class ContextCache:
+    """
+    On disk least recently used cache of TO2A contexts.
+    The entries are counted once per folder by each process and the count kept as entries are added,
+    the folder is only listed again to evict entries once the count is above `max_entries`.
+
+    Parameters
+    ----------
+    folder : Path or None, optional
+        The folder to store the cache in, `default_cache_dir` is used if None (default is None).
+    max_entries : int, optional
+        The maximum number of entries kept (default is 1000).
+
+    Methods
+    -------
+    key(sop_uid: str, image_array: np.ndarray, params: dict) -> str
+        Returns the key for an image and detection parameters.
+    get(key: str) -> TO2AContext | None
+    put(key: str, context: TO2AContext)
+    clear()
+    """
+
+    def __init__(self, folder: Path | None = None, max_entries: int = DEFAULT_MAX_ENTRIES):
+        if folder is None:
+            folder = default_cache_dir()
+        self.folder: Path = Path(folder)
+        self.max_entries: int = max_entries
+
+    @staticmethod
+    def key(sop_uid: str, image_array: np.ndarray, params: dict) -> str:
+        """
+        Returns the key for an image and the parameters used to find its context,
+        `params` should be given by `detection_params`.
+        """
+        key_record = {"version": CACHE_VERSION,
+                      "sop_uid": sop_uid,
+                      "pixels": pixel_hash(image_array),
+                      "params": params}
+        key_str = json.dumps(key_record, sort_keys=True, default=str)
+        return hashlib.blake2b(key_str.encode(), digest_size=16).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.folder / (key + ".json")
+
+    def get(self, key: str) -> TO2AContext | None:
+        """
+        Returns the cached context for `key`, or None if it is not cached.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                record = json.load(file)
+            context = context_from_record(record)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        try:
+            # modification time is used as the last access time for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return context
+
+    def put(self, key: str, context: TO2AContext) -> None:
+        """
+        Stores a context, removing the least recently used entries if the cache is full.
+        Errors writing to the cache are ignored.
+        """
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            path = self._path(key)
+            is_new = not path.exists()
+            # a unique temporary file so threads and processes writing the same key do not clash
+            # pylint: disable-next=consider-using-with
+            file = tempfile.NamedTemporaryFile("w",
+                                               encoding="utf-8",
+                                               dir=self.folder,
+                                               prefix=key + ".",
+                                               suffix=".tmp",
+                                               delete=False)
+            try:
+                with file:
+                    json.dump(context_to_record(context), file)
+                os.replace(file.name, path)
+            finally:
+                # only left if writing or replacing failed
+                Path(file.name).unlink(missing_ok=True)
+            if is_new and self._count_entry() > self.max_entries:
+                self._evict()
+        except OSError:
+            pass
+
+    def _count_entry(self) -> int:
+        """
+        Adds a new entry to the count of entries in the folder and returns the count,
+        the folder is listed the first time it is counted.
+        """
+        with _counts_lock:
+            count = _entry_counts.get(self.folder)
+            if count is None:
+                # the new entry is already in the folder
+                count = sum(1 for _ in self.folder.glob("*.json"))
+            else:
+                count += 1
+            _entry_counts[self.folder] = count
+            return count
+
+    def _evict(self) -> None:
+        """
+        Removes the least recently used entries,
+        leaving `EVICT_FRACTION` of `max_entries` if there are more than `max_entries`.
+        """
+        entries = list(self.folder.glob("*.json"))
+        num_kept = len(entries)
+        if num_kept > self.max_entries:
+            num_kept = int(self.max_entries * EVICT_FRACTION)
+            entries.sort(key=lambda x: x.stat().st_mtime)
+            for path in entries[:len(entries) - num_kept]:
+                path.unlink(missing_ok=True)
+        with _counts_lock:
+            _entry_counts[self.folder] = num_kept
+
+    def clear(self) -> None:
+        """
+        Removes all entries from the cache.
+        """
+        for path in self.folder.glob("*.json"):
+            path.unlink(missing_ok=True)
+        with _counts_lock:
+            _entry_counts[self.folder] = 0
@@ -0,0 +1,153 @@
+"""
+Reading single frames of DICOM files without decoding the whole pixel data.
+
+Headers are read with the pixel data deferred so the slices needed can be chosen first.
+Uncompressed (native) pixel data is memory mapped and only the bytes of the frames used are read,
+compressed pixel data is decoded one frame at a time by `pydicom.pixels.pixel_array`.
+No tkinter is imported.
+"""
+from pathlib import Path
+
+import numpy as np
+import pydicom
+from pydicom.tag import Tag
+from pydicom.dataelem import RawDataElement
+from pydicom.uid import DeflatedExplicitVRLittleEndian
+from pydicom.pixels import pixel_array as decode_pixels
+
+PIXEL_DATA_TAG = Tag(0x7FE0, 0x0010)
+# elements larger than this in bytes are not read with the header
+DEFER_SIZE = 1024
+
+
+def read_header(path: Path) -> pydicom.Dataset:
+    """
+    Reads the dataset of a file without reading the pixel data,
+    which is kept as a deferred element recording its position in the file.
+    """
+    return pydicom.dcmread(path, defer_size=DEFER_SIZE)
+
+
+def num_frames(ds: pydicom.Dataset) -> int:
+    """
+    Returns the number of frames in a dataset, 1 if it is not multi-frame.
+    """
+    return int(ds.get("NumberOfFrames", 1) or 1)
+
+
+def frame_item(ds: pydicom.Dataset, sequence: str, frame: int) -> pydicom.Dataset | None:
+    """
+    Returns the item of a functional group sequence for a frame of an enhanced DICOM,
+    checking the per-frame groups before the shared groups.
+    """
+    for groups_name in ("PerFrameFunctionalGroupsSequence", "SharedFunctionalGroupsSequence"):
+        groups = ds.get(groups_name)
+        if groups is None:
+            continue
+        group = groups[frame] if groups_name.startswith("PerFrame") else groups[0]
+        if sequence in group:
+            return group[sequence][0]
+    return None
+
+
+def rescale(array: np.ndarray, ds: pydicom.Dataset, frame: int = 0) -> np.ndarray:
+    """
+    Returns `array` as floats with the rescale slope and intercept of the frame applied,
+    taken from the pixel value transformation functional group if not in the dataset.
+    """
+    array = np.astype(array, float)
+    source = ds
+    if "RescaleSlope" not in ds:
+        transform = frame_item(ds, "PixelValueTransformationSequence", frame)
+        if transform is not None:
+            source = transform
+
+    slope = source.get("RescaleSlope", None)
+    intercept = source.get("RescaleIntercept", None)
+    if slope is not None and intercept is not None:
+        array = array * float(slope) + float(intercept)
+    return array
+
+
+def _native_dtype(ds: pydicom.Dataset) -> np.dtype | None:
+    """
+    Returns the dtype of native pixel data that can be memory mapped,
+    None if it has to be decoded by pydicom.
+    """
+    transfer_syntax = ds.file_meta.get("TransferSyntaxUID", None)
+    if (transfer_syntax is None
+        or transfer_syntax.is_compressed
+        or transfer_syntax == DeflatedExplicitVRLittleEndian
+            or not transfer_syntax.is_little_endian):
+        return None
+
+    bits_allocated = int(ds.get("BitsAllocated", 0) or 0)
+    bits_stored = int(ds.get("BitsStored", bits_allocated) or bits_allocated)
+    signed = int(ds.get("PixelRepresentation", 0) or 0) == 1
+    if (bits_allocated not in (8, 16, 32)
+        or int(ds.get("SamplesPerPixel", 1) or 1) != 1
+            or (signed and bits_stored != bits_allocated)):
+        # signed values stored in fewer bits need their sign extended by pydicom
+        return None
+    return np.dtype(("<i" if signed else "<u") + str(bits_allocated // 8))
+
+
+def memmap_frames(path: Path, ds: pydicom.Dataset | None = None) -> np.ndarray | None:
+    """
+    Returns a read only memory map of the native pixel data of a file as (frames, rows, columns),
+    None if the pixel data is compressed or in a format that can not be mapped.
+    Only the pages of the frames indexed are read from disk.
+    `ds` is the header from `read_header` if already read.
+    """
+    if ds is None or PIXEL_DATA_TAG not in ds:
+        ds = read_header(path)
+    dtype = _native_dtype(ds)
+    if dtype is None or PIXEL_DATA_TAG not in ds:
+        return None
+
+    element = ds.get_item(PIXEL_DATA_TAG, keep_deferred=True)
+    if not isinstance(element, RawDataElement) or element.value_tell is None:
+        return None
+
+    shape = (num_frames(ds), int(ds.Rows), int(ds.Columns))
+    if element.length < np.prod(shape) * dtype.itemsize:
+        return None
+    return np.memmap(path, dtype=dtype, mode="r", offset=element.value_tell, shape=shape)
+
+
+def read_frames(path: Path,
+                frames: list[int] | None = None,
+                ds: pydicom.Dataset | None = None) -> np.ndarray:
+    """
+    Reads frames of a file as a float array (frames, rows, columns),
+    with the rescale slope and intercept of each frame applied as in `Instance.array`.
+
+    Parameters
+    ----------
+    path : Path
+    frames : list[int] or None, optional
+        The zero based indexes of the frames to read, all frames if None (default is None).
+    ds : pydicom.Dataset or None, optional
+        The header of the file if already read (default is None).
+    """
+    if ds is None:
+        ds = read_header(path)
+    if frames is None:
+        frames = list(range(num_frames(ds)))
+
+    mapped = memmap_frames(path, ds)
+    if mapped is not None:
+        raw = [mapped[frame] for frame in frames]
+    elif num_frames(ds) == 1:
+        raw = [decode_pixels(path)] * len(frames)
+    else:
+        raw = [decode_pixels(path, index=frame) for frame in frames]
+
+    return np.stack([rescale(array, ds, frame) for array, frame in zip(raw, frames)])
+
+
+def read_frame(path: Path, frame: int = 0, ds: pydicom.Dataset | None = None) -> np.ndarray:
+    """
+    Reads one frame of a file as a 2D float array, see `read_frames`.
+    """
+    return read_frames(path, [frame], ds)[0]
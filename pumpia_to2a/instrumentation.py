@@ -0,0 +1,318 @@
+"""
+Timing and memory instrumentation of the TO2A analysis.
+
+Stages are wrapped in spans with `profiler.span(name)` or the `timed(name)` decorator.
+When the profiler is enabled each span records its wall time and,
+if memory recording is on, the tracemalloc peak above the memory in use when it started.
+A span started outside any other span is a run,
+when it ends one record of the run and all spans within it is kept,
+appended to `log_path` as a JSON line if set, and passed to any listeners.
+When the profiler is disabled spans do nothing.
+Runs are recorded separately for each thread, so analysis on a worker thread
+does not mix with spans on the main thread.
+No tkinter is imported.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import tracemalloc
+import functools
+from pathlib import Path
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from collections.abc import Callable, Iterator, Iterable
+from dataclasses import dataclass, field, asdict
+
+import numpy as np
+
+# environment variable giving a JSON lines file, if set the profiler is enabled on import
+LOG_ENV_VAR = "PUMPIA_TO2A_TIMINGS"
+# number of run records kept in memory
+MAX_RECORDS = 1000
+
+
+@dataclass
+class Span:
+    """
+    A timed stage.
+
+    Attributes
+    ----------
+    name : str
+    depth : int
+        The number of spans this span is within.
+    start : float
+        Seconds from the start of the run.
+    duration : float
+        Wall time in seconds.
+    peak_bytes : int or None
+        Peak traced memory above the memory in use at the start, None if memory is not recorded.
+    """
+    name: str
+    depth: int
+    start: float
+    duration: float = 0
+    peak_bytes: int | None = None
+
+
+@dataclass
+class _RunState:
+    """
+    The run being recorded on a thread.
+    """
+    run: "RunRecord | None" = None
+    run_start: float = 0
+    depth: int = 0
+    # peak of the enclosing spans, kept as tracemalloc only has one peak
+    peaks: list[int] = field(default_factory=list)
+
+
+@dataclass
+class RunRecord:
+    """
+    The spans of one run.
+    """
+    run_id: str
+    name: str
+    started: str
+    duration: float = 0
+    peak_bytes: int | None = None
+    spans: list[Span] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        """
+        Returns a JSON serialisable dict of the record.
+        """
+        return asdict(self)
+
+
+class Profiler:
+    """
+    Records spans of the analysis.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Whether spans are recorded (default is False).
+    memory : bool, optional
+        Whether tracemalloc peaks are recorded, this slows down the analysis (default is False).
+    log_path : Path or None, optional
+        JSON lines file each run record is appended to (default is None).
+
+    Attributes
+    ----------
+    records : list[RunRecord]
+        The most recent `MAX_RECORDS` runs.
+
+    Methods
+    -------
+    span(name: str)
+        Context manager recording a span.
+    add_listener(listener: Callable[[RunRecord], None])
+    remove_listener(listener: Callable[[RunRecord], None])
+    clear()
+    """
+
+    def __init__(self,
+                 enabled: bool = False,
+                 memory: bool = False,
+                 log_path: Path | None = None):
+        self.enabled: bool = enabled
+        self.memory: bool = memory
+        self.log_path: Path | None = log_path
+        self.records: list[RunRecord] = []
+        self._listeners: list[Callable[[RunRecord], None]] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started_tracing: bool = False
+
+    def _state(self) -> _RunState:
+        """
+        Returns the run state of the current thread.
+        """
+        try:
+            return self._local.state
+        except AttributeError:
+            self._local.state = _RunState()
+            return self._local.state
+
+    def add_listener(self, listener: Callable[[RunRecord], None]) -> None:
+        """
+        Adds a function called with each run record when the run ends.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[RunRecord], None]) -> None:
+        """
+        Removes a listener added by `add_listener`.
+        """
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def clear(self) -> None:
+        """
+        Removes all records kept in memory.
+        """
+        self.records.clear()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """
+        Records the time, and memory if enabled, of the code within the context.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        state = self._state()
+        is_run = state.run is None
+        if is_run:
+            self._start_run(state, name)
+
+        record_memory = self.memory and tracemalloc.is_tracing()
+        start_memory = 0
+        if record_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if state.peaks:
+                state.peaks[-1] = max(state.peaks[-1], peak)
+            tracemalloc.reset_peak()
+            start_memory = current
+            state.peaks.append(current)
+
+        run = state.run
+        span = Span(name, state.depth, time.perf_counter() - state.run_start)
+        run.spans.append(span)  # type: ignore
+        state.depth += 1
+        try:
+            yield
+        finally:
+            state.depth -= 1
+            span.duration = time.perf_counter() - state.run_start - span.start
+            if record_memory:
+                peak = max(state.peaks.pop(), tracemalloc.get_traced_memory()[1])
+                span.peak_bytes = peak - start_memory
+                if state.peaks:
+                    state.peaks[-1] = max(state.peaks[-1], peak)
+            if is_run:
+                self._end_run(state, span)
+
+    def _start_run(self, state: _RunState, name: str) -> None:
+        state.run = RunRecord(uuid.uuid4().hex,
+                              name,
+                              datetime.now(timezone.utc).isoformat())
+        state.run_start = time.perf_counter()
+        state.depth = 0
+        state.peaks = []
+        with self._lock:
+            if self.memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+
+    def _end_run(self, state: _RunState, span: Span) -> None:
+        run = state.run
+        state.run = None
+        if run is None:
+            return
+        run.duration = span.duration
+        run.peak_bytes = span.peak_bytes
+        with self._lock:
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+            self.records.append(run)
+            if len(self.records) > MAX_RECORDS:
+                del self.records[0]
+
+        if self.log_path is not None:
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(run.to_dict()) + "\n")
+            except OSError as exc:
+                print(f"Could not write timings to {self.log_path}: {exc}", file=sys.stderr)
+
+        for listener in list(self._listeners):
+            listener(run)
+
+
+profiler = Profiler()
+if os.environ.get(LOG_ENV_VAR):
+    profiler.enabled = True
+    profiler.log_path = Path(os.environ[LOG_ENV_VAR])
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """
+    Decorator recording each call of the function as a span of `profiler`.
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with profiler.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def read_records(path: Path) -> list[dict]:
+    """
+    Reads the run records from a JSON lines file written by the profiler,
+    skipping lines that can not be read.
+    """
+    records: list[dict] = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def stage_percentiles(records: Iterable[RunRecord | dict],
+                      percentiles: tuple[float, ...] = (50, 95)) -> dict[str, dict[str, float]]:
+    """
+    Returns percentiles of the duration in seconds of each stage over `records`,
+    keyed by stage name then "p50", "p95" etc., with the number of spans as "count".
+    """
+    durations: dict[str, list[float]] = {}
+    for record in records:
+        if isinstance(record, RunRecord):
+            record = record.to_dict()
+        for span in record["spans"]:
+            durations.setdefault(span["name"], []).append(span["duration"])
+
+    stats: dict[str, dict[str, float]] = {}
+    for name, values in durations.items():
+        stats[name] = {f"p{percentile:g}": float(np.percentile(values, percentile))
+                       for percentile in percentiles}
+        stats[name]["count"] = len(values)
+    return stats
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Prints the p50 and p95 duration of each stage in JSON lines files written by the profiler.
+    """
+    import argparse  # pylint: disable=import-outside-toplevel
+    parser = argparse.ArgumentParser(description="Summarise TO2A timing records.")
+    parser.add_argument("files", type=Path, nargs="+", help="JSON lines timing files")
+    args = parser.parse_args(argv)
+
+    records: list[dict] = []
+    for path in args.files:
+        records.extend(read_records(path))
+    stats = stage_percentiles(records)
+    name_width = max([len(name) for name in stats] + [5])
+    print(f"{'stage':<{name_width}}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, values in stats.items():
+        print(f"{name:<{name_width}}{values['count']:>8}"
+              f"{values['p50'] * 1000:>10.2f}{values['p95'] * 1000:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+"""
+GUI free analysis kernels for the TO2A phantom.
+
+These are used by the collection modules and by the headless batch runner
+so that both produce the same results for the same image.
+"""
@@ -0,0 +1,362 @@
+"""
+Context detection for TO2A phantom without any GUI.
+"""
+from collections.abc import Sequence
+
+import numpy as np
+
+from pumpia.utilities.typing import SideType
+from pumpia.utilities.feature_utils import phantom_boundary_automatic
+from pumpia.module_handling.context import PhantomContext
+
+from pumpia_to2a.instrumentation import profiler
+from pumpia_to2a.kernels.profiles import BoxBounds
+from pumpia_to2a.kernels.rotation import (MIN_CONFIDENCE,
+                                          MIN_ROTATION,
+                                          estimate_rotation)
+
+# offsets in mm (dicom standard units)
+FOUR_BOX_OFFSET = 54
+FOUR_BOX_SL = 10
+# offsets and box sizes swept when finding the insert sides, includes the above
+SWEEP_OFFSETS = (48, 51, 54, 57, 60)
+SWEEP_SIZES = (6, 10, 14)
+# diameter of the phantom in mm and the fraction a found boundary may differ from it
+# for an image to be taken as a TO2A phantom, see `screen_context`
+PHANTOM_DIAMETER = 190
+DIAMETER_TOLERANCE = 0.15
+
+SIDES: tuple[SideType, SideType, SideType, SideType] = ("top", "bottom", "left", "right")
+
+
+def same_axis(side_a: SideType, side_b: SideType) -> bool:
+    """
+    Returns True if both sides are on the same axis, i.e. top and bottom or left and right.
+    """
+    return ((side_a in ["top", "bottom"]
+             and side_b in ["top", "bottom"])
+            or (side_a in ["left", "right"]
+                and side_b in ["left", "right"]))
+
+
+class TO2AContext(PhantomContext):
+    """
+    Context for TO2A Phantom.
+
+    `rotation` is the in plane rotation of the phantom in degrees,
+    see `pumpia_to2a.kernels.rotation` for the convention used.
+    """
+
+    def __init__(self,
+                 xmin: int,
+                 xmax: int,
+                 ymin: int,
+                 ymax: int,
+                 wedges_side: SideType = "bottom",
+                 mtf_side: SideType = "left",
+                 rotation: float = 0):
+        super().__init__(xmin, xmax, ymin, ymax, 'ellipse')
+
+        if same_axis(mtf_side, wedges_side):
+            raise ValueError("wedges/MTF sides must not be on the same axis")
+
+        self.mtf_side: SideType = mtf_side
+        self.wedges_side: SideType = wedges_side
+        self.rotation: float = rotation
+
+
+def four_box_bounds(xcent: float,
+                    ycent: float,
+                    pixel_height: float,
+                    pixel_width: float) -> dict[SideType, BoxBounds]:
+    """
+    Returns the bounds of the four boxes used to find the inserts,
+    offset from the centre of the phantom.
+    """
+    four_box_offset_x = FOUR_BOX_OFFSET / pixel_width
+    four_box_offset_y = FOUR_BOX_OFFSET / pixel_height
+
+    four_box_width = FOUR_BOX_SL / pixel_width
+    four_box_height = FOUR_BOX_SL / pixel_height
+
+    return {"top": (round(xcent - four_box_width / 2),
+                    round(xcent + four_box_width / 2) + 1,
+                    round(ycent - four_box_offset_y - four_box_height),
+                    round(ycent - four_box_offset_y) + 1),
+            "bottom": (round(xcent - four_box_width / 2),
+                       round(xcent + four_box_width / 2) + 1,
+                       round(ycent + four_box_offset_y),
+                       round(ycent + four_box_offset_y + four_box_height) + 1),
+            "left": (round(xcent - four_box_offset_x - four_box_width),
+                     round(xcent - four_box_offset_x) + 1,
+                     round(ycent - four_box_height / 2),
+                     round(ycent + four_box_height / 2) + 1),
+            "right": (round(xcent + four_box_offset_x),
+                      round(xcent + four_box_offset_x + four_box_width) + 1,
+                      round(ycent - four_box_height / 2),
+                      round(ycent + four_box_height / 2) + 1)}
+
+
+def integral_image(image_array: np.ndarray) -> np.ndarray:
+    """
+    Returns the summed area table of a 2D image array,
+    padded with a row and column of zeros so that
+    `sat[ymax, xmax] - sat[ymin, xmax] - sat[ymax, xmin] + sat[ymin, xmin]`
+    is the sum of `image_array[ymin:ymax, xmin:xmax]`.
+    """
+    sat = np.zeros((image_array.shape[0] + 1, image_array.shape[1] + 1), dtype=float)
+    np.cumsum(image_array, axis=0, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def box_means(sat: np.ndarray,
+              xmin: np.ndarray,
+              xmax: np.ndarray,
+              ymin: np.ndarray,
+              ymax: np.ndarray) -> np.ndarray:
+    """
+    Returns the means of any number of boxes using a summed area table from `integral_image`.
+    Boxes are clipped to the image, boxes with no pixels in the image have a mean of inf.
+    Bounds follow `BoxBounds`, i.e. max is non-inclusive.
+    """
+    height = sat.shape[0] - 1
+    width = sat.shape[1] - 1
+    xmin = np.clip(xmin, 0, width)
+    xmax = np.clip(xmax, 0, width)
+    ymin = np.clip(ymin, 0, height)
+    ymax = np.clip(ymax, 0, height)
+
+    sums = sat[ymax, xmax] - sat[ymin, xmax] - sat[ymax, xmin] + sat[ymin, xmin]
+    areas = (xmax - xmin) * (ymax - ymin)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(areas > 0, sums / np.maximum(areas, 1), np.inf)
+
+
+def sweep_box_means(sat: np.ndarray,
+                    xcent: float,
+                    ycent: float,
+                    pixel_height: float,
+                    pixel_width: float,
+                    offsets: Sequence[float] = SWEEP_OFFSETS,
+                    sizes: Sequence[float] = SWEEP_SIZES) -> np.ndarray:
+    """
+    Returns the means of the four boxes for every combination of offset and box size,
+    placed as in `four_box_bounds`.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (len(offsets) * len(sizes), 4), columns ordered as `SIDES`.
+    """
+    offset_grid, size_grid = np.meshgrid(np.asarray(offsets, dtype=float),
+                                         np.asarray(sizes, dtype=float),
+                                         indexing="ij")
+    offset_x = offset_grid.ravel() / pixel_width
+    offset_y = offset_grid.ravel() / pixel_height
+    box_width = size_grid.ravel() / pixel_width
+    box_height = size_grid.ravel() / pixel_height
+
+    def rnd(values: np.ndarray) -> np.ndarray:
+        return np.round(values).astype(int)
+
+    # same rounding as four_box_bounds
+    centre_xmin = rnd(xcent - box_width / 2)
+    centre_xmax = rnd(xcent + box_width / 2) + 1
+    centre_ymin = rnd(ycent - box_height / 2)
+    centre_ymax = rnd(ycent + box_height / 2) + 1
+
+    means = np.empty((offset_x.shape[0], 4), dtype=float)
+    means[:, 0] = box_means(sat, centre_xmin, centre_xmax,
+                            rnd(ycent - offset_y - box_height), rnd(ycent - offset_y) + 1)
+    means[:, 1] = box_means(sat, centre_xmin, centre_xmax,
+                            rnd(ycent + offset_y), rnd(ycent + offset_y + box_height) + 1)
+    means[:, 2] = box_means(sat, rnd(xcent - offset_x - box_width), rnd(xcent - offset_x) + 1,
+                            centre_ymin, centre_ymax)
+    means[:, 3] = box_means(sat, rnd(xcent + offset_x), rnd(xcent + offset_x + box_width) + 1,
+                            centre_ymin, centre_ymax)
+    return means
+
+
+def orientation_votes(means: np.ndarray) -> dict[tuple[SideType, SideType], float]:
+    """
+    Returns the fraction of rows of `means` (from `sweep_box_means`) voting for each
+    of the eight valid (mtf side, wedges side) orientations.
+    For each row the MTF box gives the lowest mean and the wedges the lowest
+    of the two boxes on the other axis.
+    """
+    order = np.argsort(means, axis=1, kind="stable")
+    mtf_idx = order[:, 0]
+    wedge_idx = order[:, 1]
+    # SIDES is ordered so index // 2 gives the axis
+    same = (mtf_idx // 2) == (wedge_idx // 2)
+    wedge_idx = np.where(same, order[:, 2], wedge_idx)
+
+    counts = np.bincount(mtf_idx * 4 + wedge_idx, minlength=16)
+    votes: dict[tuple[SideType, SideType], float] = {}
+    for mtf_side in SIDES:
+        for wedge_side in SIDES:
+            if not same_axis(mtf_side, wedge_side):
+                index = SIDES.index(mtf_side) * 4 + SIDES.index(wedge_side)
+                votes[(mtf_side, wedge_side)] = counts[index] / means.shape[0]
+    return votes
+
+
+def find_insert_sides(image_array: np.ndarray,
+                      xcent: float,
+                      ycent: float,
+                      pixel_height: float,
+                      pixel_width: float,
+                      offsets: Sequence[float] = SWEEP_OFFSETS,
+                      sizes: Sequence[float] = SWEEP_SIZES) -> tuple[SideType, SideType]:
+    """
+    Finds the sides of the MTF box and the wedges from the means of four boxes
+    swept over several offsets and sizes.
+    The orientation with the most votes is used, see `orientation_votes`.
+    Ties are broken by the lowest combined normalised mean of the MTF and wedge boxes.
+
+    Returns
+    -------
+    tuple[SideType, SideType]
+        (mtf side, wedges side)
+    """
+    sat = integral_image(image_array)
+    means = sweep_box_means(sat, xcent, ycent, pixel_height, pixel_width, offsets, sizes)
+    votes = orientation_votes(means)
+
+    finite = np.where(np.isfinite(means), means, np.nan)
+    scale = np.nanmax(np.abs(finite), axis=1, keepdims=True)
+    scale[~(scale > 0)] = 1
+    norm_means = np.nanmean(finite / scale, axis=0)
+
+    def rank(orientation: tuple[SideType, SideType]) -> tuple[float, float]:
+        mtf_side, wedge_side = orientation
+        return (-votes[orientation],
+                2 * norm_means[SIDES.index(mtf_side)] + norm_means[SIDES.index(wedge_side)])
+
+    return min(votes, key=rank)
+
+
+def find_rotation(image_array: np.ndarray,
+                  xcent: float,
+                  ycent: float,
+                  pixel_height: float,
+                  pixel_width: float,
+                  mtf_side: SideType,
+                  wedges_side: SideType) -> float:
+    """
+    Returns the rotation of the phantom from `estimate_rotation`,
+    or 0 if the rotation is small or the estimate has a low confidence.
+    """
+    rotation, confidence = estimate_rotation(image_array,
+                                             xcent,
+                                             ycent,
+                                             pixel_height,
+                                             pixel_width,
+                                             mtf_side,
+                                             wedges_side)
+    if confidence < MIN_CONFIDENCE or abs(rotation) < MIN_ROTATION:
+        return 0
+    return round(rotation, 1)
+
+
+def detect_context(image_array: np.ndarray,
+                   pixel_size: tuple[float, float, float],
+                   sensitivity: float = 3,
+                   top_perc: float = 95,
+                   iterations: int = 2,
+                   cull_perc: float = 80,
+                   rotation: bool = True,
+                   shapes: list[str] | None = None) -> TO2AContext:
+    """
+    Finds the TO2A context for a 2D image array
+    in the same way as `TO2AContextManager` in auto mode.
+
+    Parameters
+    ----------
+    image_array : np.ndarray
+        2 dimensional image array.
+    pixel_size : tuple[float, float, float]
+        (slice_thickness, row_spacing, column_spacing) as given by `Instance.pixel_size`.
+    sensitivity, top_perc, iterations, cull_perc
+        Passed to `phantom_boundary_automatic`.
+    rotation : bool, optional
+        Whether to estimate the rotation of the phantom (default is True).
+    shapes : list[str] or None, optional
+        The phantom shapes passed to `phantom_boundary_automatic`,
+        ["ellipse"] if None (default is None).
+
+    Returns
+    -------
+    TO2AContext
+    """
+    if shapes is None:
+        shapes = ["ellipse"]
+
+    with profiler.span("context.boundary"):
+        boundary_context = phantom_boundary_automatic(image_array,
+                                                      sensitivity,
+                                                      top_perc,
+                                                      iterations,
+                                                      cull_perc,
+                                                      shapes)  # type: ignore
+
+    with profiler.span("context.insert_sides"):
+        mtf_side, wedge_side = find_insert_sides(image_array,
+                                                 boundary_context.xcent,
+                                                 boundary_context.ycent,
+                                                 pixel_size[1],
+                                                 pixel_size[2])
+
+    angle: float = 0
+    if rotation:
+        with profiler.span("context.rotation"):
+            angle = find_rotation(image_array,
+                                  boundary_context.xcent,
+                                  boundary_context.ycent,
+                                  pixel_size[1],
+                                  pixel_size[2],
+                                  mtf_side,
+                                  wedge_side)
+
+    return TO2AContext(boundary_context.xmin,
+                       boundary_context.xmax,
+                       boundary_context.ymin,
+                       boundary_context.ymax,
+                       wedge_side,
+                       mtf_side,
+                       angle)
+
+
+def screen_context(image_array: np.ndarray,
+                   context: TO2AContext,
+                   pixel_size: tuple[float, float, float]) -> str | None:
+    """
+    Checks an image with the context found for it looks like a TO2A phantom,
+    used to skip other series when analysing a folder.
+    The boundary must be within `DIAMETER_TOLERANCE` of `PHANTOM_DIAMETER` across both axes
+    and the angular profile of the image must correlate with the template of the inserts
+    at least as well as `MIN_CONFIDENCE`, see `kernels.rotation.estimate_rotation`.
+
+    Returns
+    -------
+    str or None
+        Why the image does not look like a TO2A phantom, or None if it does.
+    """
+    width = (context.xmax - context.xmin) * pixel_size[2]
+    height = (context.ymax - context.ymin) * pixel_size[1]
+    for size in (width, height):
+        if abs(size - PHANTOM_DIAMETER) > DIAMETER_TOLERANCE * PHANTOM_DIAMETER:
+            return (f"phantom size {width:.0f} x {height:.0f} mm "
+                    f"is not about {PHANTOM_DIAMETER} mm across")
+
+    _, confidence = estimate_rotation(image_array,
+                                      context.xcent,
+                                      context.ycent,
+                                      pixel_size[1],
+                                      pixel_size[2],
+                                      context.mtf_side,
+                                      context.wedges_side)
+    if confidence < MIN_CONFIDENCE:
+        return f"inserts do not match the TO2A layout (correlation {confidence:.2f})"
+    return None
@@ -0,0 +1,388 @@
+"""
+Fitting of the flat top gaussian integral (`split_gauss_integral`) without any GUI.
+
+The model and its analytic Jacobian are evaluated directly so profiles can be fitted
+together with `scipy.optimize.least_squares`, warm started from previous fits,
+or many profiles fitted at once with a vectorised Levenberg-Marquardt solver.
+"""
+import math
+from collections import OrderedDict
+from collections.abc import Hashable, Sequence
+
+import numpy as np
+from scipy.optimize import least_squares
+
+from pumpia.utilities.feature_utils import split_gauss_integral
+
+NUM_PARAMS = 5
+MAX_NFEV = 200
+WARM_START_SIZE = 64
+
+
+def split_gauss_integral_jacobian(pos: np.ndarray,
+                                  a: float,
+                                  b: float,
+                                  c: float,
+                                  amp: float) -> np.ndarray:
+    """
+    Returns the Jacobian of `split_gauss_integral` with respect to (a, b, c, amp, baseline).
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (len(pos), 5).
+    """
+    swapped = a > b
+    if swapped:
+        a, b = b, a
+
+    left = pos <= a
+    right = pos >= b
+    middle = ~left & ~right
+
+    diff = np.zeros(pos.shape)
+    diff[left] = pos[left] - a
+    diff[right] = pos[right] - b
+    gauss = np.exp(-0.5 * np.square(diff / c))
+    gauss[middle] = 1
+
+    d_pos = amp * gauss * diff / c**2
+
+    jac = np.zeros((pos.shape[0], NUM_PARAMS))
+    jac[left, 0] = d_pos[left]
+    jac[right, 1] = d_pos[right]
+    jac[:, 2] = d_pos * diff / c
+    jac[:, 3] = gauss
+    jac[:, :4] = np.cumsum(jac[:, :4], axis=0)
+    jac[:, 4] = 1
+
+    if swapped:
+        jac[:, [0, 1]] = jac[:, [1, 0]]
+    return jac
+
+
+def initial_params(profile: np.ndarray) -> np.ndarray:
+    """
+    Returns initial (a, b, c, amp, baseline) parameters for a profile,
+    using the position and spread of its derivative.
+    """
+    return initial_params_batch(np.asarray(profile, dtype=float)[None, :])[0]
+
+
+def legacy_initial_params(profile: np.ndarray, expected_width: float) -> np.ndarray:
+    """
+    Returns the initial parameters previously used with `curve_fit`.
+    """
+    prof_diff = np.diff(profile)
+
+    init_max = np.max(prof_diff)
+    init_min = np.min(prof_diff)
+    if abs(init_max) > abs(init_min):
+        init_amp = init_max
+    else:
+        init_amp = init_min
+    init_bl = np.min(profile)
+    init_c = expected_width / 2
+    init_a = prof_diff.shape[0] / 2 - init_c
+    init_b = prof_diff.shape[0] / 2 + init_c
+    return np.array([init_a, init_b, init_c, init_amp, init_bl], dtype=float)
+
+
+class WarmStartCache:
+    """
+    Least recently used store of previous fits, keyed by e.g. scanner and protocol.
+
+    Methods
+    -------
+    get(key: Hashable) -> list[np.ndarray] | None
+    put(key: Hashable, params: list[np.ndarray])
+    clear()
+    """
+
+    def __init__(self, max_size: int = WARM_START_SIZE):
+        self.max_size: int = max_size
+        self._fits: OrderedDict[Hashable, list[np.ndarray]] = OrderedDict()
+
+    def get(self, key: Hashable) -> list[np.ndarray] | None:
+        """
+        Returns the previous fit parameters for `key` or None.
+        """
+        try:
+            self._fits.move_to_end(key)
+        except KeyError:
+            return None
+        return [params.copy() for params in self._fits[key]]
+
+    def put(self, key: Hashable, params: list[np.ndarray]) -> None:
+        """
+        Stores the fit parameters for `key`.
+        """
+        self._fits[key] = [p.copy() for p in params]
+        self._fits.move_to_end(key)
+        while len(self._fits) > self.max_size:
+            self._fits.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Removes all stored fits.
+        """
+        self._fits.clear()
+
+
+warm_starts = WarmStartCache()
+
+
+def _joint_fit(profiles: Sequence[np.ndarray], initials: list[np.ndarray]):
+    """
+    Fits all profiles in one least squares problem with a block diagonal Jacobian.
+    """
+    positions = [np.arange(profile.shape[0], dtype=float) for profile in profiles]
+    offsets = np.cumsum([0] + [profile.shape[0] for profile in profiles])
+    scales = [max(float(np.ptp(profile)), 1e-12) for profile in profiles]
+
+    def residuals(params: np.ndarray) -> np.ndarray:
+        res = []
+        for i, profile in enumerate(profiles):
+            a, b, c, amp, baseline = params[i * NUM_PARAMS:(i + 1) * NUM_PARAMS]
+            model = split_gauss_integral(positions[i], a, b, c, amp, baseline)
+            res.append((model - profile) / scales[i])
+        return np.concatenate(res)
+
+    def jacobian(params: np.ndarray) -> np.ndarray:
+        jac = np.zeros((offsets[-1], NUM_PARAMS * len(profiles)))
+        for i in range(len(profiles)):
+            a, b, c, amp, _ = params[i * NUM_PARAMS:(i + 1) * NUM_PARAMS]
+            jac[offsets[i]:offsets[i + 1], i * NUM_PARAMS:(i + 1) * NUM_PARAMS] = (
+                split_gauss_integral_jacobian(positions[i], a, b, c, amp) / scales[i])
+        return jac
+
+    return least_squares(residuals,
+                         np.concatenate(initials),
+                         jac=jacobian,
+                         method="lm",
+                         max_nfev=MAX_NFEV)
+
+
+def fit_profiles(profiles: Sequence[np.ndarray],
+                 expected_width: float,
+                 warm_start_key: Hashable | None = None) -> list[np.ndarray]:
+    """
+    Fits `split_gauss_integral` to each profile, solving for all of them together.
+
+    Starting points are tried in order until one converges:
+    the previous fit for `warm_start_key`, if given,
+    the position and spread of the profile derivatives
+    and the starting point previously used with `curve_fit`.
+    The best converged fit is stored for `warm_start_key`.
+
+    Returns
+    -------
+    list[np.ndarray]
+        The fitted (a, b, c, amp, baseline) parameters for each profile.
+
+    Raises
+    ------
+    RuntimeError
+        If no fit converges.
+    """
+    profiles = [np.asarray(profile, dtype=float) for profile in profiles]
+
+    starts: list[list[np.ndarray]] = []
+    if warm_start_key is not None:
+        previous = warm_starts.get(warm_start_key)
+        if previous is not None and len(previous) == len(profiles):
+            starts.append(previous)
+    starts.append([initial_params(profile) for profile in profiles])
+    starts.append([legacy_initial_params(profile, expected_width) for profile in profiles])
+
+    best = None
+    for initials in starts:
+        result = _joint_fit(profiles, initials)
+        if result.success and np.all(np.isfinite(result.x)):
+            if best is None or result.cost < best.cost:
+                best = result
+            # accept when close to the noise floor, otherwise try the other starts
+            if result.cost <= 1e-3 * len(result.fun):
+                break
+
+    if best is None:
+        raise RuntimeError("Optimal parameters not found for the wedge profiles")
+
+    fits = [best.x[i * NUM_PARAMS:(i + 1) * NUM_PARAMS].copy() for i in range(len(profiles))]
+    if warm_start_key is not None:
+        warm_starts.put(warm_start_key, fits)
+    return fits
+
+
+def split_gauss_integral_batch(pos: np.ndarray, params: np.ndarray) -> np.ndarray:
+    """
+    Evaluates `split_gauss_integral` for each row of `params`.
+
+    Parameters
+    ----------
+    pos : np.ndarray
+        1 dimensional array of positions.
+    params : np.ndarray
+        Array of shape (M, 5) of (a, b, c, amp, baseline).
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (M, len(pos)).
+    """
+    model, _ = _batch_model_jacobian(pos, params, jacobian=False)
+    return model
+
+
+def _batch_model_jacobian(pos: np.ndarray,
+                          params: np.ndarray,
+                          jacobian: bool = True) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    Returns the model, shape (M, L), and if `jacobian` its Jacobian, shape (M, L, 5),
+    for each row of `params`.
+    """
+    a = np.minimum(params[:, 0], params[:, 1])[:, None]
+    b = np.maximum(params[:, 0], params[:, 1])[:, None]
+    c = params[:, 2][:, None]
+    amp = params[:, 3][:, None]
+    pos = pos[None, :]
+
+    left = pos <= a
+    right = pos >= b
+    middle = ~left & ~right
+
+    diff = np.where(left, pos - a, np.where(right, pos - b, 0.0))
+    gauss = np.where(middle, 1.0, np.exp(-0.5 * np.square(diff / c)))
+    model = np.cumsum(amp * gauss, axis=1) + params[:, 4][:, None]
+    if not jacobian:
+        return model, None
+
+    d_pos = amp * gauss * diff / c**2
+    jac = np.empty(model.shape + (NUM_PARAMS,))
+    d_a = np.where(left, d_pos, 0.0)
+    d_b = np.where(right, d_pos, 0.0)
+    swapped = (params[:, 0] > params[:, 1])[:, None]
+    jac[:, :, 0] = np.cumsum(np.where(swapped, d_b, d_a), axis=1)
+    jac[:, :, 1] = np.cumsum(np.where(swapped, d_a, d_b), axis=1)
+    jac[:, :, 2] = np.cumsum(d_pos * diff / c, axis=1)
+    jac[:, :, 3] = np.cumsum(gauss, axis=1)
+    jac[:, :, 4] = 1
+    return model, jac
+
+
+def initial_params_batch(profiles: np.ndarray) -> np.ndarray:
+    """
+    Returns initial (a, b, c, amp, baseline) parameters for each row of `profiles`,
+    shape (M, 5), using the position and spread of the profile derivatives.
+    """
+    prof_diff = np.diff(profiles, axis=1)
+    rise = profiles[:, -1] - profiles[:, 0]
+    sign = np.where(rise >= 0, 1.0, -1.0)
+
+    weights = np.clip(prof_diff * sign[:, None], 0, None)
+    total = np.sum(weights, axis=1)
+    safe_total = np.where(total == 0, 1, total)
+    positions = np.arange(prof_diff.shape[1]) + 0.5
+    centre = np.where(total == 0,
+                      prof_diff.shape[1] / 2,
+                      np.sum(weights * positions, axis=1) / safe_total)
+    spread = np.sqrt(np.sum(weights * np.square(positions[None, :] - centre[:, None]), axis=1)
+                     / safe_total)
+    spread = np.where(total == 0, 1.0, np.maximum(spread, 1.0))
+
+    a_init = centre - spread / 2
+    b_init = centre + spread / 2
+    c_init = spread / 2
+    amp_init = rise / (b_init - a_init + c_init * math.sqrt(2 * math.pi))
+    baseline = np.where(sign > 0, profiles[:, 0], profiles[:, -1] - rise)
+    return np.stack([a_init, b_init, c_init, amp_init, baseline], axis=1)
+
+
+def fit_profiles_batch(profiles: np.ndarray,
+                       initials: np.ndarray | None = None,
+                       max_iterations: int = 100,
+                       tolerance: float = 1e-10) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Fits `split_gauss_integral` to every row of `profiles` with a Levenberg-Marquardt solver
+    vectorised over the rows, so all problems are iterated together.
+
+    Parameters
+    ----------
+    profiles : np.ndarray
+        Array of shape (M, L) of profiles of the same length.
+    initials : np.ndarray or None, optional
+        Array of shape (M, 5) of starting parameters,
+        `initial_params_batch` is used if None (default is None).
+    max_iterations : int, optional
+        Maximum number of iterations (default is 100).
+    tolerance : float, optional
+        Relative reduction in cost below which a problem is considered converged
+        (default is 1e-10).
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        (fitted parameters, shape (M, 5), converged, boolean shape (M,))
+    """
+    profiles = np.asarray(profiles, dtype=float)
+    if initials is None:
+        params = initial_params_batch(profiles)
+    else:
+        params = np.array(initials, dtype=float)
+
+    pos = np.arange(profiles.shape[1], dtype=float)
+    scales = np.maximum(np.ptp(profiles, axis=1), 1e-12)[:, None]
+    damping = np.full(profiles.shape[0], 1e-3)
+    converged = np.zeros(profiles.shape[0], dtype=bool)
+    eye = np.eye(NUM_PARAMS)
+
+    model, jac = _batch_model_jacobian(pos, params)
+    residuals = (model - profiles) / scales
+    cost = np.sum(np.square(residuals), axis=1)
+
+    for _ in range(max_iterations):
+        active = ~converged
+        if not np.any(active):
+            break
+
+        jac_a = jac[active] / scales[active][:, :, None]  # type: ignore
+        jac_t = jac_a.transpose(0, 2, 1)
+        # batched matmul is much faster than the equivalent einsum
+        jtj = jac_t @ jac_a
+        gradient = (jac_t @ residuals[active][:, :, None])[:, :, 0]
+        diag = np.einsum("mpp->mp", jtj)
+        lhs = jtj + damping[active][:, None, None] * (eye * np.maximum(diag, 1e-12)[:, :, None])
+        try:
+            step = np.linalg.solve(lhs, -gradient[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            step = -gradient / np.maximum(diag, 1e-12)
+
+        trial = params[active] + step
+        trial_model, trial_jac = _batch_model_jacobian(pos, trial)
+        trial_residuals = (trial_model - profiles[active]) / scales[active]
+        trial_cost = np.sum(np.square(trial_residuals), axis=1)
+
+        improved = np.isfinite(trial_cost) & (trial_cost < cost[active])
+        indices = np.flatnonzero(active)
+        accept = indices[improved]
+
+        reduction = np.zeros(indices.shape[0])
+        reduction[improved] = ((cost[active][improved] - trial_cost[improved])
+                               / np.maximum(cost[active][improved], 1e-300))
+
+        params[accept] = trial[improved]
+        jac[accept] = trial_jac[improved]  # type: ignore
+        residuals[accept] = trial_residuals[improved]
+        cost[accept] = trial_cost[improved]
+
+        damping[accept] = np.maximum(damping[accept] / 3, 1e-12)
+        reject = indices[~improved]
+        damping[reject] = damping[reject] * 4
+
+        converged[accept[reduction[improved] < tolerance]] = True
+        # problems that can no longer be improved are at a minimum
+        converged[reject[damping[reject] > 1e10]] = True
+        converged[indices[np.max(np.abs(step), axis=1) < 1e-9]] = True
+
+    finite = np.all(np.isfinite(params), axis=1)
+    return params, converged & finite
@@ -0,0 +1,189 @@
+"""
+Image plane geometry of TO2A images without any GUI, used to share contexts between series.
+
+Series in the same frame of reference with the same orientation and slice position
+image the phantom in the same place, e.g. the T1, T2 and bandwidth sequences of a QA session,
+so the context found for one can be mapped onto the pixel grid of the others
+through patient coordinates instead of being found again.
+A mapped context is only used if `context_consistent` agrees with it.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pydicom
+
+from pumpia_to2a.dicom_frames import frame_item
+from pumpia_to2a.kernels.context import TO2AContext, integral_image, box_means, find_insert_sides
+
+# series with slice positions closer than this in mm are grouped together
+POSITION_TOLERANCE = 1
+# decimals the direction cosines are rounded to when grouping
+ORIENTATION_DECIMALS = 3
+# boxes checked either side of the phantom edge, side length and offset from the edge in mm
+EDGE_BOX = 4
+EDGE_OFFSET = 5
+# the most the signal outside the edge can be relative to the signal inside it
+EDGE_RATIO = 0.5
+
+
+@dataclass(frozen=True)
+class PlaneGeometry:
+    """
+    The position of an image plane in patient coordinates.
+
+    Attributes
+    ----------
+    frame_of_reference : str
+    origin : tuple[float, float, float]
+        The position of the centre of the first pixel in mm, the image position.
+    row_direction : tuple[float, float, float]
+        The direction of increasing column index, along a row.
+    column_direction : tuple[float, float, float]
+        The direction of increasing row index, down a column.
+    row_spacing : float
+        The distance between rows in mm.
+    column_spacing : float
+        The distance between columns in mm.
+    """
+    frame_of_reference: str
+    origin: tuple[float, float, float]
+    row_direction: tuple[float, float, float]
+    column_direction: tuple[float, float, float]
+    row_spacing: float
+    column_spacing: float
+
+    @property
+    def normal(self) -> np.ndarray:
+        """
+        The unit normal of the plane.
+        """
+        normal = np.cross(self.row_direction, self.column_direction)
+        return normal / np.linalg.norm(normal)
+
+    def group_key(self) -> tuple:
+        """
+        Returns a key shared by planes in the same place,
+        the frame of reference, orientation and slice position.
+        The pixel grid is not part of the key, see `map_context`.
+        """
+        position = float(np.dot(self.origin, self.normal))
+        return (self.frame_of_reference,
+                tuple(np.round(self.row_direction, ORIENTATION_DECIMALS) + 0.0),
+                tuple(np.round(self.column_direction, ORIENTATION_DECIMALS) + 0.0),
+                round(position / POSITION_TOLERANCE))
+
+    def to_patient(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        Returns the patient coordinates, shape (..., 3), of pixel coordinates
+        where x is the column and y the row.
+        """
+        x = np.asarray(x, dtype=float)[..., np.newaxis]
+        y = np.asarray(y, dtype=float)[..., np.newaxis]
+        return (np.asarray(self.origin)
+                + x * self.column_spacing * np.asarray(self.row_direction)
+                + y * self.row_spacing * np.asarray(self.column_direction))
+
+    def to_pixels(self, points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the (x, y) pixel coordinates of patient coordinates projected onto the plane.
+        """
+        relative = np.asarray(points, dtype=float) - np.asarray(self.origin)
+        return (relative @ np.asarray(self.row_direction) / self.column_spacing,
+                relative @ np.asarray(self.column_direction) / self.row_spacing)
+
+
+def plane_geometry(ds: pydicom.Dataset | None, frame: int = 0) -> PlaneGeometry | None:
+    """
+    Returns the geometry of a frame of a dataset,
+    taken from the functional groups of enhanced DICOM if not in the dataset.
+    Returns None if the dataset does not give the position and orientation.
+    """
+    if ds is None:
+        return None
+
+    def element(keyword: str, sequence: str):
+        if keyword in ds:
+            return ds[keyword].value
+        item = frame_item(ds, sequence, frame)
+        if item is None or keyword not in item:
+            return None
+        return item[keyword].value
+
+    position = element("ImagePositionPatient", "PlanePositionSequence")
+    orientation = element("ImageOrientationPatient", "PlaneOrientationSequence")
+    spacing = element("PixelSpacing", "PixelMeasuresSequence")
+    frame_of_reference = ds.get("FrameOfReferenceUID", None)
+    if (position is None or orientation is None or spacing is None
+        or len(position) != 3 or len(orientation) != 6 or len(spacing) != 2
+            or frame_of_reference is None):
+        return None
+
+    return PlaneGeometry(str(frame_of_reference),
+                         tuple(float(value) for value in position),  # type: ignore
+                         tuple(float(value) for value in orientation[:3]),  # type: ignore
+                         tuple(float(value) for value in orientation[3:]),  # type: ignore
+                         float(spacing[0]),
+                         float(spacing[1]))
+
+
+def map_context(context: TO2AContext,
+                source: PlaneGeometry,
+                target: PlaneGeometry) -> TO2AContext:
+    """
+    Returns the context found on the `source` plane on the pixel grid of the `target` plane,
+    the planes should have the same `PlaneGeometry.group_key`.
+    """
+    if source == target:
+        return context
+    x, y = target.to_pixels(source.to_patient(np.array([context.xmin, context.xmax]),
+                                              np.array([context.ymin, context.ymax])))
+    return TO2AContext(round(float(np.min(x))),
+                       round(float(np.max(x))),
+                       round(float(np.min(y))),
+                       round(float(np.max(y))),
+                       context.wedges_side,
+                       context.mtf_side,
+                       context.rotation)
+
+
+def context_consistent(image_array: np.ndarray,
+                       context: TO2AContext,
+                       pixel_size: tuple[float, float, float]) -> bool:
+    """
+    Quickly checks a context fits an image, used before reusing a context found on another image.
+    The bounds must be in the image with the signal inside each edge higher than outside it,
+    and the insert sides found from the context centre must match the context.
+    """
+    height, width = image_array.shape
+    if (context.xmin < 0 or context.ymin < 0
+            or context.xmax >= width or context.ymax >= height):
+        return False
+
+    pixel_height, pixel_width = pixel_size[1], pixel_size[2]
+    sat = integral_image(image_array)
+    xcent, ycent = context.xcent, context.ycent
+    half_x = EDGE_BOX / pixel_width / 2
+    half_y = EDGE_BOX / pixel_height / 2
+    offset_x = EDGE_OFFSET / pixel_width
+    offset_y = EDGE_OFFSET / pixel_height
+    # box centres inside then outside the left, right, top and bottom edges
+    centres_x = np.array([context.xmin + offset_x, context.xmax - offset_x, xcent, xcent,
+                          context.xmin - offset_x, context.xmax + offset_x, xcent, xcent])
+    centres_y = np.array([ycent, ycent, context.ymin + offset_y, context.ymax - offset_y,
+                          ycent, ycent, context.ymin - offset_y, context.ymax + offset_y])
+    means = box_means(sat,
+                      np.round(centres_x - half_x).astype(int),
+                      np.round(centres_x + half_x).astype(int) + 1,
+                      np.round(centres_y - half_y).astype(int),
+                      np.round(centres_y + half_y).astype(int) + 1)
+    inside, outside = means[:4], means[4:]
+    # boxes clipped off the image have a mean of inf and are treated as background
+    outside = np.where(np.isfinite(outside), outside, 0)
+    if not (np.all(np.isfinite(inside)) and np.all(outside < EDGE_RATIO * inside)):
+        return False
+
+    return find_insert_sides(image_array,
+                             xcent,
+                             ycent,
+                             pixel_height,
+                             pixel_width) == (context.mtf_side, context.wedges_side)
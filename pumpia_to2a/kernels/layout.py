@@ -0,0 +1,291 @@
+"""
+Layout of the TO2A Phantom ROIs and their placement on an image without any GUI.
+
+Every ROI is described once in mm in the phantom frame,
+where x points away from the MTF box and y towards the wedges,
+the frame of `kernels.rotation.TEMPLATE_REGIONS` and `synthetic`.
+A `PhantomTransform` built from a context maps the phantom frame to pixels,
+so all eight insert orientations, the pixel size and the rotation are handled by one
+affine transform and `place_boxes` and `place_lines` place any number of ROIs in one step.
+Rectangle ROIs can not be rotated, so boxes are placed unrotated
+and moved so their centres follow the rotation, as `kernels.rotation.rotate_bounds`,
+profiles are then taken along the rotated box by `kernels.profiles.box_pixels`.
+"""
+import math
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Literal
+
+import numpy as np
+
+from pumpia_to2a.kernels.context import TO2AContext
+from pumpia_to2a.kernels.profiles import BoxBounds, LineEnds
+from pumpia_to2a.kernels.rotation import SIDE_VECTORS
+
+# distances in mm
+# wedge ROIs, offset from the centre towards the wedges
+INSIDE_OFFSET = 40
+OUTSIDE_OFFSET = 61
+WEDGE_ROI_WIDTH = 14
+WEDGE_ROI_LENGTH = 70
+
+# resolution inserts, bars across the profile
+INSERT_WIDTH = 11
+INSERT_LENGTHS = {"2": 24, "1_5": 20, "1": 16}
+# inserts on the wedge side of the centre, profiles towards the wedges
+WEDGE_SIDE_OFFSET = 10
+WEDGE_SIDE_OFFSETS = {"2": 31, "1_5": 51, "1": 71}
+# inserts on the other side of the centre, profiles away from the MTF box
+OTHER_SIDE_OFFSET = 43
+OTHER_SIDE_OFFSETS = {"2": 20, "1_5": 41, "1": 61}
+
+# MTF block, (xmin, xmax, ymin, ymax)
+MTF_BLOCK = (-80, -45, -15, 15)
+# MTF edge ROIs, centred on an edge of the MTF block,
+# half their size across the edge and along it keeping clear of the corners
+MTF_HALF_WIDTH = 10
+MTF_HALF_LENGTH = 12
+
+# phantom width lines, half the length of each line through the centre
+HALF_LINE_LENGTH = 100
+COS_PI_6 = math.cos(math.pi / 6)
+COS_PI_3 = math.cos(math.pi / 3)
+
+ProfileAxis = Literal["x", "y"]
+
+
+@dataclass(frozen=True)
+class BoxLayout:
+    """
+    A rectangle ROI in mm in the phantom frame.
+
+    Attributes
+    ----------
+    xmin : float
+    xmax : float
+    ymin : float
+    ymax : float
+    profile_axis : ProfileAxis
+        The phantom axis the profile of the ROI is taken along.
+    """
+    xmin: float
+    xmax: float
+    ymin: float
+    ymax: float
+    profile_axis: ProfileAxis = "x"
+
+
+@dataclass(frozen=True)
+class LineLayout:
+    """
+    A line ROI in mm from (x1, y1) to (x2, y2).
+    """
+    x1: float
+    y1: float
+    x2: float
+    y2: float
+
+
+WEDGE_BOXES: dict[str, BoxLayout] = {
+    "inside_wedge": BoxLayout(-WEDGE_ROI_LENGTH / 2, WEDGE_ROI_LENGTH / 2,
+                              INSIDE_OFFSET, INSIDE_OFFSET + WEDGE_ROI_WIDTH),
+    "outside_wedge": BoxLayout(-WEDGE_ROI_LENGTH / 2, WEDGE_ROI_LENGTH / 2,
+                               OUTSIDE_OFFSET, OUTSIDE_OFFSET + WEDGE_ROI_WIDTH)}
+
+OTHER_SIDE_INSERTS: dict[str, BoxLayout] = {
+    size: BoxLayout(OTHER_SIDE_OFFSET, OTHER_SIDE_OFFSET + length,
+                    -OTHER_SIDE_OFFSETS[size], INSERT_WIDTH - OTHER_SIDE_OFFSETS[size])
+    for size, length in INSERT_LENGTHS.items()}
+
+WEDGE_SIDE_INSERTS: dict[str, BoxLayout] = {
+    size: BoxLayout(WEDGE_SIDE_OFFSETS[size], WEDGE_SIDE_OFFSETS[size] + INSERT_WIDTH,
+                    WEDGE_SIDE_OFFSET, WEDGE_SIDE_OFFSET + length,
+                    "y")
+    for size, length in INSERT_LENGTHS.items()}
+
+# the edge of the MTF block facing the centre, profiles away from the MTF box,
+# and the edge on the wedge side, profiles towards the wedges
+MTF_EDGES: dict[str, BoxLayout] = {
+    "x": BoxLayout(MTF_BLOCK[1] - MTF_HALF_WIDTH, MTF_BLOCK[1] + MTF_HALF_WIDTH,
+                   -MTF_HALF_LENGTH, MTF_HALF_LENGTH),
+    "y": BoxLayout((MTF_BLOCK[0] + MTF_BLOCK[1]) / 2 - MTF_HALF_LENGTH,
+                   (MTF_BLOCK[0] + MTF_BLOCK[1]) / 2 + MTF_HALF_LENGTH,
+                   MTF_BLOCK[3] - MTF_HALF_WIDTH, MTF_BLOCK[3] + MTF_HALF_WIDTH,
+                   "y")}
+
+# x and y factors of the half line length for each phantom width line, named by clock positions
+SPOKES: dict[str, tuple[float, float]] = {"12_6": (0, 1),
+                                          "1_7": (-COS_PI_3, COS_PI_6),
+                                          "2_8": (-COS_PI_6, COS_PI_3),
+                                          "3_9": (1, 0),
+                                          "4_10": (COS_PI_6, COS_PI_3),
+                                          "5_11": (COS_PI_3, COS_PI_6)}
+
+# lines through the centre in the image frame as the phantom body is round,
+# so they are only rotated with the phantom
+SPOKE_LINES: dict[str, LineLayout] = {
+    name: LineLayout(-HALF_LINE_LENGTH * x_factor, -HALF_LINE_LENGTH * y_factor,
+                     HALF_LINE_LENGTH * x_factor, HALF_LINE_LENGTH * y_factor)
+    for name, (x_factor, y_factor) in SPOKES.items()}
+
+
+@dataclass(frozen=True)
+class PhantomTransform:
+    """
+    Affine transform from mm in the phantom frame to pixels.
+
+    Attributes
+    ----------
+    centre : np.ndarray
+        The centre of the phantom in pixels, (x, y).
+    orientation : np.ndarray
+        2x2 matrix whose columns are the phantom x and y axes in the image.
+    scale : np.ndarray
+        The pixel width and height in mm.
+    rotation : np.ndarray | None
+        2x2 matrix rotating mm in the image with the phantom, None if the phantom is not rotated.
+    """
+    centre: np.ndarray
+    orientation: np.ndarray
+    scale: np.ndarray
+    rotation: np.ndarray | None
+
+    @classmethod
+    def from_context(cls,
+                     context: TO2AContext,
+                     pixel_size: tuple[float, float, float],
+                     oriented: bool = True) -> "PhantomTransform":
+        """
+        Returns the transform for a context.
+        If `oriented` is False the phantom frame is the image frame,
+        only moved to the centre and rotated, as used for `SPOKE_LINES`.
+        """
+        if oriented:
+            mtf_x, mtf_y = SIDE_VECTORS[context.mtf_side]
+            wedge_x, wedge_y = SIDE_VECTORS[context.wedges_side]
+            orientation = np.array([[-mtf_x, wedge_x], [-mtf_y, wedge_y]], dtype=float)
+        else:
+            orientation = np.eye(2)
+        rotation = None
+        if context.rotation != 0:
+            theta = math.radians(context.rotation)
+            cos = math.cos(theta)
+            sin = math.sin(theta)
+            rotation = np.array([[cos, -sin], [sin, cos]])
+        return cls(np.array([context.xcent, context.ycent], dtype=float),
+                   orientation,
+                   np.array([pixel_size[2], pixel_size[1]], dtype=float),
+                   rotation)
+
+    def profile_direction(self, axis: ProfileAxis) -> Literal["Horizontal", "Vertical"]:
+        """
+        Returns the image direction of the profile along a phantom axis.
+        """
+        column = self.orientation[:, 0 if axis == "x" else 1]
+        return "Horizontal" if abs(column[0]) > abs(column[1]) else "Vertical"
+
+    def unrotated_pixels(self, points: np.ndarray) -> np.ndarray:
+        """
+        Returns points given in mm in the phantom frame, shape (..., 2),
+        in pixels without the rotation.
+        """
+        return self.centre + (np.asarray(points, dtype=float) @ self.orientation.T) / self.scale
+
+    def rotate(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        Rotates points in pixels, shape (..., 2), about the centre with the phantom,
+        working in mm so non square pixels are handled as `kernels.rotation.rotate_point`.
+        """
+        pixels = np.asarray(pixels, dtype=float)
+        if self.rotation is None:
+            return pixels
+        offsets = (pixels - self.centre) * self.scale
+        return self.centre + (offsets @ self.rotation.T) / self.scale
+
+    def to_pixels(self, points: np.ndarray) -> np.ndarray:
+        """
+        Returns points given in mm in the phantom frame, shape (..., 2), in pixels.
+        """
+        return self.rotate(self.unrotated_pixels(points))
+
+
+def place_boxes(boxes: Mapping[str, BoxLayout],
+                transform: PhantomTransform) -> dict[str, BoxBounds]:
+    """
+    Returns the bounds of every box, keyed as `boxes`, placed by `transform` in one step.
+    """
+    names = list(boxes)
+    if not names:
+        return {}
+    mm = np.array([[(box.xmin, box.ymin), (box.xmax, box.ymax)] for box in boxes.values()])
+    corners = transform.unrotated_pixels(mm)
+    low = np.round(corners.min(axis=1))
+    high = np.round(corners.max(axis=1))
+    if transform.rotation is not None:
+        centres = (low + high) / 2
+        shift = np.round(transform.rotate(centres) - centres)
+        low += shift
+        high += shift
+    bounds = np.stack([low, high], axis=-1).reshape(len(names), 4).astype(int).tolist()
+    return {name: tuple(row) for name, row in zip(names, bounds)}  # type: ignore
+
+
+def place_lines(lines: Mapping[str, LineLayout],
+                transform: PhantomTransform) -> dict[str, LineEnds]:
+    """
+    Returns the end points of every line, keyed as `lines`, placed by `transform` in one step.
+    Ends are rounded to pixels before and after the rotation, as `kernels.rotation.rotate_line`.
+    """
+    names = list(lines)
+    if not names:
+        return {}
+    mm = np.array([[(line.x1, line.y1), (line.x2, line.y2)] for line in lines.values()])
+    ends = np.round(transform.unrotated_pixels(mm))
+    if transform.rotation is not None:
+        ends = np.round(transform.rotate(ends))
+    ends = ends.reshape(len(names), 4).astype(int).tolist()
+    return {name: tuple(row) for name, row in zip(names, ends)}  # type: ignore
+
+
+def insert_boxes(transform: PhantomTransform) -> dict[str, BoxLayout]:
+    """
+    Returns the resolution inserts keyed by their names in the image,
+    the direction of their profile and size e.g. "horizontal_2",
+    ordered horizontal then vertical from the largest bars.
+    """
+    named = {transform.profile_direction(box.profile_axis).lower() + "_" + size: box
+             for inserts in (OTHER_SIDE_INSERTS, WEDGE_SIDE_INSERTS)
+             for size, box in inserts.items()}
+    return {direction + "_" + size: named[direction + "_" + size]
+            for direction in ("horizontal", "vertical")
+            for size in INSERT_LENGTHS}
+
+
+def mtf_boxes(transform: PhantomTransform) -> dict[str, BoxLayout]:
+    """
+    Returns the MTF edge ROIs keyed by the direction of their profile in the image,
+    "horizontal" then "vertical".
+    """
+    named = {transform.profile_direction(box.profile_axis).lower(): box
+             for box in MTF_EDGES.values()}
+    return {direction: named[direction] for direction in ("horizontal", "vertical")}
+
+
+def phantom_rois(context: TO2AContext,
+                 pixel_size: tuple[float, float, float]) -> dict[str, BoxBounds | LineEnds]:
+    """
+    Returns every ROI of the modules for a context in one step,
+    keyed as the "rois" of a batch record: "inside_wedge", "outside_wedge",
+    "spoke_" followed by the `SPOKES` names, the names of `insert_boxes`
+    and "mtf_" followed by the names of `mtf_boxes`.
+    """
+    transform = PhantomTransform.from_context(context, pixel_size)
+    boxes = place_boxes({**WEDGE_BOXES,
+                         **insert_boxes(transform),
+                         **{"mtf_" + name: box for name, box in mtf_boxes(transform).items()}},
+                        transform)
+    lines = place_lines(SPOKE_LINES, PhantomTransform.from_context(context, pixel_size, False))
+    return {"inside_wedge": boxes.pop("inside_wedge"),
+            "outside_wedge": boxes.pop("outside_wedge"),
+            **{"spoke_" + name: ends for name, ends in lines.items()},
+            **boxes}
@@ -0,0 +1,251 @@
+"""
+Modulation transfer function (MTF) from the edges of the TO2A MTF block without any GUI.
+
+Uses the slanted edge method: the edge is found on every row across it and a line fitted,
+the pixels are binned by their distance from the line into an oversampled edge spread function,
+which is differentiated to the line spread function and Fourier transformed to the MTF.
+An edge too close to the pixel grid to oversample falls back to the mean row at the pixel pitch.
+Frequencies are in cycles per mm.
+"""
+import math
+from dataclasses import dataclass
+from typing import Literal
+
+import numpy as np
+
+from pumpia_to2a.kernels.context import TO2AContext
+from pumpia_to2a.kernels.profiles import BoxBounds, box_pixels
+from pumpia_to2a.kernels.layout import PhantomTransform, mtf_boxes, place_boxes
+
+# bins per pixel of the edge spread function
+OVERSAMPLE = 4
+# half width in pixels of the window around the first edge estimate used to refine it
+EDGE_WINDOW = 5
+# the line spread function is zero padded to this many times its length for a finer MTF
+FFT_PADDING = 4
+# MTF levels reported
+MTF_LEVELS = (50, 10)
+# pixels the edge must move across the rows of the ROI,
+# below this the pixels do not fill every bin of the oversampled edge spread function
+MIN_EDGE_SHIFT = 1
+# `edge_status` of an edge that is oversampled and one that is not
+OVERSAMPLED_STATUS = "OK"
+GRID_EDGE_STATUS = "Edge too square, not oversampled"
+
+
+@dataclass
+class EdgeMTF:
+    """
+    The MTF measured from one edge.
+
+    Attributes
+    ----------
+    angle : float
+        The angle of the edge to the pixel grid in degrees.
+    frequencies : np.ndarray
+        The frequencies of `mtf` in cycles per mm.
+    mtf : np.ndarray
+        The MTF, 1 at zero frequency.
+    mtf50 : float
+        The frequency the MTF first falls to 50%, nan if it does not before the Nyquist frequency.
+    mtf10 : float
+        The frequency the MTF first falls to 10%, nan as for `mtf50`.
+    oversampled : bool
+        False if the edge was too close to the pixel grid to be oversampled
+        and the MTF is from the mean row at the pixel pitch, so includes aliasing.
+    """
+    angle: float
+    frequencies: np.ndarray
+    mtf: np.ndarray
+    mtf50: float
+    mtf10: float
+    oversampled: bool = True
+
+
+def mtf_rois(context: TO2AContext,
+             pixel_size: tuple[float, float, float]) -> dict[str, BoxBounds]:
+    """
+    Returns the bounds of the MTF edge ROIs, placed from `kernels.layout.MTF_EDGES`.
+    Keys are "horizontal" and "vertical", the direction of the profile across the edge,
+    so the horizontal ROI measures the MTF along the rows.
+    The ROIs are moved with the rotation of the phantom.
+    """
+    transform = PhantomTransform.from_context(context, pixel_size)
+    return place_boxes(mtf_boxes(transform), transform)
+
+
+def edge_line(pixels: np.ndarray) -> tuple[float, float]:
+    """
+    Fits a line to the edge crossing each row of `pixels`, x = slope * row + intercept,
+    in pixels.
+    The edge on each row is the centroid of the absolute differences along the row,
+    first of the whole row then within `EDGE_WINDOW` pixels of the first line.
+    """
+    diffs = np.abs(np.diff(pixels, axis=1))
+    rows = np.arange(diffs.shape[0], dtype=float)
+    # differences are between pixels so are half a pixel along
+    positions = np.arange(diffs.shape[1]) + 0.5
+
+    slope, intercept = 0.0, 0.0
+    weights = diffs
+    for _ in range(2):
+        totals = np.sum(weights, axis=1)
+        valid = totals > 0
+        if np.count_nonzero(valid) < 2:
+            raise ValueError("Edge not found in the MTF ROI")
+        centroids = np.sum(weights * positions, axis=1)[valid] / totals[valid]
+        slope, intercept = np.polyfit(rows[valid], centroids, 1)
+        edge = slope * rows + intercept
+        weights = diffs * (np.abs(positions[np.newaxis, :] - edge[:, np.newaxis]) <= EDGE_WINDOW)
+    return float(slope), float(intercept)
+
+
+def edge_spread(pixels: np.ndarray,
+                pixel_along: float,
+                pixel_across: float,
+                oversample: int = OVERSAMPLE) -> tuple[np.ndarray, float, float]:
+    """
+    Returns the oversampled edge spread function of an edge crossing the rows of `pixels`.
+
+    Parameters
+    ----------
+    pixels : np.ndarray
+        2D array with the edge crossing each row.
+    pixel_along : float
+        The pixel size along the rows in mm.
+    pixel_across : float
+        The pixel size between rows in mm.
+    oversample : int, optional
+        The number of bins per pixel (default is `OVERSAMPLE`).
+
+    Returns
+    -------
+    tuple[np.ndarray, float, float]
+        (edge spread function, bin size in mm, edge angle in degrees)
+    """
+    pixels = np.asarray(pixels, dtype=float)
+    slope, intercept = edge_line(pixels)
+    # the slope in mm, the edge angle from the rows
+    slope_mm = slope * pixel_along / pixel_across
+    cos_angle = 1 / math.sqrt(1 + slope_mm**2)
+
+    rows, columns = np.indices(pixels.shape)
+    distances = (columns - slope * rows - intercept) * pixel_along * cos_angle
+    bin_size = pixel_along * cos_angle / oversample
+    bins = np.floor((distances - np.min(distances)) / bin_size).astype(int).ravel()
+
+    counts = np.bincount(bins)
+    sums = np.bincount(bins, weights=pixels.ravel())
+    filled = counts > 0
+    centres = np.arange(counts.shape[0])
+    # bins with no pixels, e.g. for an edge along the grid, are interpolated
+    esf = np.interp(centres, centres[filled], sums[filled] / counts[filled])
+    return esf, bin_size, math.degrees(math.atan(slope_mm))
+
+
+def level_frequency(frequencies: np.ndarray,
+                    mtf: np.ndarray,
+                    level: float,
+                    limit: float = math.inf) -> float:
+    """
+    Returns the frequency the MTF first falls below `level` percent,
+    interpolated between samples, nan if it does not or the frequency is above `limit`.
+    """
+    fraction = level / 100
+    below = np.flatnonzero(mtf < fraction)
+    if below.size == 0 or below[0] == 0:
+        return math.nan
+    i = below[0]
+    frequency = float(np.interp(fraction,
+                                [mtf[i], mtf[i - 1]],
+                                [frequencies[i], frequencies[i - 1]]))
+    if frequency > limit:
+        return math.nan
+    return frequency
+
+
+def edge_mtf(pixels: np.ndarray,
+             pixel_along: float,
+             pixel_across: float,
+             oversample: int = OVERSAMPLE) -> EdgeMTF:
+    """
+    Measures the MTF along the rows of `pixels` from an edge crossing each row,
+    see `edge_spread` for the parameters.
+    The line spread function is windowed about its peak
+    and the MTF corrected for the finite difference used to find it.
+    Levels above the Nyquist frequency of the rows are nan.
+    If the edge moves less than `MIN_EDGE_SHIFT` pixels across the rows
+    the edge spread function is the mean of the rows, not oversampled,
+    and the result is flagged by `EdgeMTF.oversampled`.
+
+    Raises
+    ------
+    ValueError
+        If no edge is found.
+    """
+    esf, bin_size, angle = edge_spread(pixels, pixel_along, pixel_across, oversample)
+    shift = abs(math.tan(math.radians(angle))) * pixel_across / pixel_along * (len(pixels) - 1)
+    oversampled = shift >= MIN_EDGE_SHIFT
+    if not oversampled:
+        esf = np.mean(np.asarray(pixels, dtype=float), axis=0)
+        bin_size = pixel_along
+
+    lsf = np.diff(esf)
+    if lsf.size < 3:
+        raise ValueError("MTF ROI too small")
+
+    peak = int(np.argmax(np.abs(lsf)))
+    half = min(peak, lsf.size - 1 - peak)
+    lsf = lsf[peak - half:peak + half + 1] * np.hanning(2 * half + 3)[1:-1]
+
+    length = FFT_PADDING * lsf.size
+    spectrum = np.abs(np.fft.rfft(lsf, n=length))
+    if spectrum[0] == 0:
+        raise ValueError("Edge not found in the MTF ROI")
+    frequencies = np.fft.rfftfreq(length, bin_size)
+    mtf = spectrum / spectrum[0] / np.sinc(frequencies * bin_size)
+    nyquist = 0.5 / pixel_along
+    return EdgeMTF(angle,
+                   frequencies,
+                   mtf,
+                   *(level_frequency(frequencies, mtf, level, nyquist) for level in MTF_LEVELS),
+                   oversampled)
+
+
+def edge_status(edge: EdgeMTF) -> str:
+    """
+    Returns `OVERSAMPLED_STATUS`, or `GRID_EDGE_STATUS` if the edge was too square to oversample.
+    """
+    if edge.oversampled:
+        return OVERSAMPLED_STATUS
+    return GRID_EDGE_STATUS
+
+
+def box_mtf(image_array: np.ndarray,
+            bounds: BoxBounds,
+            direction: Literal["Horizontal", "Vertical"],
+            pixel_size: tuple[float, float, float],
+            oversample: int = OVERSAMPLE) -> EdgeMTF:
+    """
+    Measures the MTF from the edge in the box given by `bounds`
+    along the horizontal or vertical `direction` it is crossed.
+    """
+    pixels = box_pixels(image_array, bounds)
+    if direction == "Vertical":
+        return edge_mtf(pixels.T, pixel_size[1], pixel_size[2], oversample)
+    return edge_mtf(pixels, pixel_size[2], pixel_size[1], oversample)
+
+
+def direction_edges(phase_dir: str) -> dict[str, str]:
+    """
+    Returns the MTF edge, keyed as in `mtf_rois`, used for the "phase" and "freq" encode directions,
+    matching `kernels.resolution.direction_inserts`.
+
+    Parameters
+    ----------
+    phase_dir : str
+        The in-plane phase encoding direction, "ROW" or "COL".
+    """
+    if phase_dir == "ROW":
+        return {"phase": "vertical", "freq": "horizontal"}
+    return {"phase": "horizontal", "freq": "vertical"}
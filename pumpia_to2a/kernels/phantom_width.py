@@ -0,0 +1,190 @@
+"""
+Phantom width of TO2A Phantom without any GUI.
+"""
+import math
+import statistics
+from collections.abc import Iterable
+
+import numpy as np
+from scipy.ndimage import map_coordinates
+
+from pumpia.utilities.array_utils import nth_max_bounds
+
+from pumpia_to2a.kernels.context import TO2AContext
+from pumpia_to2a.kernels.profiles import LineEnds
+from pumpia_to2a.kernels.layout import (HALF_LINE_LENGTH,
+                                        SPOKES,
+                                        SPOKE_LINES,
+                                        PhantomTransform,
+                                        place_lines)
+
+# distances in mm
+SAMPLE_STEP = 0.5
+DEFAULT_NUM_SPOKES = 36
+
+
+def spoke_lines(context: TO2AContext,
+                pixel_size: tuple[float, float, float]) -> dict[str, LineEnds]:
+    """
+    Returns the end points of the lines across the phantom, keyed by the names in `SPOKES`,
+    placed from `kernels.layout.SPOKE_LINES`.
+    The lines are rotated with the phantom.
+    """
+    return place_lines(SPOKE_LINES, PhantomTransform.from_context(context, pixel_size, False))
+
+
+def lines_centre(lines: Iterable[LineEnds]) -> tuple[float, float]:
+    """
+    Returns the (x, y) centre of the phantom in pixels as the mean of the midpoints of `lines`,
+    the diameters from `spoke_lines`, so the centre follows lines that have been moved.
+    """
+    ends = np.array(list(lines), dtype=float)
+    return float(np.mean(ends[:, [0, 2]])), float(np.mean(ends[:, [1, 3]]))
+
+
+def spoke_unit_length(name: str,
+                      pixel_size: tuple[float, float, float],
+                      rotation: float = 0) -> float:
+    """
+    Returns the length in mm of one profile step along the line `name`,
+    with the phantom rotated by `rotation` degrees.
+    """
+    x_factor, y_factor = SPOKES[name]
+    if rotation != 0:
+        theta = math.radians(rotation)
+        x_factor, y_factor = (x_factor * math.cos(theta) - y_factor * math.sin(theta),
+                              x_factor * math.sin(theta) + y_factor * math.cos(theta))
+    return math.dist([pixel_size[1] * abs(y_factor), pixel_size[2] * abs(x_factor)], [0, 0])
+
+
+def spoke_width(profile: np.ndarray, unit_length: float, max_perc: float = 20) -> float:
+    """
+    Returns the width of the phantom in mm along a line profile.
+    """
+    divisor = 100 / max_perc
+    return float(nth_max_bounds(profile, divisor).difference * unit_length)
+
+
+def average_width(widths: dict[str, float], include: dict[str, bool] | None = None) -> float:
+    """
+    Returns the mean of `widths`, only including those set to True in `include` if given.
+    """
+    if include is None:
+        return statistics.fmean(widths.values())
+    return statistics.fmean([width for name, width in widths.items() if include[name]])
+
+
+def spoke_angles(num_spokes: int, rotation: float = 0) -> np.ndarray:
+    """
+    Returns the angles in degrees of `num_spokes` diameters equally spaced over 180 degrees,
+    starting from the x axis of the phantom rotated by `rotation` degrees.
+    """
+    return rotation + np.arange(num_spokes) * 180 / num_spokes
+
+
+def sample_spokes(image_array: np.ndarray,
+                  xcent: float,
+                  ycent: float,
+                  pixel_height: float,
+                  pixel_width: float,
+                  angles: np.ndarray,
+                  half_length: float = HALF_LINE_LENGTH,
+                  step: float = SAMPLE_STEP) -> np.ndarray:
+    """
+    Samples profiles along diameters through the centre at `angles` in degrees,
+    with a spacing of `step` mm along every diameter.
+    All diameters are sampled with linear interpolation in one call,
+    points outside the image are 0.
+
+    Returns
+    -------
+    np.ndarray
+        Profiles of shape (number of angles, samples per diameter).
+    """
+    radii = np.arange(-half_length, half_length + step / 2, step)
+    theta = np.radians(angles)
+    xs = xcent + np.outer(np.cos(theta), radii) / pixel_width
+    ys = ycent + np.outer(np.sin(theta), radii) / pixel_height
+    return map_coordinates(image_array, [ys, xs], order=1, mode="constant", cval=0)
+
+
+def profile_widths(profiles: np.ndarray, step: float, max_perc: float = 20) -> np.ndarray:
+    """
+    Returns the width in mm of the phantom along each row of `profiles`,
+    sampled every `step` mm.
+    Edges are the first and last crossings of the same level as `spoke_width`,
+    linearly interpolated between samples for every row at once.
+    Rows with fewer than 2 crossings have a width of nan.
+    """
+    divisor = 100 / max_perc
+    minimum = np.min(profiles, axis=1, keepdims=True)
+    maximum = np.max(profiles, axis=1, keepdims=True)
+    level = (maximum + minimum) / divisor
+
+    above = profiles >= level
+    crossings = above[:, :-1] != above[:, 1:]
+    num_crossings = np.count_nonzero(crossings, axis=1)
+    first = np.argmax(crossings, axis=1)
+    last = crossings.shape[1] - 1 - np.argmax(crossings[:, ::-1], axis=1)
+
+    rows = np.arange(profiles.shape[0])
+    level = level[:, 0]
+
+    def crossing_position(index: np.ndarray) -> np.ndarray:
+        left = profiles[rows, index]
+        right = profiles[rows, index + 1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return index + np.abs((level - left) / (right - left))
+
+    widths = (crossing_position(last) - crossing_position(first)) * step
+    return np.where(num_crossings >= 2, widths, np.nan)
+
+
+def dense_widths(image_array: np.ndarray,
+                 context: TO2AContext,
+                 pixel_size: tuple[float, float, float],
+                 num_spokes: int = DEFAULT_NUM_SPOKES,
+                 max_perc: float = 20) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the phantom width along `num_spokes` diameters,
+    rotated with the phantom.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        (angles in degrees relative to the phantom, widths in mm)
+    """
+    return centred_widths(image_array,
+                          context.xcent,
+                          context.ycent,
+                          context.rotation,
+                          pixel_size,
+                          num_spokes,
+                          max_perc)
+
+
+def centred_widths(image_array: np.ndarray,
+                   xcent: float,
+                   ycent: float,
+                   rotation: float,
+                   pixel_size: tuple[float, float, float],
+                   num_spokes: int = DEFAULT_NUM_SPOKES,
+                   max_perc: float = 20) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the phantom width along `num_spokes` diameters through (`xcent`, `ycent`),
+    rotated by `rotation` degrees, as `dense_widths` without a context,
+    e.g. about the centre of drawn lines given by `lines_centre`.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        (angles in degrees relative to the phantom, widths in mm)
+    """
+    angles = spoke_angles(num_spokes)
+    profiles = sample_spokes(image_array,
+                             xcent,
+                             ycent,
+                             pixel_size[1],
+                             pixel_size[2],
+                             angles + rotation)
+    return angles, profile_widths(profiles, SAMPLE_STEP, max_perc)
@@ -0,0 +1,187 @@
+"""
+Profile extraction matching the pumpia ROI profiles
+"""
+import math
+from typing import Literal
+
+import numpy as np
+from scipy.ndimage import map_coordinates
+
+# (xmin, xmax, ymin, ymax) in pixels, max values are non-inclusive
+BoxBounds = tuple[int, int, int, int]
+
+# (slice_thickness, row_spacing, column_spacing) in mm, as given by `Instance.pixel_size`
+PixelSize = tuple[float, float, float]
+
+# (x1, y1, x2, y2) in pixels
+LineEnds = tuple[int, int, int, int]
+
+
+def rotated_box_coordinates(bounds: BoxBounds,
+                            rotation: float,
+                            pixel_size: PixelSize) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (y, x) coordinates in pixels of the pixel centres of `bounds`
+    rotated by `rotation` degrees about the centre of the box,
+    using the convention of `kernels.rotation` and working in mm so non square pixels are handled.
+    Each has the shape of the box, (ymax - ymin, xmax - xmin).
+    """
+    xmin, xmax, ymin, ymax = bounds
+    pixel_height, pixel_width = pixel_size[1], pixel_size[2]
+    xcent = (xmin + xmax - 1) / 2
+    ycent = (ymin + ymax - 1) / 2
+    x_mm = (np.arange(xmin, xmax) - xcent)[np.newaxis, :] * pixel_width
+    y_mm = (np.arange(ymin, ymax) - ycent)[:, np.newaxis] * pixel_height
+    theta = math.radians(rotation)
+    cos = math.cos(theta)
+    sin = math.sin(theta)
+    xs = xcent + (x_mm * cos - y_mm * sin) / pixel_width
+    ys = ycent + (x_mm * sin + y_mm * cos) / pixel_height
+    return ys, xs
+
+
+def box_pixels(image_array: np.ndarray,
+               bounds: BoxBounds,
+               rotation: float = 0,
+               pixel_size: PixelSize = (1, 1, 1)) -> np.ndarray:
+    """
+    Returns the pixels in `bounds` as a `RectangleROI` would,
+    with any part outside of `image_array` set to 0.
+
+    If `rotation` is not 0 the box is sampled rotated by `rotation` degrees about its centre,
+    see `rotated_box_coordinates`, with linear interpolation,
+    so the rows and columns of the returned array follow the rotated phantom axes.
+    """
+    if rotation != 0:
+        return map_coordinates(image_array,
+                               rotated_box_coordinates(bounds, rotation, pixel_size),
+                               output=float,
+                               order=1,
+                               mode="constant",
+                               cval=0)
+
+    xmin, xmax, ymin, ymax = bounds
+    pixel_array = np.zeros((ymax - ymin, xmax - xmin))
+
+    xmin_i = max(0, xmin)
+    xmax_i = min(image_array.shape[1], xmax)
+    ymin_i = max(0, ymin)
+    ymax_i = min(image_array.shape[0], ymax)
+
+    if xmin_i < xmax_i and ymin_i < ymax_i:
+        pixel_array[ymin_i - ymin:ymax_i - ymin,
+                    xmin_i - xmin:xmax_i - xmin] = image_array[ymin_i:ymax_i, xmin_i:xmax_i]
+
+    return pixel_array
+
+
+def box_profile(image_array: np.ndarray,
+                bounds: BoxBounds,
+                direction: Literal["Horizontal", "Vertical"],
+                rotation: float = 0,
+                pixel_size: PixelSize = (1, 1, 1)) -> np.ndarray:
+    """
+    Returns the horizontal or vertical profile of the box given by `bounds`.
+    Equivalent to `RectangleROI.h_profile` and `RectangleROI.v_profile`,
+    or taken along the rotated box if `rotation` is given, see `box_pixels`.
+    """
+    if direction == "Horizontal":
+        return np.sum(box_pixels(image_array, bounds, rotation, pixel_size), axis=0)
+    return np.sum(box_pixels(image_array, bounds, rotation, pixel_size), axis=1)
+
+
+def box_row_profiles(image_array: np.ndarray,
+                     bounds: BoxBounds,
+                     direction: Literal["Horizontal", "Vertical"],
+                     bin_rows: int = 1,
+                     rotation: float = 0,
+                     pixel_size: PixelSize = (1, 1, 1)) -> np.ndarray:
+    """
+    Returns the profiles of the box given by `bounds` along `direction` for each row across it,
+    summed over bins of `bin_rows` rows, as an array of shape (bins, profile length).
+    The last bin has fewer rows if the box is not a multiple of `bin_rows` wide.
+    The bins sum to `box_profile`, the box is rotated as `box_pixels`.
+    """
+    pixels = box_pixels(image_array, bounds, rotation, pixel_size)
+    if direction == "Vertical":
+        pixels = pixels.T
+    starts = np.arange(0, pixels.shape[0], max(1, bin_rows))
+    return np.add.reduceat(pixels, starts, axis=0)
+
+
+def stack_box_profiles(image_stack: np.ndarray,
+                       bounds: BoxBounds,
+                       direction: Literal["Horizontal", "Vertical"],
+                       rotation: float = 0,
+                       pixel_size: PixelSize = (1, 1, 1)) -> np.ndarray:
+    """
+    Returns `box_profile` for every slice of a 3D (slice, y, x) array,
+    as an array of shape (slices, profile length).
+    """
+    if rotation != 0:
+        coordinates = rotated_box_coordinates(bounds, rotation, pixel_size)
+        pixel_stack = np.stack([map_coordinates(image,
+                                                coordinates,
+                                                output=float,
+                                                order=1,
+                                                mode="constant",
+                                                cval=0)
+                                for image in image_stack])
+        axis = 1 if direction == "Horizontal" else 2
+        return np.sum(pixel_stack, axis=axis)
+
+    xmin, xmax, ymin, ymax = bounds
+    pixel_stack = np.zeros((image_stack.shape[0], ymax - ymin, xmax - xmin))
+
+    xmin_i = max(0, xmin)
+    xmax_i = min(image_stack.shape[2], xmax)
+    ymin_i = max(0, ymin)
+    ymax_i = min(image_stack.shape[1], ymax)
+
+    if xmin_i < xmax_i and ymin_i < ymax_i:
+        pixel_stack[:,
+                    ymin_i - ymin:ymax_i - ymin,
+                    xmin_i - xmin:xmax_i - xmin] = image_stack[:, ymin_i:ymax_i, xmin_i:xmax_i]
+
+    if direction == "Horizontal":
+        return np.sum(pixel_stack, axis=1)
+    return np.sum(pixel_stack, axis=2)
+
+
+def pad_profiles(profiles: list[np.ndarray]) -> np.ndarray:
+    """
+    Stacks profiles of different lengths into one array of shape (profiles, longest length).
+    Shorter profiles are padded by repeating their last value,
+    which adds no crossings and does not change their minimum or maximum.
+    """
+    length = max(len(profile) for profile in profiles)
+    return np.stack([np.pad(np.asarray(profile, dtype=float),
+                            (0, length - len(profile)),
+                            mode="edge")
+                     for profile in profiles])
+
+
+def line_profile(image_array: np.ndarray, ends: LineEnds) -> np.ndarray:
+    """
+    Returns the nearest neighbour profile along the line given by `ends`.
+    Equivalent to `LineROI.profile`.
+    """
+    x1, y1, x2, y2 = ends
+    length = math.sqrt((x1 - x2)**2 + (y1 - y2)**2)
+    num_points = round(length) + 1
+    if length == 0:
+        x_frac = 1
+        y_frac = 1
+    else:
+        x_frac = (x2 - x1) / length
+        y_frac = (y2 - y1) / length
+
+    steps = np.arange(num_points)
+    xs = np.round(x1 + steps * x_frac).astype(int)
+    ys = np.round(y1 + steps * y_frac).astype(int)
+    inside = ((xs >= 0) & (xs < image_array.shape[1])
+              & (ys >= 0) & (ys < image_array.shape[0]))
+
+    profile = np.zeros(num_points)
+    profile[inside] = image_array[ys[inside], xs[inside]]
+    return profile
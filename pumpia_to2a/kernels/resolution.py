@@ -0,0 +1,192 @@
+"""
+Resolution inserts of TO2A Phantom without any GUI.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+from scipy import ndimage
+
+from pumpia_to2a.kernels.context import TO2AContext
+from pumpia_to2a.kernels.profiles import BoxBounds, PixelSize, box_profile, pad_profiles
+from pumpia_to2a.kernels.layout import PhantomTransform, insert_boxes, place_boxes
+
+# number of troughs seen when an insert is resolved
+RESOLVED_TROUGHS = 5
+
+INSERT_SIZES = ("2", "1_5", "1")
+
+
+def insert_rois(context: TO2AContext,
+                pixel_size: tuple[float, float, float]) -> dict[str, BoxBounds]:
+    """
+    Returns the bounds of the resolution insert ROIs,
+    placed from `kernels.layout.OTHER_SIDE_INSERTS` and `kernels.layout.WEDGE_SIDE_INSERTS`.
+    Keys are "horizontal_2", "horizontal_1_5", "horizontal_1",
+    "vertical_2", "vertical_1_5" and "vertical_1".
+    Horizontal inserts should use the horizontal profile and vertical inserts the vertical profile.
+    The ROIs are moved with the rotation of the phantom.
+    """
+    transform = PhantomTransform.from_context(context, pixel_size)
+    return place_boxes(insert_boxes(transform), transform)
+
+
+def insert_profiles(image_array: np.ndarray,
+                    bounds: dict[str, BoxBounds],
+                    rotation: float = 0,
+                    pixel_size: PixelSize = (1, 1, 1)) -> dict[str, np.ndarray]:
+    """
+    Returns the profile across the bars of each insert given by `insert_rois`,
+    the vertical profile for vertical inserts and the horizontal profile for horizontal inserts.
+    The profiles are taken along the phantom axes rotated by `rotation`, see `box_pixels`.
+    """
+    profiles: dict[str, np.ndarray] = {}
+    for name, box in bounds.items():
+        if name.startswith("vertical"):
+            profiles[name] = box_profile(image_array, box, "Vertical", rotation, pixel_size)
+        else:
+            profiles[name] = box_profile(image_array, box, "Horizontal", rotation, pixel_size)
+    return profiles
+
+
+@dataclass
+class InsertResult:
+    """
+    The result for one resolution insert.
+
+    Attributes
+    ----------
+    troughs : int
+        The number of troughs seen.
+    modulation : float
+        The modulation depth (peak - trough) / (peak + trough) of the bars,
+        from the mean of the peak maxima and trough minima, 0 if no troughs are seen.
+    resolved : bool
+        If `RESOLVED_TROUGHS` troughs are seen.
+    """
+    troughs: int
+    modulation: float
+    resolved: bool
+
+
+def trough_stats(profiles: np.ndarray, max_perc: float = 50) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Counts the troughs and finds the modulation depth of every row of `profiles`
+    in one pass.
+    Troughs are runs below the same level as `nth_max_troughs`
+    with a crossing on both sides,
+    peaks are the runs above the level from the one before the first trough
+    to the one after the last trough.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        (number of troughs, modulation depth) for each row
+    """
+    profiles = np.asarray(profiles, dtype=float)
+    num_rows, length = profiles.shape
+    divisor = 100 / max_perc
+    level = (np.max(profiles, axis=1) + np.min(profiles, axis=1)) / divisor
+
+    above = profiles >= level[:, np.newaxis]
+    starts = np.ones(profiles.shape, dtype=bool)
+    starts[:, 1:] = above[:, 1:] != above[:, :-1]
+    run_index = np.cumsum(starts, axis=1) - 1
+    last_run = run_index[:, -1]
+
+    # one entry per run of samples on the same side of the level
+    run_rows, run_cols = np.nonzero(starts)
+    run_numbers = run_index[run_rows, run_cols]
+    run_above = above[run_rows, run_cols]
+    labels = run_index + (np.arange(num_rows) * length)[:, np.newaxis]
+    run_labels = labels[run_rows, run_cols]
+    run_max = np.asarray(ndimage.maximum(profiles, labels, run_labels))
+    run_min = np.asarray(ndimage.minimum(profiles, labels, run_labels))
+
+    is_trough = ~run_above & (run_numbers > 0) & (run_numbers < last_run[run_rows])
+    troughs = np.bincount(run_rows, weights=is_trough, minlength=num_rows).astype(int)
+
+    # runs alternate so the first and last troughs are next to the ends of each row
+    first_trough = np.where(above[:, 0], 1, 2)
+    last_trough = np.where(above[:, -1], last_run - 1, last_run - 2)
+    is_peak = (run_above
+               & (troughs[run_rows] > 0)
+               & (run_numbers >= first_trough[run_rows] - 1)
+               & (run_numbers <= last_trough[run_rows] + 1))
+
+    num_peaks = np.bincount(run_rows, weights=is_peak, minlength=num_rows)
+    peak_sum = np.bincount(run_rows, weights=np.where(is_peak, run_max, 0), minlength=num_rows)
+    trough_sum = np.bincount(run_rows, weights=np.where(is_trough, run_min, 0), minlength=num_rows)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        peak_mean = peak_sum / num_peaks
+        trough_mean = trough_sum / troughs
+        modulation = (peak_mean - trough_mean) / (peak_mean + trough_mean)
+    modulation = np.where((troughs > 0) & np.isfinite(modulation), modulation, 0.0)
+
+    return troughs, modulation
+
+
+def analyse_inserts(profiles: dict[str, np.ndarray],
+                    max_perc: float = 50) -> dict[str, InsertResult]:
+    """
+    Analyses the profiles of all inserts together,
+    keyed as in `insert_rois`.
+    """
+    names = list(profiles.keys())
+    troughs, modulation = trough_stats(pad_profiles([profiles[name] for name in names]), max_perc)
+    return {name: InsertResult(int(troughs[i]),
+                               float(modulation[i]),
+                               bool(troughs[i] == RESOLVED_TROUGHS))
+            for i, name in enumerate(names)}
+
+
+def count_troughs(profile: np.ndarray, max_perc: float = 50) -> int:
+    """
+    Returns the number of troughs seen in an insert profile.
+    """
+    return int(trough_stats(profile[np.newaxis], max_perc)[0][0])
+
+
+def direction_inserts(phase_dir: str) -> dict[str, str]:
+    """
+    Returns the insert, keyed as in `insert_rois`, used for each encode direction and size.
+    Keys are "phase_2", "phase_1_5", "phase_1", "freq_2", "freq_1_5" and "freq_1".
+
+    Parameters
+    ----------
+    phase_dir : str
+        The in-plane phase encoding direction, "ROW" or "COL".
+    """
+    if phase_dir == "ROW":
+        phase_inserts = "vertical"
+        freq_inserts = "horizontal"
+    else:
+        phase_inserts = "horizontal"
+        freq_inserts = "vertical"
+
+    inserts: dict[str, str] = {}
+    for size in INSERT_SIZES:
+        inserts["phase_" + size] = phase_inserts + "_" + size
+    for size in INSERT_SIZES:
+        inserts["freq_" + size] = freq_inserts + "_" + size
+    return inserts
+
+
+def insert_results(troughs: dict[str, int], phase_dir: str) -> dict[str, bool]:
+    """
+    Maps the troughs seen for each insert onto the phase and frequency encode directions.
+
+    Parameters
+    ----------
+    troughs : dict[str, int]
+        Troughs seen keyed as in `insert_rois`.
+    phase_dir : str
+        The in-plane phase encoding direction, "ROW" or "COL".
+
+    Returns
+    -------
+    dict[str, bool]
+        If each insert is resolved, keyed as in `direction_inserts`.
+    """
+    return {key: troughs[name] == RESOLVED_TROUGHS
+            for key, name in direction_inserts(phase_dir).items()}
@@ -0,0 +1,200 @@
+"""
+In plane rotation of TO2A Phantom without any GUI.
+
+Rotations are in degrees, positive rotations turn the +x axis towards the +y axis of the image,
+i.e. clockwise as displayed as the y axis points down.
+"""
+import math
+
+import numpy as np
+from scipy.ndimage import map_coordinates
+
+from pumpia.utilities.typing import SideType
+
+from pumpia_to2a.kernels.profiles import BoxBounds, LineEnds
+
+# unit vectors of each side in image coordinates
+SIDE_VECTORS: dict[SideType, tuple[int, int]] = {"top": (0, -1),
+                                                 "bottom": (0, 1),
+                                                 "left": (-1, 0),
+                                                 "right": (1, 0)}
+
+# regions of the phantom with structure (xmin, xmax, ymin, ymax) in mm,
+# in the phantom frame where x points away from the MTF box and y towards the wedges.
+TEMPLATE_REGIONS: tuple[tuple[float, float, float, float], ...] = (
+    # MTF block
+    (-80, -45, -15, 15),
+    # wedges block
+    (-45, 45, 38, 78),
+    # resolution inserts furthest from the wedges
+    (43, 67, -20, -9),
+    (43, 63, -41, -30),
+    (43, 59, -61, -50),
+    # resolution inserts closest to the wedges
+    (31, 42, 10, 34),
+    (51, 62, 10, 30),
+    (71, 82, 10, 26))
+
+# annulus sampled for the angular profile in mm
+ANNULUS_INNER = 20
+ANNULUS_OUTER = 80
+ANNULUS_STEP = 1
+ANGULAR_SAMPLES = 720
+
+# rotations found outside these limits, or with a lower confidence, are treated as 0
+MAX_ROTATION = 15
+MIN_ROTATION = 1
+MIN_CONFIDENCE = 0.3
+
+
+def angular_profile(image_array: np.ndarray,
+                    xcent: float,
+                    ycent: float,
+                    pixel_height: float,
+                    pixel_width: float) -> np.ndarray:
+    """
+    Resamples an annulus around the centre into polar coordinates and
+    returns the mean absolute deviation from the annulus median at each angle,
+    relative to that median.
+    Angles are `ANGULAR_SAMPLES` equal steps from the +x axis towards the +y axis.
+    """
+    radii = np.arange(ANNULUS_INNER, ANNULUS_OUTER + ANNULUS_STEP, ANNULUS_STEP, dtype=float)
+    angles = np.linspace(0, 2 * np.pi, ANGULAR_SAMPLES, endpoint=False)
+    xs = xcent + np.outer(radii, np.cos(angles)) / pixel_width
+    ys = ycent + np.outer(radii, np.sin(angles)) / pixel_height
+
+    polar = map_coordinates(image_array, [ys, xs], order=1, mode="nearest")
+    median = np.median(polar)
+    if median == 0:
+        median = 1
+    return np.mean(np.abs(polar - median), axis=0) / abs(median)
+
+
+def template_profile(mtf_side: SideType, wedges_side: SideType) -> np.ndarray:
+    """
+    Returns the fraction of the annulus covered by `TEMPLATE_REGIONS` at each angle
+    of `angular_profile` for an unrotated phantom in the given orientation.
+    """
+    x_dir = -np.array(SIDE_VECTORS[mtf_side], dtype=float)
+    y_dir = np.array(SIDE_VECTORS[wedges_side], dtype=float)
+
+    radii = np.arange(ANNULUS_INNER, ANNULUS_OUTER + ANNULUS_STEP, ANNULUS_STEP, dtype=float)
+    angles = np.linspace(0, 2 * np.pi, ANGULAR_SAMPLES, endpoint=False)
+    dx = np.outer(radii, np.cos(angles))
+    dy = np.outer(radii, np.sin(angles))
+    phantom_x = dx * x_dir[0] + dy * x_dir[1]
+    phantom_y = dx * y_dir[0] + dy * y_dir[1]
+
+    covered = np.zeros(dx.shape, dtype=bool)
+    for xmin, xmax, ymin, ymax in TEMPLATE_REGIONS:
+        covered |= ((phantom_x >= xmin) & (phantom_x <= xmax)
+                    & (phantom_y >= ymin) & (phantom_y <= ymax))
+    return np.mean(covered, axis=0)
+
+
+def estimate_rotation(image_array: np.ndarray,
+                      xcent: float,
+                      ycent: float,
+                      pixel_height: float,
+                      pixel_width: float,
+                      mtf_side: SideType,
+                      wedges_side: SideType,
+                      max_rotation: float = MAX_ROTATION) -> tuple[float, float]:
+    """
+    Estimates the in plane rotation of the phantom by circular cross correlation,
+    using FFTs, of the angular profile of the image against the template profile.
+
+    Returns
+    -------
+    tuple[float, float]
+        (rotation in degrees, confidence)
+        The confidence is the correlation coefficient of the profiles at the rotation found.
+    """
+    profile = angular_profile(image_array, xcent, ycent, pixel_height, pixel_width)
+    template = template_profile(mtf_side, wedges_side)
+    profile = profile - np.mean(profile)
+    template = template - np.mean(template)
+    norm = np.linalg.norm(profile) * np.linalg.norm(template)
+    if norm == 0:
+        return 0.0, 0.0
+
+    correlation = np.fft.irfft(np.fft.rfft(profile) * np.conj(np.fft.rfft(template)),
+                               n=ANGULAR_SAMPLES) / norm
+
+    step = 360 / ANGULAR_SAMPLES
+    max_lag = int(max_rotation / step)
+    lags = np.arange(-max_lag, max_lag + 1)
+    values = correlation[lags % ANGULAR_SAMPLES]
+    peak = int(np.argmax(values))
+    lag = float(lags[peak])
+
+    # parabolic interpolation for sub sample accuracy
+    if 0 < peak < len(values) - 1:
+        before, at, after = values[peak - 1:peak + 2]
+        denominator = before - 2 * at + after
+        if denominator != 0:
+            lag += 0.5 * (before - after) / denominator
+
+    return lag * step, float(values[peak])
+
+
+def rotate_point(x: float,
+                 y: float,
+                 xcent: float,
+                 ycent: float,
+                 rotation: float,
+                 pixel_height: float,
+                 pixel_width: float) -> tuple[float, float]:
+    """
+    Rotates a point about the centre, working in mm so non square pixels are handled.
+    """
+    if rotation == 0:
+        return x, y
+    theta = math.radians(rotation)
+    cos = math.cos(theta)
+    sin = math.sin(theta)
+    dx = (x - xcent) * pixel_width
+    dy = (y - ycent) * pixel_height
+    return (xcent + (dx * cos - dy * sin) / pixel_width,
+            ycent + (dx * sin + dy * cos) / pixel_height)
+
+
+def rotate_bounds(bounds: BoxBounds,
+                  xcent: float,
+                  ycent: float,
+                  rotation: float,
+                  pixel_height: float,
+                  pixel_width: float) -> BoxBounds:
+    """
+    Moves a box so its centre is rotated about the centre.
+    The box stays aligned to the image axes as rectangle ROIs can not be rotated.
+    """
+    if rotation == 0:
+        return bounds
+    xmin, xmax, ymin, ymax = bounds
+    box_x, box_y = rotate_point((xmin + xmax) / 2,
+                                (ymin + ymax) / 2,
+                                xcent,
+                                ycent,
+                                rotation,
+                                pixel_height,
+                                pixel_width)
+    xshift = round(box_x - (xmin + xmax) / 2)
+    yshift = round(box_y - (ymin + ymax) / 2)
+    return (xmin + xshift, xmax + xshift, ymin + yshift, ymax + yshift)
+
+
+def rotate_line(ends: LineEnds,
+                xcent: float,
+                ycent: float,
+                rotation: float,
+                pixel_height: float,
+                pixel_width: float) -> LineEnds:
+    """
+    Rotates both ends of a line about the centre.
+    """
+    if rotation == 0:
+        return ends
+    x1, y1 = rotate_point(ends[0], ends[1], xcent, ycent, rotation, pixel_height, pixel_width)
+    x2, y2 = rotate_point(ends[2], ends[3], xcent, ycent, rotation, pixel_height, pixel_width)
+    return (round(x1), round(y1), round(x2), round(y2))
@@ -0,0 +1,248 @@
+"""
+Slice width using TO2A wedges without any GUI.
+"""
+import math
+from collections.abc import Hashable
+from typing import Literal
+
+import numpy as np
+import pydicom
+
+from pumpia_to2a.instrumentation import profiler
+from pumpia_to2a.kernels.context import TO2AContext
+from pumpia_to2a.kernels.fitting import fit_profiles, fit_profiles_batch
+from pumpia_to2a.kernels.profiles import BoxBounds, pad_profiles
+from pumpia_to2a.kernels.layout import WEDGE_BOXES, PhantomTransform, place_boxes
+
+# modified z score above which a row fit is rejected, see `reject_outliers`
+OUTLIER_THRESHOLD = 3.5
+# ratio of the MAD to the standard deviation for normally distributed values
+MAD_RATIO = 0.6745
+# rows of the wedge ROIs summed for each fit when fitting rows
+DEFAULT_ROW_BIN = 2
+# relative reduction in cost at which a row fit is converged,
+# looser than for whole profiles as each row is noisier and outliers are rejected anyway
+ROW_TOLERANCE = 1e-6
+
+
+def wedge_rois(context: TO2AContext,
+               pixel_size: tuple[float, float, float]
+               ) -> tuple[Literal["Horizontal", "Vertical"], BoxBounds, BoxBounds]:
+    """
+    Returns the wedge direction and the bounds of the inside and outside wedge ROIs,
+    placed from `kernels.layout.WEDGE_BOXES`.
+    The ROIs are moved with the rotation of the phantom.
+    """
+    transform = PhantomTransform.from_context(context, pixel_size)
+    bounds = place_boxes(WEDGE_BOXES, transform)
+    return (transform.profile_direction(WEDGE_BOXES["inside_wedge"].profile_axis),
+            bounds["inside_wedge"],
+            bounds["outside_wedge"])
+
+
+def fit_wedge_profile(profile: np.ndarray,
+                      expected_width: float,
+                      warm_start_key: Hashable | None = None) -> np.ndarray:
+    """
+    Fits `split_gauss_integral` to a wedge profile.
+
+    Returns
+    -------
+    np.ndarray
+        The fitted (a, b, c, amp, baseline) parameters.
+    """
+    return fit_profiles([profile], expected_width, warm_start_key)[0]
+
+
+def fit_key(dataset: pydicom.Dataset | None, wedge_dir: str) -> tuple[str, str, str] | None:
+    """
+    Returns the key used to warm start fits, (station name, protocol, wedge direction).
+    The series description is used if there is no protocol name.
+    """
+    if dataset is None:
+        return None
+    protocol = str(dataset.get("ProtocolName", "") or dataset.get("SeriesDescription", ""))
+    return (str(dataset.get("StationName", "")), protocol, wedge_dir)
+
+
+def fit_fwhm(fit: np.ndarray, max_perc: float) -> float:
+    """
+    Returns the width of the fitted profile at `max_perc` percent of the maximum in pixels.
+    """
+    divisor = 100 / max_perc
+    c_coeff = 2 * math.sqrt(2 * math.log(divisor))
+    return abs(fit[1] - fit[0]) + c_coeff * abs(fit[2])
+
+
+def slice_widths(inside_prof: np.ndarray,
+                 outside_prof: np.ndarray,
+                 expected_width: float,
+                 pix_size: float,
+                 tan_theta: float = 0.25,
+                 max_perc: float = 50,
+                 warm_start_key: Hashable | None = None) -> tuple[float, float, float]:
+    """
+    Calculates the slice width from the inside and outside wedge profiles,
+    both profiles are fitted together.
+    If `warm_start_key`, e.g. the scanner and protocol, is given
+    the fits start from the last fit with the same key.
+
+    Returns
+    -------
+    tuple[float, float, float]
+        (inside wedge width, outside wedge width, slice width) in mm
+    """
+    with profiler.span("slice_width.fit"):
+        in_fit, out_fit = fit_profiles([inside_prof, outside_prof], expected_width, warm_start_key)
+
+    return widths_from_fits(in_fit, out_fit, pix_size, tan_theta, max_perc)
+
+
+def widths_from_fits(in_fit: np.ndarray,
+                     out_fit: np.ndarray,
+                     pix_size: float,
+                     tan_theta: float = 0.25,
+                     max_perc: float = 50) -> tuple[float, float, float]:
+    """
+    Calculates the slice width from the fitted inside and outside wedge profiles,
+    so the width at a different `max_perc` or `tan_theta` does not need the profiles fitting again.
+
+    Returns
+    -------
+    tuple[float, float, float]
+        (inside wedge width, outside wedge width, slice width) in mm
+    """
+    inside_width = fit_fwhm(in_fit, max_perc) * tan_theta * pix_size
+    outside_width = fit_fwhm(out_fit, max_perc) * tan_theta * pix_size
+
+    return inside_width, outside_width, math.sqrt(inside_width * outside_width)
+
+
+def slice_widths_stack(inside_profs: np.ndarray,
+                       outside_profs: np.ndarray,
+                       expected_width: float,
+                       pix_size: float,
+                       tan_theta: float = 0.25,
+                       max_perc: float = 50) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculates the slice width for every slice from stacks of inside and outside wedge profiles,
+    shape (slices, profile length), as given by `stack_box_profiles`.
+    The two stacks can have different profile lengths, e.g. if one ROI has been resized,
+    they are padded by `pad_profiles` so all profiles are fitted together by `fit_profiles_batch`,
+    any that do not converge are refitted on their own without the padding.
+    Slices where no fit is found have a width of nan.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        (inside wedge widths, outside wedge widths, slice widths) in mm
+    """
+    profiles = [*inside_profs, *outside_profs]
+    with profiler.span("slice_width.fit"):
+        fits, converged = fit_profiles_batch(pad_profiles(profiles))
+        for i in np.flatnonzero(~converged):
+            try:
+                fits[i] = fit_profiles([profiles[i]], expected_width)[0]
+            except RuntimeError:
+                fits[i] = np.nan
+
+    widths = fit_fwhm(fits.T, max_perc) * tan_theta * pix_size
+    num_slices = inside_profs.shape[0]
+    inside_widths = widths[:num_slices]
+    outside_widths = widths[num_slices:]
+    return inside_widths, outside_widths, np.sqrt(inside_widths * outside_widths)
+
+
+def width_summary(widths: np.ndarray) -> dict[str, float]:
+    """
+    Returns the mean, standard deviation, minimum and maximum of `widths`, ignoring nan.
+    """
+    return {"mean": float(np.nanmean(widths)),
+            "std": float(np.nanstd(widths)),
+            "min": float(np.nanmin(widths)),
+            "max": float(np.nanmax(widths))}
+
+
+def reject_outliers(values: np.ndarray, threshold: float = OUTLIER_THRESHOLD) -> np.ndarray:
+    """
+    Returns a mask of the finite `values` kept by the median absolute deviation (MAD) test,
+    values whose modified z score, `MAD_RATIO` * |value - median| / MAD,
+    is above `threshold` are rejected.
+    If the MAD is 0 only values equal to the median are kept.
+    """
+    values = np.asarray(values, dtype=float)
+    kept = np.isfinite(values)
+    if not np.any(kept):
+        return kept
+    deviation = np.abs(values - np.median(values[kept]))
+    mad = np.median(deviation[kept])
+    if mad == 0:
+        return kept & (deviation == 0)
+    return kept & (MAD_RATIO * deviation <= threshold * mad)
+
+
+def slice_widths_rows(inside_rows: np.ndarray,
+                      outside_rows: np.ndarray,
+                      pix_size: float,
+                      tan_theta: float = 0.25,
+                      max_perc: float = 50,
+                      threshold: float = OUTLIER_THRESHOLD
+                      ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculates the slice width from every row, or bin of rows, of the inside and outside wedges,
+    arrays of shape (rows, profile length) as given by `box_row_profiles`.
+    All rows are fitted together by `fit_profiles_batch`,
+    rows whose fit does not converge or whose width is rejected by `reject_outliers`
+    have a width of nan.
+    Rows of the two wedges are paired in order, so there is a slice width for each row
+    of the narrower wedge ROI and it is nan if either row is.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        (inside wedge widths, outside wedge widths, slice widths) in mm
+    """
+    num_inside = inside_rows.shape[0]
+    with profiler.span("slice_width.fit_rows"):
+        fits, converged = fit_profiles_batch(pad_profiles([*inside_rows, *outside_rows]),
+                                             tolerance=ROW_TOLERANCE)
+
+    widths = fit_fwhm(fits.T, max_perc) * tan_theta * pix_size
+    widths[~converged] = np.nan
+    inside_widths = widths[:num_inside]
+    outside_widths = widths[num_inside:]
+    inside_widths[~reject_outliers(inside_widths, threshold)] = np.nan
+    outside_widths[~reject_outliers(outside_widths, threshold)] = np.nan
+
+    num_pairs = min(len(inside_widths), len(outside_widths))
+    return (inside_widths,
+            outside_widths,
+            np.sqrt(inside_widths[:num_pairs] * outside_widths[:num_pairs]))
+
+
+def row_width_summary(inside_widths: np.ndarray,
+                      outside_widths: np.ndarray,
+                      slice_widths: np.ndarray) -> dict[str, float | int]:
+    """
+    Returns the distribution of the slice widths from `slice_widths_rows`, ignoring nan,
+    as `width_summary` with the "median", the slice width from the median wedge widths
+    ("slice_width") and the number of rows kept and rejected.
+    All values are nan if no rows are kept.
+    """
+    kept = np.isfinite(slice_widths)
+    rejected = int(np.sum(~np.isfinite(inside_widths)) + np.sum(~np.isfinite(outside_widths)))
+    if not np.any(kept):
+        return {"mean": math.nan,
+                "std": math.nan,
+                "min": math.nan,
+                "max": math.nan,
+                "median": math.nan,
+                "slice_width": math.nan,
+                "rows": 0,
+                "rejected": rejected}
+    return {**width_summary(slice_widths),
+            "median": float(np.median(slice_widths[kept])),
+            "slice_width": math.sqrt(float(np.nanmedian(inside_widths))
+                                     * float(np.nanmedian(outside_widths))),
+            "rows": int(np.sum(kept)),
+            "rejected": rejected}
@@ -0,0 +1,166 @@
+"""
+MTF from the edges of the TO2A Phantom MTF block
+"""
+from pumpia.module_handling.modules import PhantomModule
+from pumpia.module_handling.in_outs.roi_ios import BaseInputROI, InputRectangleROI
+from pumpia.module_handling.in_outs.viewer_ios import MonochromeDicomViewerIO
+from pumpia.module_handling.in_outs.simple import IntInput, StringOutput, FloatOutput
+from pumpia.image_handling.roi_structures import RectangleROI
+from pumpia.file_handling.dicom_structures import Series
+from pumpia.file_handling.dicom_tags import MRTags
+
+from pumpia_to2a.to2a_context import TO2AContextManagerGenerator, TO2AContext
+from pumpia_to2a.instrumentation import profiler, timed
+from pumpia_to2a.pixel_buffer import pixel_buffer
+from pumpia_to2a.roi_results import RoiResults, roi_signature
+from pumpia_to2a.background import ApplyFunction, JobFunction
+from pumpia_to2a.kernels.mtf import (OVERSAMPLE,
+                                     EdgeMTF,
+                                     mtf_rois,
+                                     box_mtf,
+                                     direction_edges,
+                                     edge_status)
+
+
+class TO2AMTF(PhantomModule):
+    """
+    Calculates the MTF from the edges of the TO2A MTF block using the slanted edge method
+    """
+    context_manager_generator = TO2AContextManagerGenerator()
+    show_draw_rois_button = True
+    show_analyse_button = True
+    name = "MTF"
+
+    viewer = MonochromeDicomViewerIO(row=0, column=0)
+
+    oversample = IntInput(OVERSAMPLE, verbose_name="Oversampling (bins per pixel)")
+
+    phase_dir = StringOutput(verbose_name="Phase Encode Direction",
+                             reset_on_analysis=True)
+
+    phase_mtf50 = FloatOutput(verbose_name="Phase Encode Direction MTF50 (cycles/mm)",
+                              reset_on_analysis=True)
+    phase_mtf10 = FloatOutput(verbose_name="Phase Encode Direction MTF10 (cycles/mm)",
+                              reset_on_analysis=True)
+    freq_mtf50 = FloatOutput(verbose_name="Frequency Encode Direction MTF50 (cycles/mm)",
+                             reset_on_analysis=True)
+    freq_mtf10 = FloatOutput(verbose_name="Frequency Encode Direction MTF10 (cycles/mm)",
+                             reset_on_analysis=True)
+
+    phase_edge_angle = FloatOutput(verbose_name="Phase Encode Direction Edge Angle",
+                                   reset_on_analysis=True)
+    freq_edge_angle = FloatOutput(verbose_name="Frequency Encode Direction Edge Angle",
+                                  reset_on_analysis=True)
+
+    phase_edge_status = StringOutput(verbose_name="Phase Encode Direction Edge Status",
+                                     reset_on_analysis=True)
+    freq_edge_status = StringOutput(verbose_name="Frequency Encode Direction Edge Status",
+                                    reset_on_analysis=True)
+
+    horizontal_edge = InputRectangleROI(name="Horizontal MTF edge")
+    vertical_edge = InputRectangleROI(name="Vertical MTF edge")
+
+    @property
+    def roi_inputs(self) -> dict[str, InputRectangleROI]:
+        """
+        The edge ROI inputs keyed by the edge names used in the kernels.
+        """
+        return {"horizontal": self.horizontal_edge,
+                "vertical": self.vertical_edge}
+
+    @property
+    def roi_results(self) -> RoiResults:
+        """
+        Edge MTFs kept between analyses,
+        so only an edge whose ROI has moved is measured again.
+        """
+        if "_roi_results" not in vars(self):
+            self._roi_results = RoiResults()  # pylint: disable=attribute-defined-outside-init
+        return self._roi_results
+
+    @timed("mtf.draw_rois")
+    def draw_rois(self, context: TO2AContext, batch: bool = False) -> None:
+
+        if self.viewer.image is not None:
+            image = self.viewer.image
+
+            if isinstance(image, Series):
+                slice_index = image.num_slices // 2
+                image = image.instances[slice_index]
+
+            bounds = mtf_rois(context, image.pixel_size)
+            roi_inputs = self.roi_inputs
+
+            for name, (xmin, xmax, ymin, ymax) in bounds.items():
+                roi = RectangleROI(image,
+                                   xmin,
+                                   ymin,
+                                   xmax - xmin,
+                                   ymax - ymin,
+                                   replace=True)
+                roi_inputs[name].register_roi(roi)
+
+    def post_roi_register(self, roi_input: BaseInputROI):
+        if (roi_input.roi is not None
+            and self.manager is not None
+                and roi_input in self.rois):
+            self.manager.add_roi(roi_input.roi)
+
+    def link_rois_viewers(self):
+        self.horizontal_edge.viewer = self.viewer
+        self.vertical_edge.viewer = self.viewer
+
+    @timed("mtf.analyse")
+    def analyse(self, batch: bool = False):
+        job = self.analysis_job()
+        if job is not None:
+            job()()
+
+    def analysis_job(self) -> JobFunction | None:
+        """
+        Returns the analysis split into a job, see `background`, or None if the ROIs are not drawn.
+        The inputs and ROIs are read when this is called, the edges are measured by the job
+        and the outputs are set by the function it returns.
+        """
+        if (self.viewer.image is None
+            or self.horizontal_edge.roi is None
+                or self.vertical_edge.roi is None):
+            return None
+
+        oversample = max(1, self.oversample.value)
+        results = self.roi_results
+        rois: dict[str, RectangleROI] = {name: roi_input.roi  # type: ignore
+                                         for name, roi_input in self.roi_inputs.items()}
+
+        if isinstance(self.viewer.image, Series):
+            phase_dir = self.viewer.image.get_tag(MRTags.InPlanePhaseEncodingDirection, 0)
+        else:
+            phase_dir = self.viewer.image.get_tag(MRTags.InPlanePhaseEncodingDirection)
+        pixel_size = self.viewer.image.pixel_size
+
+        def job() -> ApplyFunction:
+            edges: dict[str, EdgeMTF] = {}
+            for name, roi in rois.items():
+                signature = (roi_signature(roi), pixel_size, oversample)
+
+                def measure(name: str = name, roi: RectangleROI = roi) -> EdgeMTF:
+                    with profiler.span("mtf.edge"):
+                        return box_mtf(pixel_buffer.array(roi.image, roi.slice_num),
+                                       (roi.xmin, roi.xmax, roi.ymin, roi.ymax),
+                                       name.capitalize(),  # type: ignore
+                                       pixel_size,
+                                       oversample)
+                edges[name] = results.get(name, signature, measure)
+
+            def apply() -> None:
+                self.phase_dir.value = phase_dir  # type: ignore
+
+                for key, name in direction_edges(phase_dir).items():  # type: ignore
+                    edge = edges[name]
+                    getattr(self, key + "_mtf50").value = edge.mtf50
+                    getattr(self, key + "_mtf10").value = edge.mtf10
+                    getattr(self, key + "_edge_angle").value = edge.angle
+                    getattr(self, key + "_edge_status").value = edge_status(edge)
+            return apply
+
+        return job
@@ -1,23 +1,33 @@
 """
 Phantom width of TO2A Phantom
 """
-import math
-import statistics
+from functools import partial
+
+import numpy as np
 
 from pumpia.module_handling.modules import PhantomModule
 from pumpia.module_handling.in_outs.roi_ios import BaseInputROI, InputLineROI
 from pumpia.module_handling.in_outs.viewer_ios import MonochromeDicomViewerIO
-from pumpia.module_handling.in_outs.simple import BoolInput, PercInput, FloatOutput
+from pumpia.module_handling.in_outs.simple import (BoolInput,
+                                                   PercInput,
+                                                   IntInput,
+                                                   FloatOutput,
+                                                   StringOutput)
 from pumpia.image_handling.roi_structures import LineROI
 from pumpia.file_handling.dicom_structures import Series
-from pumpia.utilities.array_utils import nth_max_bounds
 
 from pumpia_to2a.to2a_context import TO2AContextManagerGenerator, TO2AContext
-
-# distances in mm
-HALF_LINE_LENGTH = 100
-COS_PI_6 = math.cos(math.pi / 6)
-COS_PI_3 = math.cos(math.pi / 3)
+from pumpia_to2a.instrumentation import profiler, timed
+from pumpia_to2a.pixel_buffer import pixel_buffer, image_key, roi_line_profile
+from pumpia_to2a.roi_results import RoiResults, roi_signature
+from pumpia_to2a.background import ApplyFunction, JobFunction
+from pumpia_to2a.kernels.phantom_width import (DEFAULT_NUM_SPOKES,
+                                               spoke_lines,
+                                               spoke_unit_length,
+                                               spoke_width,
+                                               average_width,
+                                               lines_centre,
+                                               centred_widths)
 
 
 class TO2APhantomWidth(PhantomModule):
@@ -32,6 +42,7 @@ class TO2APhantomWidth(PhantomModule):
     viewer = MonochromeDicomViewerIO(row=0, column=0)
 
     max_perc = PercInput(20, verbose_name="Width position (% of max)")
+    num_spokes = IntInput(DEFAULT_NUM_SPOKES, verbose_name="Number of Spokes")
 
     bool_12_6 = BoolInput(verbose_name="Include 12-6 in Average")
     bool_1_7 = BoolInput(verbose_name="Include 1-7 in Average")
@@ -49,6 +60,13 @@ class TO2APhantomWidth(PhantomModule):
 
     average_width = FloatOutput(verbose_name="Average Phantom Width", reset_on_analysis=True)
 
+    min_spoke_width = FloatOutput(verbose_name="Min Width (All Spokes)", reset_on_analysis=True)
+    max_spoke_width = FloatOutput(verbose_name="Max Width (All Spokes)", reset_on_analysis=True)
+    mean_spoke_width = FloatOutput(verbose_name="Mean Width (All Spokes)", reset_on_analysis=True)
+    spoke_widths = StringOutput(verbose_name="Widths (All Spokes)", reset_on_analysis=True)
+
+    rotation = FloatOutput(verbose_name="Phantom Rotation (°)")
+
     line_12_6 = InputLineROI(name="12-6 Line")
     line_1_7 = InputLineROI(name="1-7 Line")
     line_2_8 = InputLineROI(name="2-8 Line")
@@ -56,6 +74,29 @@ class TO2APhantomWidth(PhantomModule):
     line_4_10 = InputLineROI(name="4-10 Line")
     line_5_11 = InputLineROI(name="5-11 Line")
 
+    @property
+    def line_inputs(self) -> dict[str, InputLineROI]:
+        """
+        The line inputs keyed by the spoke names used in the kernels.
+        """
+        return {"12_6": self.line_12_6,
+                "1_7": self.line_1_7,
+                "2_8": self.line_2_8,
+                "3_9": self.line_3_9,
+                "4_10": self.line_4_10,
+                "5_11": self.line_5_11}
+
+    @property
+    def roi_results(self) -> RoiResults:
+        """
+        Results of each line kept between analyses,
+        so only lines that have moved are measured again.
+        """
+        if "_roi_results" not in vars(self):
+            self._roi_results = RoiResults()  # pylint: disable=attribute-defined-outside-init
+        return self._roi_results
+
+    @timed("phantom_width.draw_rois")
     def draw_rois(self, context: TO2AContext, batch: bool = False) -> None:
 
         if self.viewer.image is not None:
@@ -65,96 +106,18 @@ class TO2APhantomWidth(PhantomModule):
                 slice_index = image.num_slices // 2
                 image = image.instances[slice_index]
 
-            pixel_size = image.pixel_size
-            pixel_height = pixel_size[1]
-            pixel_width = pixel_size[2]
-
-            xcent = context.xcent
-            ycent = context.ycent
-
-            ydiff = HALF_LINE_LENGTH / pixel_height
-            xdiff = 0
-            x1 = round(xcent - xdiff)
-            x2 = round(xcent + xdiff)
-            y1 = round(ycent - ydiff)
-            y2 = round(ycent + ydiff)
-            roi = LineROI(image,
-                          x1,
-                          y1,
-                          x2,
-                          y2,
-                          replace=True)
-            self.line_12_6.register_roi(roi)
-
-            ydiff = HALF_LINE_LENGTH / pixel_height * COS_PI_6
-            xdiff = HALF_LINE_LENGTH / pixel_width * COS_PI_3
-            x1 = round(xcent - xdiff)
-            x2 = round(xcent + xdiff)
-            y1 = round(ycent - ydiff)
-            y2 = round(ycent + ydiff)
-            roi = LineROI(image,
-                          x1,
-                          y1,
-                          x2,
-                          y2,
-                          replace=True)
-            self.line_5_11.register_roi(roi)
-
-            ydiff = HALF_LINE_LENGTH / pixel_height * COS_PI_3
-            xdiff = HALF_LINE_LENGTH / pixel_width * COS_PI_6
-            x1 = round(xcent - xdiff)
-            x2 = round(xcent + xdiff)
-            y1 = round(ycent - ydiff)
-            y2 = round(ycent + ydiff)
-            roi = LineROI(image,
-                          x1,
-                          y1,
-                          x2,
-                          y2,
-                          replace=True)
-            self.line_4_10.register_roi(roi)
-
-            ydiff = 0
-            xdiff = HALF_LINE_LENGTH / pixel_width
-            x1 = round(xcent - xdiff)
-            x2 = round(xcent + xdiff)
-            y1 = round(ycent - ydiff)
-            y2 = round(ycent + ydiff)
-            roi = LineROI(image,
-                          x1,
-                          y1,
-                          x2,
-                          y2,
-                          replace=True)
-            self.line_3_9.register_roi(roi)
-
-            ydiff = HALF_LINE_LENGTH / pixel_height * COS_PI_3
-            xdiff = -HALF_LINE_LENGTH / pixel_width * COS_PI_6
-            x1 = round(xcent - xdiff)
-            x2 = round(xcent + xdiff)
-            y1 = round(ycent - ydiff)
-            y2 = round(ycent + ydiff)
-            roi = LineROI(image,
-                          x1,
-                          y1,
-                          x2,
-                          y2,
-                          replace=True)
-            self.line_2_8.register_roi(roi)
-
-            ydiff = HALF_LINE_LENGTH / pixel_height * COS_PI_6
-            xdiff = -HALF_LINE_LENGTH / pixel_width * COS_PI_3
-            x1 = round(xcent - xdiff)
-            x2 = round(xcent + xdiff)
-            y1 = round(ycent - ydiff)
-            y2 = round(ycent + ydiff)
-            roi = LineROI(image,
-                          x1,
-                          y1,
-                          x2,
-                          y2,
-                          replace=True)
-            self.line_1_7.register_roi(roi)
+            self.rotation.value = context.rotation
+            lines = spoke_lines(context, image.pixel_size)
+            line_inputs = self.line_inputs
+
+            for name, (x1, y1, x2, y2) in lines.items():
+                roi = LineROI(image,
+                              x1,
+                              y1,
+                              x2,
+                              y2,
+                              replace=True)
+                line_inputs[name].register_roi(roi)
 
     def post_roi_register(self, roi_input: BaseInputROI):
         if (roi_input.roi is not None
@@ -170,70 +133,100 @@ class TO2APhantomWidth(PhantomModule):
         self.line_4_10.viewer = self.viewer
         self.line_5_11.viewer = self.viewer
 
+    @timed("phantom_width.analyse")
     def analyse(self, batch: bool = False):
-        if (self.viewer.image is not None
-            and self.line_12_6.roi is not None
-            and self.line_1_7.roi is not None
-            and self.line_2_8.roi is not None
-            and self.line_3_9.roi is not None
-            and self.line_4_10.roi is not None
-                and self.line_5_11.roi is not None):
-
-            image = self.viewer.image
-
-            if isinstance(image, Series):
-                slice_index = image.num_slices // 2
-                image = image.instances[slice_index]
-
-            pixel_size = image.pixel_size
-            pixel_height = pixel_size[1]
-            pixel_width = pixel_size[2]
-
-            prof_12_6 = self.line_12_6.roi.profile
-            prof_1_7 = self.line_1_7.roi.profile
-            prof_2_8 = self.line_2_8.roi.profile
-            prof_3_9 = self.line_3_9.roi.profile
-            prof_4_10 = self.line_4_10.roi.profile
-            prof_5_11 = self.line_5_11.roi.profile
-
-            divisor = 100 / self.max_perc.value
-
-            lengths = []
-
-            unit_length_12_6 = pixel_height
-            width_12_6 = nth_max_bounds(prof_12_6, divisor).difference * unit_length_12_6
-            self.width_12_6.value = width_12_6
-            if self.bool_12_6.value:
-                lengths.append(width_12_6)
-
-            unit_length_1_7 = math.dist([pixel_height * COS_PI_6, pixel_width * COS_PI_3], [0, 0])
-            width_1_7 = nth_max_bounds(prof_1_7, divisor).difference * unit_length_1_7
-            self.width_1_7.value = width_1_7
-            if self.bool_1_7.value:
-                lengths.append(width_1_7)
-
-            unit_length_2_8 = math.dist([pixel_height * COS_PI_3, pixel_width * COS_PI_6], [0, 0])
-            width_2_8 = nth_max_bounds(prof_2_8, divisor).difference * unit_length_2_8
-            self.width_2_8.value = width_2_8
-            if self.bool_2_8.value:
-                lengths.append(width_2_8)
-
-            unit_length_3_9 = pixel_width
-            width_3_9 = nth_max_bounds(prof_3_9, divisor).difference * unit_length_3_9
-            self.width_3_9.value = width_3_9
-            if self.bool_3_9.value:
-                lengths.append(width_3_9)
-
-            unit_length_4_10 = math.dist([pixel_height * COS_PI_3, pixel_width * COS_PI_6], [0, 0])
-            width_4_10 = nth_max_bounds(prof_4_10, divisor).difference * unit_length_4_10
-            self.width_4_10.value = width_4_10
-            if self.bool_4_10.value:
-                lengths.append(width_4_10)
-
-            unit_length_5_11 = math.dist([pixel_height * COS_PI_6, pixel_width * COS_PI_3], [0, 0])
-            width_5_11 = nth_max_bounds(prof_5_11, divisor).difference * unit_length_5_11
-            self.width_5_11.value = width_5_11
-            if self.bool_5_11.value:
-                lengths.append(width_5_11)
-
-            self.average_width.value = statistics.fmean(lengths)
+        job = self.analysis_job()
+        if job is not None:
+            job()()
+
+    def analysis_job(self) -> JobFunction | None:
+        """
+        Returns the analysis split into a job, see `background`, or None if the ROIs are not drawn.
+        The inputs and ROIs are read when this is called, the widths are measured by the job
+        and the outputs are set by the function it returns.
+        """
+        if (self.viewer.image is None
+            or self.line_12_6.roi is None
+            or self.line_1_7.roi is None
+            or self.line_2_8.roi is None
+            or self.line_3_9.roi is None
+            or self.line_4_10.roi is None
+                or self.line_5_11.roi is None):
+            return None
+
+        image = self.viewer.image
+
+        if isinstance(image, Series):
+            slice_index = image.num_slices // 2
+            image = image.instances[slice_index]
+
+        pixel_size = image.pixel_size
+        max_perc = self.max_perc.value
+        num_spokes = self.num_spokes.value
+        rotation = self.rotation.value
+        results = self.roi_results
+        rois: dict[str, LineROI] = {name: line_input.roi  # type: ignore
+                                    for name, line_input in self.line_inputs.items()}
+        include = {"12_6": self.bool_12_6.value,
+                   "1_7": self.bool_1_7.value,
+                   "2_8": self.bool_2_8.value,
+                   "3_9": self.bool_3_9.value,
+                   "4_10": self.bool_4_10.value,
+                   "5_11": self.bool_5_11.value}
+        # the spokes are measured about the drawn lines, not a new context,
+        # so they follow lines that have been moved and the context is not detected again
+        xcent, ycent = lines_centre((roi.x1, roi.y1, roi.x2, roi.y2) for roi in rois.values())
+
+        def measure(roi: LineROI, unit_length: float) -> float:
+            with profiler.span("phantom_width.profiles"):
+                profile = roi_line_profile(roi)
+            return spoke_width(profile, unit_length, max_perc)
+
+        def job() -> ApplyFunction:
+            widths: dict[str, float] = {}
+            for name, roi in rois.items():
+                unit_length = spoke_unit_length(name, pixel_size, rotation)
+                widths[name] = results.get(name,
+                                           (roi_signature(roi), unit_length, max_perc),
+                                           partial(measure, roi, unit_length))
+
+            spoke_widths = None
+            if num_spokes > 0:
+                spokes_signature = (image_key(image),
+                                    xcent,
+                                    ycent,
+                                    rotation,
+                                    num_spokes,
+                                    max_perc)
+
+                def measure_spokes() -> np.ndarray:
+                    with profiler.span("phantom_width.spokes"):
+                        return centred_widths(pixel_buffer.array(image),  # type: ignore
+                                              xcent,
+                                              ycent,
+                                              rotation,
+                                              pixel_size,
+                                              num_spokes,
+                                              max_perc)[1]
+
+                spoke_widths = results.get("spokes", spokes_signature, measure_spokes)
+
+            def apply() -> None:
+                self.width_12_6.value = widths["12_6"]
+                self.width_1_7.value = widths["1_7"]
+                self.width_2_8.value = widths["2_8"]
+                self.width_3_9.value = widths["3_9"]
+                self.width_4_10.value = widths["4_10"]
+                self.width_5_11.value = widths["5_11"]
+
+                self.average_width.value = average_width(widths, include)
+
+                if spoke_widths is not None:
+                    if not np.all(np.isnan(spoke_widths)):
+                        self.min_spoke_width.value = float(np.nanmin(spoke_widths))
+                        self.max_spoke_width.value = float(np.nanmax(spoke_widths))
+                        self.mean_spoke_width.value = float(np.nanmean(spoke_widths))
+                    self.spoke_widths.value = ", ".join(f"{width:.2f}" for width in spoke_widths)
+            return apply
+
+        return job
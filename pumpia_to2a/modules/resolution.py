@@ -1,6 +1,8 @@
 """
 Resolution inserts of TO2A Phantom
 """
+import numpy as np
+
 from pumpia.module_handling.modules import PhantomModule
 from pumpia.module_handling.in_outs.roi_ios import BaseInputROI, InputRectangleROI
 from pumpia.module_handling.in_outs.viewer_ios import MonochromeDicomViewerIO
@@ -8,25 +10,16 @@ from pumpia.module_handling.in_outs.simple import PercInput, StringOutput, Float
 from pumpia.image_handling.roi_structures import RectangleROI
 from pumpia.file_handling.dicom_structures import Series
 from pumpia.file_handling.dicom_tags import MRTags
-from pumpia.utilities.array_utils import nth_max_troughs
 
 from pumpia_to2a.to2a_context import TO2AContextManagerGenerator, TO2AContext
-
-# distances in mm
-WIDTHS = 11
-LENGTH_2MM = 24
-LENGTH_1_5_MM = 20
-LENGTH_1_MM = 16
-
-WEDGE_SIDE_OFFSET = 10
-WEDGE_SIDE_2MM_OFFSET = 31
-WEDGE_SIDE_1_5MM_OFFSET = 51
-WEDGE_SIDE_1MM_OFFSET = 71
-
-OTHER_SIDE_OFFSET = 43
-OTHER_SIDE_2MM_OFFSET = 20
-OTHER_SIDE_1_5MM_OFFSET = 41
-OTHER_SIDE_1MM_OFFSET = 61
+from pumpia_to2a.instrumentation import profiler, timed
+from pumpia_to2a.pixel_buffer import rectangle_profile
+from pumpia_to2a.roi_results import RoiResults, roi_signature
+from pumpia_to2a.background import ApplyFunction, JobFunction
+from pumpia_to2a.kernels.resolution import (InsertResult,
+                                            insert_rois,
+                                            analyse_inserts,
+                                            direction_inserts)
 
 TICK = "\u2713"
 CROSS = "\u274c"
@@ -45,6 +38,8 @@ class TO2AResolution(PhantomModule):
 
     max_perc = PercInput(50, verbose_name="Width position (% of max)")
 
+    rotation = FloatOutput(verbose_name="Phantom Rotation (°)")
+
     phase_dir = StringOutput(verbose_name="Phase Encode Direction",
                              reset_on_analysis=True)
     phase_pix = FloatOutput(verbose_name="Phase Pixel Size",
@@ -66,6 +61,20 @@ class TO2AResolution(PhantomModule):
     freq_1 = StringOutput(verbose_name="Frequency Encode Direction 1mm",
                           reset_on_analysis=True)
 
+    phase_2_modulation = FloatOutput(verbose_name="Phase Encode Direction 2mm Modulation",
+                                     reset_on_analysis=True)
+    phase_1_5_modulation = FloatOutput(verbose_name="Phase Encode Direction 1.5mm Modulation",
+                                       reset_on_analysis=True)
+    phase_1_modulation = FloatOutput(verbose_name="Phase Encode Direction 1mm Modulation",
+                                     reset_on_analysis=True)
+
+    freq_2_modulation = FloatOutput(verbose_name="Frequency Encode Direction 2mm Modulation",
+                                    reset_on_analysis=True)
+    freq_1_5_modulation = FloatOutput(verbose_name="Frequency Encode Direction 1.5mm Modulation",
+                                      reset_on_analysis=True)
+    freq_1_modulation = FloatOutput(verbose_name="Frequency Encode Direction 1mm Modulation",
+                                    reset_on_analysis=True)
+
     horizontal_2_roi = InputRectangleROI(name="Horizontal 2mm")
     horizontal_1_5_roi = InputRectangleROI(name="Horizontal 1.5mm")
     horizontal_1_roi = InputRectangleROI(name="Horizontal 1mm insert")
@@ -74,6 +83,41 @@ class TO2AResolution(PhantomModule):
     vertical_1_5_roi = InputRectangleROI(name="Vertical 1.5mm insert")
     vertical_1_roi = InputRectangleROI(name="Vertical 1mm insert")
 
+    @property
+    def roi_inputs(self) -> dict[str, InputRectangleROI]:
+        """
+        The insert ROI inputs keyed by the insert names used in the kernels.
+        """
+        return {"horizontal_2": self.horizontal_2_roi,
+                "horizontal_1_5": self.horizontal_1_5_roi,
+                "horizontal_1": self.horizontal_1_roi,
+                "vertical_2": self.vertical_2_roi,
+                "vertical_1_5": self.vertical_1_5_roi,
+                "vertical_1": self.vertical_1_roi}
+
+    @property
+    def result_outputs(self) -> dict[str, tuple[StringOutput, FloatOutput]]:
+        """
+        The resolved and modulation outputs keyed by the encode direction names used in the kernels.
+        """
+        return {"phase_2": (self.phase_2, self.phase_2_modulation),
+                "phase_1_5": (self.phase_1_5, self.phase_1_5_modulation),
+                "phase_1": (self.phase_1, self.phase_1_modulation),
+                "freq_2": (self.freq_2, self.freq_2_modulation),
+                "freq_1_5": (self.freq_1_5, self.freq_1_5_modulation),
+                "freq_1": (self.freq_1, self.freq_1_modulation)}
+
+    @property
+    def roi_results(self) -> RoiResults:
+        """
+        Insert results kept between analyses,
+        so only inserts whose ROI has moved are analysed again.
+        """
+        if "_roi_results" not in vars(self):
+            self._roi_results = RoiResults()  # pylint: disable=attribute-defined-outside-init
+        return self._roi_results
+
+    @timed("resolution.draw_rois")
     def draw_rois(self, context: TO2AContext, batch: bool = False) -> None:
 
         if self.viewer.image is not None:
@@ -83,187 +127,19 @@ class TO2AResolution(PhantomModule):
                 slice_index = image.num_slices // 2
                 image = image.instances[slice_index]
 
-            pixel_size = image.pixel_size
-            pixel_height = pixel_size[1]
-            pixel_width = pixel_size[2]
-
-            wedge_loc = context.wedges_side
-            mtf_loc = context.mtf_side
-
-            xcent = context.xcent
-            ycent = context.ycent
-
-            horizontal_height = WIDTHS / pixel_height
-            horizontal_2mm_width = LENGTH_2MM / pixel_width
-            horizontal_1_5mm_width = LENGTH_1_5_MM / pixel_width
-            horizontal_1mm_width = LENGTH_1_MM / pixel_width
-
-            vertical_width = WIDTHS / pixel_width
-            vertical_2mm_height = LENGTH_2MM / pixel_height
-            vertical_1_5mm_height = LENGTH_1_5_MM / pixel_height
-            vertical_1mm_height = LENGTH_1_MM / pixel_height
-
-            if wedge_loc == "bottom" or wedge_loc == "top":
-                horizontal_xoffset = OTHER_SIDE_OFFSET / pixel_width
-                horizontal_2mm_yoffset = OTHER_SIDE_2MM_OFFSET / pixel_height
-                horizontal_1_5mm_yoffset = OTHER_SIDE_1_5MM_OFFSET / pixel_height
-                horizontal_1mm_yoffset = OTHER_SIDE_1MM_OFFSET / pixel_height
-
-                vertical_yoffset = WEDGE_SIDE_OFFSET / pixel_height
-                vertical_2mm_xoffset = WEDGE_SIDE_2MM_OFFSET / pixel_width
-                vertical_1_5mm_xoffset = WEDGE_SIDE_1_5MM_OFFSET / pixel_width
-                vertical_1mm_xoffset = WEDGE_SIDE_1MM_OFFSET / pixel_width
-
-                if wedge_loc == "bottom":
-                    horizontal_2mm_ymin = ycent - horizontal_2mm_yoffset
-                    horizontal_1_5mm_ymin = ycent - horizontal_1_5mm_yoffset
-                    horizontal_1mm_ymin = ycent - horizontal_1mm_yoffset
-                    vertical_2mm_ymin = ycent + vertical_yoffset
-                    vertical_1_5mm_ymin = ycent + vertical_yoffset
-                    vertical_1mm_ymin = ycent + vertical_yoffset
+            bounds = insert_rois(context, image.pixel_size)
+            # profiles are taken along the inserts rotated by this, the ROIs can not be rotated
+            self.rotation.value = context.rotation
+            roi_inputs = self.roi_inputs
 
-                else:
-                    horizontal_2mm_ymin = ycent + horizontal_2mm_yoffset - horizontal_height
-                    horizontal_1_5mm_ymin = ycent + horizontal_1_5mm_yoffset - horizontal_height
-                    horizontal_1mm_ymin = ycent + horizontal_1mm_yoffset - horizontal_height
-                    vertical_2mm_ymin = ycent - vertical_yoffset - vertical_2mm_height
-                    vertical_1_5mm_ymin = ycent - vertical_yoffset - vertical_1_5mm_height
-                    vertical_1mm_ymin = ycent - vertical_yoffset - vertical_1mm_height
-
-                if mtf_loc == "left":
-                    horizontal_2mm_xmin = xcent + horizontal_xoffset
-                    horizontal_1_5mm_xmin = xcent + horizontal_xoffset
-                    horizontal_1mm_xmin = xcent + horizontal_xoffset
-                    vertical_2mm_xmin = xcent + vertical_2mm_xoffset
-                    vertical_1_5mm_xmin = xcent + vertical_1_5mm_xoffset
-                    vertical_1mm_xmin = xcent + vertical_1mm_xoffset
-
-                else:
-                    horizontal_2mm_xmin = xcent - horizontal_xoffset - horizontal_2mm_width
-                    horizontal_1_5mm_xmin = xcent - horizontal_xoffset - horizontal_1_5mm_width
-                    horizontal_1mm_xmin = xcent - horizontal_xoffset - horizontal_1mm_width
-                    vertical_2mm_xmin = xcent - vertical_2mm_xoffset - vertical_width
-                    vertical_1_5mm_xmin = xcent - vertical_1_5mm_xoffset - vertical_width
-                    vertical_1mm_xmin = xcent - vertical_1mm_xoffset - vertical_width
-
-            else:
-                horizontal_xoffset = WEDGE_SIDE_OFFSET / pixel_width
-                horizontal_2mm_yoffset = WEDGE_SIDE_2MM_OFFSET / pixel_height
-                horizontal_1_5mm_yoffset = WEDGE_SIDE_1_5MM_OFFSET / pixel_height
-                horizontal_1mm_yoffset = WEDGE_SIDE_1MM_OFFSET / pixel_height
-
-                vertical_yoffset = OTHER_SIDE_OFFSET / pixel_height
-                vertical_2mm_xoffset = OTHER_SIDE_2MM_OFFSET / pixel_width
-                vertical_1_5mm_xoffset = OTHER_SIDE_1_5MM_OFFSET / pixel_width
-                vertical_1mm_xoffset = OTHER_SIDE_1MM_OFFSET / pixel_width
-
-                if wedge_loc == "right":
-                    horizontal_2mm_xmin = xcent + horizontal_xoffset
-                    horizontal_1_5mm_xmin = xcent + horizontal_xoffset
-                    horizontal_1mm_xmin = xcent + horizontal_xoffset
-                    vertical_2mm_xmin = xcent - vertical_2mm_xoffset
-                    vertical_1_5mm_xmin = xcent - vertical_1_5mm_xoffset
-                    vertical_1mm_xmin = xcent - vertical_1mm_xoffset
-
-                else:
-                    horizontal_2mm_xmin = xcent - horizontal_xoffset - horizontal_2mm_width
-                    horizontal_1_5mm_xmin = xcent - horizontal_xoffset - horizontal_1_5mm_width
-                    horizontal_1mm_xmin = xcent - horizontal_xoffset - horizontal_1mm_width
-                    vertical_2mm_xmin = xcent + vertical_2mm_xoffset - vertical_width
-                    vertical_1_5mm_xmin = xcent + vertical_1_5mm_xoffset - vertical_width
-                    vertical_1mm_xmin = xcent + vertical_1mm_xoffset - vertical_width
-
-                if mtf_loc == "bottom":
-                    horizontal_2mm_ymin = ycent - horizontal_2mm_yoffset - horizontal_height
-                    horizontal_1_5mm_ymin = ycent - horizontal_1_5mm_yoffset - horizontal_height
-                    horizontal_1mm_ymin = ycent - horizontal_1mm_yoffset - horizontal_height
-                    vertical_2mm_ymin = ycent - vertical_yoffset - vertical_2mm_height
-                    vertical_1_5mm_ymin = ycent - vertical_yoffset - vertical_1_5mm_height
-                    vertical_1mm_ymin = ycent - vertical_yoffset - vertical_1mm_height
-
-                else:
-                    horizontal_2mm_ymin = ycent + horizontal_2mm_yoffset
-                    horizontal_1_5mm_ymin = ycent + horizontal_1_5mm_yoffset
-                    horizontal_1mm_ymin = ycent + horizontal_1mm_yoffset
-                    vertical_2mm_ymin = ycent + vertical_yoffset
-                    vertical_1_5mm_ymin = ycent + vertical_yoffset
-                    vertical_1mm_ymin = ycent + vertical_yoffset
-
-            horizontal_2mm_ymax = round(horizontal_2mm_ymin + horizontal_height)
-            horizontal_1_5mm_ymax = round(horizontal_1_5mm_ymin + horizontal_height)
-            horizontal_1mm_ymax = round(horizontal_1mm_ymin + horizontal_height)
-            vertical_2mm_ymax = round(vertical_2mm_ymin + vertical_2mm_height)
-            vertical_1_5mm_ymax = round(vertical_1_5mm_ymin + vertical_1_5mm_height)
-            vertical_1mm_ymax = round(vertical_1mm_ymin + vertical_1mm_height)
-
-            horizontal_2mm_xmax = round(horizontal_2mm_xmin + horizontal_2mm_width)
-            horizontal_1_5mm_xmax = round(horizontal_1_5mm_xmin + horizontal_1_5mm_width)
-            horizontal_1mm_xmax = round(horizontal_1mm_xmin + horizontal_1mm_width)
-            vertical_2mm_xmax = round(vertical_2mm_xmin + vertical_width)
-            vertical_1_5mm_xmax = round(vertical_1_5mm_xmin + vertical_width)
-            vertical_1mm_xmax = round(vertical_1mm_xmin + vertical_width)
-
-            horizontal_2mm_ymin = round(horizontal_2mm_ymin)
-            horizontal_1_5mm_ymin = round(horizontal_1_5mm_ymin)
-            horizontal_1mm_ymin = round(horizontal_1mm_ymin)
-            vertical_2mm_ymin = round(vertical_2mm_ymin)
-            vertical_1_5mm_ymin = round(vertical_1_5mm_ymin)
-            vertical_1mm_ymin = round(vertical_1mm_ymin)
-
-            horizontal_2mm_xmin = round(horizontal_2mm_xmin)
-            horizontal_1_5mm_xmin = round(horizontal_1_5mm_xmin)
-            horizontal_1mm_xmin = round(horizontal_1mm_xmin)
-            vertical_2mm_xmin = round(vertical_2mm_xmin)
-            vertical_1_5mm_xmin = round(vertical_1_5mm_xmin)
-            vertical_1mm_xmin = round(vertical_1mm_xmin)
-
-            horizontal_2mm_roi = RectangleROI(image,
-                                              horizontal_2mm_xmin,
-                                              horizontal_2mm_ymin,
-                                              horizontal_2mm_xmax - horizontal_2mm_xmin,
-                                              horizontal_2mm_ymax - horizontal_2mm_ymin,
-                                              replace=True)
-            self.horizontal_2_roi.register_roi(horizontal_2mm_roi)
-
-            horizontal_1_5mm_roi = RectangleROI(image,
-                                                horizontal_1_5mm_xmin,
-                                                horizontal_1_5mm_ymin,
-                                                horizontal_1_5mm_xmax - horizontal_1_5mm_xmin,
-                                                horizontal_1_5mm_ymax - horizontal_1_5mm_ymin,
-                                                replace=True)
-            self.horizontal_1_5_roi.register_roi(horizontal_1_5mm_roi)
-
-            horizontal_1mm_roi = RectangleROI(image,
-                                              horizontal_1mm_xmin,
-                                              horizontal_1mm_ymin,
-                                              horizontal_1mm_xmax - horizontal_1mm_xmin,
-                                              horizontal_1mm_ymax - horizontal_1mm_ymin,
-                                              replace=True)
-            self.horizontal_1_roi.register_roi(horizontal_1mm_roi)
-
-            vertical_2mm_roi = RectangleROI(image,
-                                            vertical_2mm_xmin,
-                                            vertical_2mm_ymin,
-                                            vertical_2mm_xmax - vertical_2mm_xmin,
-                                            vertical_2mm_ymax - vertical_2mm_ymin,
-                                            replace=True)
-            self.vertical_2_roi.register_roi(vertical_2mm_roi)
-
-            vertical_1_5mm_roi = RectangleROI(image,
-                                              vertical_1_5mm_xmin,
-                                              vertical_1_5mm_ymin,
-                                              vertical_1_5mm_xmax - vertical_1_5mm_xmin,
-                                              vertical_1_5mm_ymax - vertical_1_5mm_ymin,
-                                              replace=True)
-            self.vertical_1_5_roi.register_roi(vertical_1_5mm_roi)
-
-            vertical_1mm_roi = RectangleROI(image,
-                                            vertical_1mm_xmin,
-                                            vertical_1mm_ymin,
-                                            vertical_1mm_xmax - vertical_1mm_xmin,
-                                            vertical_1mm_ymax - vertical_1mm_ymin,
-                                            replace=True)
-            self.vertical_1_roi.register_roi(vertical_1mm_roi)
+            for name, (xmin, xmax, ymin, ymax) in bounds.items():
+                roi = RectangleROI(image,
+                                   xmin,
+                                   ymin,
+                                   xmax - xmin,
+                                   ymax - ymin,
+                                   replace=True)
+                roi_inputs[name].register_roi(roi)
 
     def post_roi_register(self, roi_input: BaseInputROI):
         if (roi_input.roi is not None
@@ -279,104 +155,77 @@ class TO2AResolution(PhantomModule):
         self.horizontal_1_5_roi.viewer = self.viewer
         self.horizontal_2_roi.viewer = self.viewer
 
+    @timed("resolution.analyse")
     def analyse(self, batch: bool = False):
-        if (self.viewer.image is not None
-           and self.vertical_1_roi.roi is not None
-            and self.vertical_1_5_roi.roi is not None
-            and self.vertical_2_roi.roi is not None
-            and self.horizontal_1_roi.roi is not None
-            and self.horizontal_1_5_roi.roi is not None
-                and self.horizontal_2_roi.roi is not None):
-
-            vertical_1_prof = self.vertical_1_roi.roi.v_profile
-            vertical_1_5_prof = self.vertical_1_5_roi.roi.v_profile
-            vertical_2_prof = self.vertical_2_roi.roi.v_profile
-            horizontal_1_prof = self.horizontal_1_roi.roi.h_profile
-            horizontal_1_5_prof = self.horizontal_1_5_roi.roi.h_profile
-            horizontal_2_prof = self.horizontal_2_roi.roi.h_profile
-
-            divisor = 100 / self.max_perc.value
-
-            vertical_1_n_seen = len(nth_max_troughs(vertical_1_prof, divisor))
-            vertical_1_5_n_seen = len(nth_max_troughs(vertical_1_5_prof, divisor))
-            vertical_2_n_seen = len(nth_max_troughs(vertical_2_prof, divisor))
-            horizontal_1_n_seen = len(nth_max_troughs(horizontal_1_prof, divisor))
-            horizontal_1_5_n_seen = len(nth_max_troughs(horizontal_1_5_prof, divisor))
-            horizontal_2_n_seen = len(nth_max_troughs(horizontal_2_prof, divisor))
-
-            if isinstance(self.viewer.image, Series):
-                phase_dir = self.viewer.image.get_tag(MRTags.InPlanePhaseEncodingDirection, 0)
-            else:
-                phase_dir = self.viewer.image.get_tag(MRTags.InPlanePhaseEncodingDirection)
-
-            self.phase_dir.value = phase_dir  # type: ignore
-
-            pixel_size = self.viewer.image.pixel_size
-            pixel_height = pixel_size[1]
-            pixel_width = pixel_size[2]
-
-            if phase_dir == "ROW":
-                self.phase_pix.value = pixel_height
-                self.freq_pix.value = pixel_width
-                if vertical_1_n_seen == 5:
-                    self.phase_1.value = TICK
-                else:
-                    self.phase_1.value = CROSS
-
-                if vertical_1_5_n_seen == 5:
-                    self.phase_1_5.value = TICK
-                else:
-                    self.phase_1_5.value = CROSS
-
-                if vertical_2_n_seen == 5:
-                    self.phase_2.value = TICK
-                else:
-                    self.phase_2.value = CROSS
-
-                if horizontal_1_n_seen == 5:
-                    self.freq_1.value = TICK
-                else:
-                    self.freq_1.value = CROSS
-
-                if horizontal_1_5_n_seen == 5:
-                    self.freq_1_5.value = TICK
-                else:
-                    self.freq_1_5.value = CROSS
-
-                if horizontal_2_n_seen == 5:
-                    self.freq_2.value = TICK
-                else:
-                    self.freq_2.value = CROSS
-
-            else:
-                self.phase_pix.value = pixel_width
-                self.freq_pix.value = pixel_height
-                if horizontal_1_n_seen == 5:
-                    self.phase_1.value = TICK
-                else:
-                    self.phase_1.value = CROSS
-
-                if horizontal_1_5_n_seen == 5:
-                    self.phase_1_5.value = TICK
-                else:
-                    self.phase_1_5.value = CROSS
-
-                if horizontal_2_n_seen == 5:
-                    self.phase_2.value = TICK
-                else:
-                    self.phase_2.value = CROSS
-
-                if vertical_1_n_seen == 5:
-                    self.freq_1.value = TICK
-                else:
-                    self.freq_1.value = CROSS
-
-                if vertical_1_5_n_seen == 5:
-                    self.freq_1_5.value = TICK
-                else:
-                    self.freq_1_5.value = CROSS
-
-                if vertical_2_n_seen == 5:
-                    self.freq_2.value = TICK
-                else:
-                    self.freq_2.value = CROSS
+        job = self.analysis_job()
+        if job is not None:
+            job()()
+
+    def analysis_job(self) -> JobFunction | None:
+        """
+        Returns the analysis split into a job, see `background`, or None if the ROIs are not drawn.
+        The inputs and ROIs are read when this is called, the inserts are analysed by the job
+        and the outputs are set by the function it returns.
+        """
+        if (self.viewer.image is None
+           or self.vertical_1_roi.roi is None
+            or self.vertical_1_5_roi.roi is None
+            or self.vertical_2_roi.roi is None
+            or self.horizontal_1_roi.roi is None
+            or self.horizontal_1_5_roi.roi is None
+                or self.horizontal_2_roi.roi is None):
+            return None
+
+        max_perc = self.max_perc.value
+        rotation = self.rotation.value
+        results = self.roi_results
+        rois: dict[str, RectangleROI] = {name: roi_input.roi  # type: ignore
+                                         for name, roi_input in self.roi_inputs.items()}
+
+        if isinstance(self.viewer.image, Series):
+            phase_dir = self.viewer.image.get_tag(MRTags.InPlanePhaseEncodingDirection, 0)
+        else:
+            phase_dir = self.viewer.image.get_tag(MRTags.InPlanePhaseEncodingDirection)
+        pixel_size = self.viewer.image.pixel_size
+
+        def job() -> ApplyFunction:
+            signatures = {name: (roi_signature(roi), rotation, max_perc)
+                          for name, roi in rois.items()}
+            changed = [name for name, signature in signatures.items()
+                       if not results.is_current(name, signature)]
+
+            if changed:
+                profiles: dict[str, np.ndarray] = {}
+                with profiler.span("resolution.profiles"):
+                    for name in changed:
+                        if name.startswith("vertical"):
+                            profiles[name] = rectangle_profile(rois[name], "Vertical", rotation)
+                        else:
+                            profiles[name] = rectangle_profile(rois[name], "Horizontal", rotation)
+                for name, result in analyse_inserts(profiles, max_perc).items():
+                    results.put(name, signatures[name], result)
+
+            inserts: dict[str, InsertResult] = {name: results.result(name)  # type: ignore
+                                                for name in signatures}
+
+            def apply() -> None:
+                self.phase_dir.value = phase_dir  # type: ignore
+
+                pixel_height = pixel_size[1]
+                pixel_width = pixel_size[2]
+
+                if phase_dir == "ROW":
+                    self.phase_pix.value = pixel_height
+                    self.freq_pix.value = pixel_width
+                else:
+                    self.phase_pix.value = pixel_width
+                    self.freq_pix.value = pixel_height
+
+                result_outputs = self.result_outputs
+                for key, name in direction_inserts(phase_dir).items():  # type: ignore
+                    resolved_output, modulation_output = result_outputs[key]
+                    resolved_output.value = TICK if inserts[name].resolved else CROSS
+                    modulation_output.value = inserts[name].modulation
+            return apply
+
+        return job
@@ -1,25 +1,36 @@
 """
 Slice width using TO2A wedges
 """
-import math
 import numpy as np
-from scipy.optimize import curve_fit
 
 from pumpia.module_handling.modules import PhantomModule
 from pumpia.module_handling.in_outs.roi_ios import BaseInputROI, InputRectangleROI
 from pumpia.module_handling.in_outs.viewer_ios import MonochromeDicomViewerIO
-from pumpia.module_handling.in_outs.simple import FloatInput, PercInput, FloatOutput, StringOutput
+from pumpia.module_handling.in_outs.simple import (FloatInput,
+                                                   PercInput,
+                                                   BoolInput,
+                                                   IntInput,
+                                                   FloatOutput,
+                                                   IntOutput,
+                                                   StringOutput)
 from pumpia.image_handling.roi_structures import RectangleROI
-from pumpia.file_handling.dicom_structures import Series
-from pumpia.utilities.feature_utils import split_gauss_integral
+from pumpia.file_handling.dicom_structures import Series, Instance
 
 from pumpia_to2a.to2a_context import TO2AContextManagerGenerator, TO2AContext
-
-# distances in mm
-INSIDE_OFFSET = 40
-OUTSIDE_OFFSET = 61
-ROI_WIDTH = 14
-ROI_LENGTH = 70
+from pumpia_to2a.instrumentation import profiler, timed
+from pumpia_to2a.pixel_buffer import rectangle_profile, rectangle_row_profiles
+from pumpia_to2a.roi_results import RoiResults, roi_signature
+from pumpia_to2a.background import ApplyFunction, JobFunction
+from pumpia_to2a.kernels.profiles import stack_box_profiles
+from pumpia_to2a.kernels.fitting import fit_profiles
+from pumpia_to2a.kernels.slice_width import (DEFAULT_ROW_BIN,
+                                             wedge_rois,
+                                             widths_from_fits,
+                                             slice_widths_stack,
+                                             slice_widths_rows,
+                                             width_summary,
+                                             row_width_summary,
+                                             fit_key)
 
 
 class TO2ASliceWidth(PhantomModule):
@@ -35,17 +46,59 @@ class TO2ASliceWidth(PhantomModule):
 
     tan_theta = FloatInput(0.25, verbose_name="Tan of wedge angle")
     max_perc = PercInput(50, verbose_name="Width position (% of max)")
+    all_slices = BoolInput(False, verbose_name="Analyse All Slices")
+    fit_rows = BoolInput(False, verbose_name="Fit Each Row")
+    row_bin = IntInput(DEFAULT_ROW_BIN, verbose_name="Rows Per Fit")
 
     wedge_dir = StringOutput(verbose_name="Wedge Direction")
+    rotation = FloatOutput(verbose_name="Phantom Rotation (°)")
 
     expected_width = FloatOutput()
     inside_wedge_width = FloatOutput(reset_on_analysis=True)
     outside_wedge_width = FloatOutput(reset_on_analysis=True)
     slice_width = FloatOutput(reset_on_analysis=True)
 
+    mean_slice_width = FloatOutput(verbose_name="Mean Slice Width (All Slices)",
+                                   reset_on_analysis=True)
+    std_slice_width = FloatOutput(verbose_name="Slice Width SD (All Slices)",
+                                  reset_on_analysis=True)
+    min_slice_width = FloatOutput(verbose_name="Min Slice Width (All Slices)",
+                                  reset_on_analysis=True)
+    max_slice_width = FloatOutput(verbose_name="Max Slice Width (All Slices)",
+                                  reset_on_analysis=True)
+    all_slice_widths = StringOutput(verbose_name="Slice Widths (All Slices)",
+                                    reset_on_analysis=True)
+
+    row_slice_width = FloatOutput(verbose_name="Slice Width (Row Medians)",
+                                  reset_on_analysis=True)
+    median_row_width = FloatOutput(verbose_name="Median Slice Width (Rows)",
+                                   reset_on_analysis=True)
+    mean_row_width = FloatOutput(verbose_name="Mean Slice Width (Rows)",
+                                 reset_on_analysis=True)
+    std_row_width = FloatOutput(verbose_name="Slice Width SD (Rows)",
+                                reset_on_analysis=True)
+    min_row_width = FloatOutput(verbose_name="Min Slice Width (Rows)",
+                                reset_on_analysis=True)
+    max_row_width = FloatOutput(verbose_name="Max Slice Width (Rows)",
+                                reset_on_analysis=True)
+    rejected_rows = IntOutput(verbose_name="Rejected Rows", reset_on_analysis=True)
+    all_row_widths = StringOutput(verbose_name="Slice Widths (Rows)",
+                                  reset_on_analysis=True)
+
     inside_wedge = InputRectangleROI()
     outside_wedge = InputRectangleROI()
 
+    @property
+    def roi_results(self) -> RoiResults:
+        """
+        Wedge fits kept between analyses,
+        so only a wedge whose ROI has moved is fitted again.
+        """
+        if "_roi_results" not in vars(self):
+            self._roi_results = RoiResults()  # pylint: disable=attribute-defined-outside-init
+        return self._roi_results
+
+    @timed("slice_width.draw_rois")
     def draw_rois(self, context: TO2AContext, batch: bool = False) -> None:
 
         if self.viewer.image is not None:
@@ -56,51 +109,15 @@ class TO2ASliceWidth(PhantomModule):
                 image = image.instances[slice_index]
 
             pixel_size = image.pixel_size
-            pixel_height = pixel_size[1]
-            pixel_width = pixel_size[2]
 
             self.expected_width.value = pixel_size[0]
 
-            if context.wedges_side == "bottom" or context.wedges_side == "top":
-                self.wedge_dir.value = "Horizontal"
-                box_width = ROI_WIDTH / pixel_height
-                box_length = ROI_LENGTH / pixel_width
-                inside_pix_offset = INSIDE_OFFSET / pixel_height
-                outside_pix_offset = OUTSIDE_OFFSET / pixel_height
-
-                inside_xmin = outside_xmin = round(context.xcent - box_length / 2)
-                inside_xmax = outside_xmax = round(context.xcent + box_length / 2)
-
-                if context.wedges_side == "bottom":
-                    inside_ymin = round(context.ycent + inside_pix_offset)
-                    inside_ymax = round(context.ycent + inside_pix_offset + box_width)
-                    outside_ymin = round(context.ycent + outside_pix_offset)
-                    outside_ymax = round(context.ycent + outside_pix_offset + box_width)
-                else:
-                    inside_ymin = round(context.ycent - inside_pix_offset - box_width)
-                    inside_ymax = round(context.ycent - inside_pix_offset)
-                    outside_ymin = round(context.ycent - outside_pix_offset - box_width)
-                    outside_ymax = round(context.ycent - outside_pix_offset)
-            else:
-                self.wedge_dir.value = "Vertical"
-                box_width = ROI_WIDTH / pixel_width
-                box_length = ROI_LENGTH / pixel_height
-                inside_pix_offset = INSIDE_OFFSET / pixel_width
-                outside_pix_offset = OUTSIDE_OFFSET / pixel_width
-
-                inside_ymin = outside_ymin = round(context.ycent - box_length / 2)
-                inside_ymax = outside_ymax = round(context.ycent + box_length / 2)
-
-                if context.wedges_side == "right":
-                    inside_xmin = round(context.xcent + inside_pix_offset)
-                    inside_xmax = round(context.xcent + inside_pix_offset + box_width)
-                    outside_xmin = round(context.xcent + outside_pix_offset)
-                    outside_xmax = round(context.xcent + outside_pix_offset + box_width)
-                else:
-                    inside_xmin = round(context.xcent - inside_pix_offset - box_width)
-                    inside_xmax = round(context.xcent - inside_pix_offset)
-                    outside_xmin = round(context.xcent - outside_pix_offset - box_width)
-                    outside_xmax = round(context.xcent - outside_pix_offset)
+            wedge_dir, inside_bounds, outside_bounds = wedge_rois(context, pixel_size)
+            self.wedge_dir.value = wedge_dir
+            # profiles are taken along the wedges rotated by this, the ROIs can not be rotated
+            self.rotation.value = context.rotation
+            inside_xmin, inside_xmax, inside_ymin, inside_ymax = inside_bounds
+            outside_xmin, outside_xmax, outside_ymin, outside_ymax = outside_bounds
 
             inside_roi = RectangleROI(image,
                                       inside_xmin,
@@ -130,74 +147,226 @@ class TO2ASliceWidth(PhantomModule):
         self.inside_wedge.viewer = self.viewer
         self.outside_wedge.viewer = self.viewer
 
+    @timed("slice_width.analyse")
     def analyse(self, batch: bool = False):
-        if (self.inside_wedge.roi is not None
-            and self.outside_wedge.roi is not None
-                and self.viewer.image is not None):
-            if self.wedge_dir.value == "Vertical":
-                inside_prof = self.inside_wedge.roi.v_profile
-                outside_prof = self.outside_wedge.roi.v_profile
-                pix_size = self.viewer.image.pixel_size[1]
-            else:
-                inside_prof = self.inside_wedge.roi.h_profile
-                outside_prof = self.outside_wedge.roi.h_profile
-                pix_size = self.viewer.image.pixel_size[2]
-
-            inside_prof_diff = np.diff(inside_prof)
-            outside_prof_diff = np.diff(outside_prof)
-
-            init_in_max = np.max(inside_prof_diff)
-            init_in_min = np.min(inside_prof_diff)
-            if abs(init_in_max) > abs(init_in_min):
-                init_in_amp = init_in_max
-            else:
-                init_in_amp = init_in_min
-            init_in_bl = np.min(inside_prof)
-            init_in_c = self.expected_width.value / 2
-            init_in_a = inside_prof_diff.shape[0] / 2 - init_in_c
-            init_in_b = inside_prof_diff.shape[0] / 2 + init_in_c
-            init_in = (init_in_a, init_in_b, init_in_c, init_in_amp, init_in_bl)
-            in_shp = list(inside_prof_diff.shape)
-            in_shp[0] = in_shp[0] + 1
-            in_indeces = np.indices(in_shp)[0]
-
-            in_fit, _ = curve_fit(split_gauss_integral,
-                                  in_indeces,
-                                  inside_prof,
-                                  init_in)
-
-            init_out_max = np.max(outside_prof_diff)
-            init_out_min = np.min(outside_prof_diff)
-            if abs(init_out_max) > abs(init_out_min):
-                init_out_amp = init_out_max
-            else:
-                init_out_amp = init_out_min
-            init_out_bl = np.min(outside_prof)
-            init_out_c = self.expected_width.value / 2
-            init_out_a = outside_prof_diff.shape[0] / 2 - init_out_c
-            init_out_b = outside_prof_diff.shape[0] / 2 + init_out_c
-            init_out = (init_out_a, init_out_b, init_out_c, init_out_amp, init_out_bl)
-            out_shp = list(outside_prof_diff.shape)
-            out_shp[0] = out_shp[0] + 1
-            out_indeces = np.indices(out_shp)[0]
-
-            out_fit, _ = curve_fit(split_gauss_integral,
-                                   out_indeces,
-                                   outside_prof,
-                                   init_out)
-
-            divisor = 100 / self.max_perc.value
-            c_coeff = 2 * math.sqrt(2 * math.log(divisor))
-
-            inside_fwhm = abs(in_fit[1] - in_fit[0]) + c_coeff * in_fit[2]
-            outside_fwhm = abs(out_fit[1] - out_fit[0]) + c_coeff * out_fit[2]
-
-            tan_theta = self.tan_theta.value
-
-            inside_width = inside_fwhm * tan_theta * pix_size
-            outside_width = outside_fwhm * tan_theta * pix_size
-
-            self.inside_wedge_width.value = inside_width
-            self.outside_wedge_width.value = outside_width
-
-            self.slice_width.value = math.sqrt(inside_width * outside_width)
+        job = self.analysis_job()
+        if job is not None:
+            job()()
+
+    def analysis_job(self) -> JobFunction | None:
+        """
+        Returns the analysis split into a job, see `background`, or None if the ROIs are not drawn.
+        The inputs and ROIs are read when this is called, the wedges are fitted by the job
+        and the outputs are set by the function it returns.
+        """
+        if (self.inside_wedge.roi is None
+            or self.outside_wedge.roi is None
+                or self.viewer.image is None):
+            return None
+
+        if self.wedge_dir.value == "Vertical":
+            wedge_dir = "Vertical"
+            pix_size = self.viewer.image.pixel_size[1]
+        else:
+            wedge_dir = "Horizontal"
+            pix_size = self.viewer.image.pixel_size[2]
+
+        results = self.roi_results
+        rois = {"inside": self.inside_wedge.roi, "outside": self.outside_wedge.roi}
+        rotation = self.rotation.value
+        expected_width = self.expected_width.value
+        tan_theta = self.tan_theta.value
+        max_perc = self.max_perc.value
+        dicom_dataset = self.viewer.image.dicom_dataset
+        all_slices_job = self.all_slices_job(pix_size) if self.all_slices.value else None
+        rows_job = self.rows_job(pix_size) if self.fit_rows.value else None
+
+        def job() -> ApplyFunction:
+            signatures = {name: (roi_signature(roi), wedge_dir, rotation, expected_width)
+                          for name, roi in rois.items()}
+            changed = [name for name, signature in signatures.items()
+                       if not results.is_current(name, signature)]
+
+            if changed:
+                with profiler.span("slice_width.profiles"):
+                    profiles = [rectangle_profile(rois[name], wedge_dir, rotation)
+                                for name in changed]
+                # both wedges are fitted together, warm started, unless only one has moved
+                warm_start_key = None
+                if len(changed) == 2:
+                    warm_start_key = fit_key(dicom_dataset, wedge_dir)
+                with profiler.span("slice_width.fit"):
+                    fits = fit_profiles(profiles, expected_width, warm_start_key)
+                for name, fit in zip(changed, fits):
+                    results.put(name, signatures[name], fit)
+
+            inside_width, outside_width, slice_width = widths_from_fits(
+                results.result("inside"),  # type: ignore
+                results.result("outside"),  # type: ignore
+                pix_size,
+                tan_theta,
+                max_perc)
+
+            apply_all_slices = None
+            if all_slices_job is not None:
+                apply_all_slices = all_slices_job()
+            apply_rows = None
+            if rows_job is not None:
+                apply_rows = rows_job()
+
+            def apply() -> None:
+                self.inside_wedge_width.value = inside_width
+                self.outside_wedge_width.value = outside_width
+
+                self.slice_width.value = slice_width
+
+                if apply_all_slices is not None:
+                    apply_all_slices()
+                if apply_rows is not None:
+                    apply_rows()
+            return apply
+
+        return job
+
+    def analyse_all_slices(self, pix_size: float) -> None:
+        """
+        Calculates the slice width for every slice of the series using the current ROIs,
+        fitting all slices together.
+        """
+        job = self.all_slices_job(pix_size)
+        if job is not None:
+            job()()
+
+    def all_slices_job(self, pix_size: float) -> JobFunction | None:
+        """
+        Returns `analyse_all_slices` split into a job, see `background`,
+        or None if the ROIs are not drawn.
+        """
+        image = self.viewer.image
+        if (image is None
+            or self.inside_wedge.roi is None
+                or self.outside_wedge.roi is None):
+            return None
+
+        if isinstance(image, Instance):
+            series = image.series
+        else:
+            series = image
+
+        wedge_dir = "Vertical" if self.wedge_dir.value == "Vertical" else "Horizontal"
+        inside = self.inside_wedge.roi
+        outside = self.outside_wedge.roi
+        rotation = self.rotation.value
+        expected_width = self.expected_width.value
+        tan_theta = self.tan_theta.value
+        max_perc = self.max_perc.value
+        results = self.roi_results
+
+        def fit_all_slices() -> np.ndarray | None:
+            image_stack = series.array
+            if image_stack.ndim != 3:
+                return None
+            with profiler.span("slice_width.profiles"):
+                inside_profs = stack_box_profiles(image_stack,
+                                                  (inside.xmin, inside.xmax, inside.ymin, inside.ymax),
+                                                  wedge_dir,
+                                                  rotation,
+                                                  series.pixel_size)
+                outside_profs = stack_box_profiles(image_stack,
+                                                   (outside.xmin, outside.xmax,
+                                                    outside.ymin, outside.ymax),
+                                                   wedge_dir,
+                                                   rotation,
+                                                   series.pixel_size)
+            return slice_widths_stack(inside_profs,
+                                      outside_profs,
+                                      expected_width,
+                                      pix_size,
+                                      tan_theta,
+                                      max_perc)[2]
+
+        def job() -> ApplyFunction:
+            signature = (roi_signature(inside),
+                         roi_signature(outside),
+                         wedge_dir,
+                         rotation,
+                         expected_width,
+                         pix_size,
+                         tan_theta,
+                         max_perc)
+            widths = results.get("all_slices", signature, fit_all_slices)
+
+            def apply() -> None:
+                if widths is None:
+                    return
+                summary = width_summary(widths)
+
+                self.mean_slice_width.value = summary["mean"]
+                self.std_slice_width.value = summary["std"]
+                self.min_slice_width.value = summary["min"]
+                self.max_slice_width.value = summary["max"]
+                self.all_slice_widths.value = ", ".join(f"{width:.3f}" for width in widths)
+            return apply
+
+        return job
+
+    def analyse_rows(self, pix_size: float) -> None:
+        """
+        Calculates the slice width from every bin of `row_bin` rows across the wedge ROIs,
+        rejecting outliers, see `kernels.slice_width.slice_widths_rows`.
+        """
+        job = self.rows_job(pix_size)
+        if job is not None:
+            job()()
+
+    def rows_job(self, pix_size: float) -> JobFunction | None:
+        """
+        Returns `analyse_rows` split into a job, see `background`,
+        or None if the ROIs are not drawn.
+        """
+        if self.inside_wedge.roi is None or self.outside_wedge.roi is None:
+            return None
+
+        wedge_dir = "Vertical" if self.wedge_dir.value == "Vertical" else "Horizontal"
+        inside = self.inside_wedge.roi
+        outside = self.outside_wedge.roi
+        rotation = self.rotation.value
+        bin_rows = max(1, self.row_bin.value)
+        tan_theta = self.tan_theta.value
+        max_perc = self.max_perc.value
+        results = self.roi_results
+
+        def fit_rows() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+            with profiler.span("slice_width.profiles"):
+                inside_rows = rectangle_row_profiles(inside, wedge_dir, bin_rows, rotation)
+                outside_rows = rectangle_row_profiles(outside, wedge_dir, bin_rows, rotation)
+            return slice_widths_rows(inside_rows,
+                                     outside_rows,
+                                     pix_size,
+                                     tan_theta,
+                                     max_perc)
+
+        def job() -> ApplyFunction:
+            signature = (roi_signature(inside),
+                         roi_signature(outside),
+                         wedge_dir,
+                         rotation,
+                         bin_rows,
+                         pix_size,
+                         tan_theta,
+                         max_perc)
+            widths = results.get("rows", signature, fit_rows)
+            summary = row_width_summary(*widths)
+
+            def apply() -> None:
+                self.row_slice_width.value = summary["slice_width"]
+                self.median_row_width.value = summary["median"]
+                self.mean_row_width.value = summary["mean"]
+                self.std_row_width.value = summary["std"]
+                self.min_row_width.value = summary["min"]
+                self.max_row_width.value = summary["max"]
+                self.rejected_rows.value = int(summary["rejected"])
+                self.all_row_widths.value = ", ".join(f"{width:.3f}" for width in widths[2])
+            return apply
+
+        return job
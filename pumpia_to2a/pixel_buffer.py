@@ -0,0 +1,126 @@
+"""
+Shared buffer of decoded pixel arrays.
+
+`Instance.array` decodes the pixel data and applies the rescale each time it is used,
+and each ROI loads its pixels through it.
+The context manager and modules get arrays from `pixel_buffer` instead,
+so each image is decoded once however many modules and ROIs use it.
+Arrays in the buffer are read only as they are shared,
+and the buffer can be used from the analysis worker thread.
+"""
+import threading
+from collections import OrderedDict
+from typing import Literal
+
+import numpy as np
+
+from pumpia.file_handling.dicom_structures import Instance
+from pumpia.image_handling.image_structures import ArrayImage
+from pumpia.image_handling.roi_structures import RectangleROI, LineROI
+
+from pumpia_to2a.kernels.profiles import box_profile, box_row_profiles, line_profile
+
+# number of decoded slices kept
+BUFFER_SIZE = 8
+
+
+def image_key(image: Instance) -> tuple[str, str, int]:
+    """
+    Returns the key identifying an image,
+    (series UID, SOP instance UID, slice number).
+    """
+    dataset = image.dicom_dataset
+    sop_uid = "" if dataset is None else str(dataset.get("SOPInstanceUID", ""))
+    return (image.series.series_id, sop_uid, image.slice_number)
+
+
+class PixelBuffer:
+    """
+    Least recently used buffer of decoded 2D slices.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        The number of slices kept (default is 8).
+
+    Methods
+    -------
+    array(image: ArrayImage, slice_num: int = 0) -> np.ndarray
+    clear()
+    """
+
+    def __init__(self, max_entries: int = BUFFER_SIZE):
+        self.max_entries: int = max_entries
+        self._arrays: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        self._lock = threading.RLock()
+
+    def array(self, image: ArrayImage, slice_num: int = 0) -> np.ndarray:
+        """
+        Returns the read only 2D array of a slice of `image`, as `image.array[slice_num]`.
+        Only `Instance` images are buffered.
+        """
+        if not isinstance(image, Instance):
+            return image.array[slice_num]
+
+        key = (image_key(image), slice_num)
+        with self._lock:
+            try:
+                array = self._arrays.pop(key)
+            except KeyError:
+                array = np.asarray(image.array[slice_num])
+                array.flags.writeable = False
+                if len(self._arrays) >= self.max_entries:
+                    self._arrays.popitem(last=False)
+            self._arrays[key] = array
+            return array
+
+    def clear(self) -> None:
+        """
+        Removes all arrays from the buffer.
+        """
+        with self._lock:
+            self._arrays.clear()
+
+
+pixel_buffer = PixelBuffer()
+
+
+def rectangle_profile(roi: RectangleROI,
+                      direction: Literal["Horizontal", "Vertical"],
+                      rotation: float = 0) -> np.ndarray:
+    """
+    Returns `roi.h_profile` or `roi.v_profile` using the shared buffer,
+    without the ROI loading its own copy of the image.
+    If `rotation` is not 0 the profile is taken along the ROI rotated about its centre,
+    see `box_pixels`.
+    """
+    return box_profile(pixel_buffer.array(roi.image, roi.slice_num),
+                       (roi.xmin, roi.xmax, roi.ymin, roi.ymax),
+                       direction,
+                       rotation,
+                       roi.image.pixel_size)
+
+
+def rectangle_row_profiles(roi: RectangleROI,
+                           direction: Literal["Horizontal", "Vertical"],
+                           bin_rows: int = 1,
+                           rotation: float = 0) -> np.ndarray:
+    """
+    Returns the profiles of each bin of `bin_rows` rows across `roi`, see `box_row_profiles`,
+    using the shared buffer.
+    """
+    return box_row_profiles(pixel_buffer.array(roi.image, roi.slice_num),
+                            (roi.xmin, roi.xmax, roi.ymin, roi.ymax),
+                            direction,
+                            bin_rows,
+                            rotation,
+                            roi.image.pixel_size)
+
+
+def roi_line_profile(roi: LineROI) -> np.ndarray:
+    """
+    Returns `roi.profile` using the shared buffer,
+    without the ROI loading its own copy of the image.
+    """
+    return line_profile(pixel_buffer.array(roi.image, roi.slice_num),
+                        (roi.x1, roi.y1, roi.x2, roi.y2))
@@ -0,0 +1,109 @@
+"""
+Output frame showing the progress of a `background.BackgroundTask`.
+"""
+import tkinter as tk
+from tkinter import ttk
+from collections.abc import Callable
+
+from pumpia.module_handling.module_collections import OutputFrame
+
+from pumpia_to2a.background import BackgroundTask, Cancelled
+
+# milliseconds between checks of the task progress
+POLL_INTERVAL = 100
+
+
+class ProgressFrame(OutputFrame):
+    """
+    Output frame showing the progress of the task running in the background,
+    with a button to cancel it.
+    The copy buttons copy the current status.
+
+    Methods
+    -------
+    track(task: BackgroundTask, on_done: Callable[[BackgroundTask], None])
+    """
+
+    def setup(self, *, parent: tk.Misc | None = None, verbose_name: str | None = None):
+        if self.is_setup:
+            return
+        super().setup(parent=parent, verbose_name=verbose_name)
+
+        self._task: BackgroundTask | None = None
+        self._on_done: Callable[[BackgroundTask], None] | None = None
+
+        self.fraction_var = tk.DoubleVar(self, value=0)
+        self.status_var = tk.StringVar(self, value="Idle")
+
+        self.progress_bar = ttk.Progressbar(self.output_frame,
+                                            variable=self.fraction_var,
+                                            maximum=1)
+        self.progress_bar.grid(column=0, row=0, sticky="nsew")
+        self.cancel_button = ttk.Button(self.output_frame,
+                                        text="Cancel",
+                                        command=self.cancel,
+                                        state="disabled")
+        self.cancel_button.grid(column=1, row=0, sticky="nsew")
+        self.status_label = ttk.Label(self.output_frame, textvariable=self.status_var)
+        self.status_label.grid(column=0, row=1, columnspan=2, sticky="nsw")
+
+        self.output_frame.columnconfigure(0, weight=1)
+
+    def track(self, task: BackgroundTask, on_done: Callable[[BackgroundTask], None]) -> None:
+        """
+        Shows the progress of `task` until it finishes,
+        then calls `on_done` with it on the main thread.
+        A task tracked before is no longer shown and its `on_done` is not called.
+        """
+        self._task = task
+        self._on_done = on_done
+        self.fraction_var.set(0)
+        self.status_var.set(task.name)
+        self.cancel_button.configure(state="normal")
+        self.after(POLL_INTERVAL, self._poll, task)
+
+    def cancel(self) -> None:
+        """
+        Cancels the task being shown.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self.status_var.set(f"{self._task.name}: cancelling")
+
+    def _poll(self, task: BackgroundTask) -> None:
+        """
+        Shows the progress of `task`, checking again after `POLL_INTERVAL` until it is done.
+        """
+        if task is not self._task:
+            return
+
+        if not task.done:
+            fraction, message = task.progress()
+            self.fraction_var.set(fraction)
+            if not task.cancelled:
+                self.status_var.set(f"{task.name}: {message}" if message else task.name)
+            self.after(POLL_INTERVAL, self._poll, task)
+            return
+
+        self._task = None
+        on_done = self._on_done
+        self._on_done = None
+        self.cancel_button.configure(state="disabled")
+
+        exception = task.future.exception()
+        if isinstance(exception, Cancelled):
+            self.fraction_var.set(0)
+            self.status_var.set(f"{task.name}: cancelled")
+        elif exception is not None:
+            self.fraction_var.set(0)
+            self.status_var.set(f"{task.name}: failed")
+        else:
+            self.fraction_var.set(1)
+            self.status_var.set(f"{task.name}: done")
+
+        if on_done is not None:
+            on_done(task)
+
+    @property
+    def var_strings(self) -> list[str]:
+        return [self.status_var.get()]
@@ -0,0 +1,603 @@
+"""
+DICOM storage receiver analysing TO2A series sent from a scanner or PACS.
+
+Runs a C-STORE SCP with pynetdicom, an optional dependency only needed by this module
+(`pip install pynetdicom`).
+Received instances are kept in memory per series as their encoded bytes.
+When the instances held take more than `max_memory` bytes the series holding the most
+is spilled to a temporary folder, and the rest of that series is written there as it arrives,
+so the memory used stays bounded for series of any size.
+A series is complete once no instances have been received for it for `settle` seconds,
+its middle slice is then decoded straight from the bytes (or the spilled files)
+and analysed in a process pool through shared memory, see `batch.analyse_arrays`,
+without writing the instances anywhere.
+Instances of a series received after it is complete are analysed as a new series,
+so `settle` should be longer than any pause while a series is sent.
+Results are written to the results database and optionally a JSON lines file.
+No tkinter is imported.
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import signal
+import tempfile
+import argparse
+import threading
+import traceback
+from io import BytesIO
+from pathlib import Path
+from collections import deque
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any
+
+import numpy as np
+import pydicom
+from pydicom.errors import InvalidDicomError
+from pydicom.pixels import pixel_array as decode_pixels
+
+from pumpia_to2a.batch import (ImageJob,
+                               pixel_size_of,
+                               header_record,
+                               record_status,
+                               submit_shared)
+from pumpia_to2a.dicom_frames import read_header, read_frames, num_frames, rescale
+from pumpia_to2a.results_store import ResultsStore, default_store_path
+from pumpia_to2a.context_cache import default_cache_dir
+from pumpia_to2a.shared_arrays import release
+
+DEFAULT_PORT = 11112
+DEFAULT_AE_TITLE = "PUMPIA_TO2A"
+DEFAULT_SETTLE = 10
+# bytes of received instances held in memory before series are spilled to disk
+DEFAULT_MAX_MEMORY = 512 * 2**20
+# seconds between checks for complete series
+CHECK_INTERVAL = 0.5
+
+# C-STORE status codes
+STATUS_SUCCESS = 0x0000
+STATUS_CANNOT_UNDERSTAND = 0xC000
+STATUS_OUT_OF_RESOURCES = 0xA700
+
+# an instance is held as its encoded bytes or the file it was spilled to
+InstanceData = bytes | Path
+
+
+@dataclass
+class ReceivedSeries:
+    """
+    The instances of a series received by a `SeriesAssembler`.
+
+    Attributes
+    ----------
+    series_uid : str
+    description : str
+    protocol : str
+    instances : dict[str, tuple[int, InstanceData]]
+        The instance number and data of each instance, keyed by SOP instance UID.
+    memory : int
+        The bytes of the instances held in memory.
+    spilled : bool
+        Whether the series has been spilled to disk, new instances are written straight to disk.
+    last_change : float
+        The `time.monotonic` time an instance was last received.
+    """
+    series_uid: str
+    description: str = ""
+    protocol: str = ""
+    instances: dict[str, tuple[int, InstanceData]] = field(default_factory=dict)
+    memory: int = 0
+    spilled: bool = False
+    last_change: float = 0
+
+    def sorted_data(self) -> list[InstanceData]:
+        """
+        Returns the data of the instances sorted by instance number.
+        """
+        return [data for _, data in sorted(self.instances.values(), key=lambda x: x[0])]
+
+
+class SeriesAssembler:
+    """
+    Collects received instances into series, see the module documentation.
+    Instances are added from the association threads, so all methods are thread safe.
+
+    Parameters
+    ----------
+    settle : float, optional
+        Seconds without new instances before a series is complete (default is `DEFAULT_SETTLE`).
+    max_memory : int, optional
+        Bytes of instances held in memory before series are spilled to disk
+        (default is `DEFAULT_MAX_MEMORY`).
+    spill_dir : Path or None, optional
+        The folder spilled series are written to,
+        a temporary folder removed by `close` if None (default is None).
+    series_filter : str or None, optional
+        Regular expression matched against the series description and protocol name,
+        if given instances of other series are not kept (default is None).
+
+    Methods
+    -------
+    add(data: bytes, ds: pydicom.Dataset, now: float | None = None) -> bool
+    complete(now: float | None = None) -> list[ReceivedSeries]
+    discard(series: ReceivedSeries)
+    close()
+    """
+
+    def __init__(self,
+                 settle: float = DEFAULT_SETTLE,
+                 max_memory: int = DEFAULT_MAX_MEMORY,
+                 spill_dir: Path | None = None,
+                 series_filter: str | None = None):
+        self.settle = settle
+        self.max_memory = max_memory
+        self.pattern = None if series_filter is None else re.compile(series_filter, re.IGNORECASE)
+        self._spill_dir = None if spill_dir is None else Path(spill_dir)
+        self._temporary_dir: Path | None = None
+        self._lock = threading.Lock()
+        # series still receiving instances
+        self._open: dict[str, ReceivedSeries] = {}
+        # every series holding data, including complete series not yet discarded
+        self._held: list[ReceivedSeries] = []
+
+    @property
+    def memory(self) -> int:
+        """
+        The bytes of instances held in memory.
+        """
+        with self._lock:
+            return sum(series.memory for series in self._held)
+
+    def _matches(self, description: str, protocol: str) -> bool:
+        return (self.pattern is None
+                or self.pattern.search(description) is not None
+                or self.pattern.search(protocol) is not None)
+
+    def _series_dir(self, series: ReceivedSeries) -> Path:
+        if self._spill_dir is None:
+            self._temporary_dir = Path(tempfile.mkdtemp(prefix="pumpia_to2a_receiver_"))
+            self._spill_dir = self._temporary_dir
+        # a series can be held twice if instances arrive after it is complete
+        folder = self._spill_dir / f"{series.series_uid}_{id(series)}"
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder
+
+    def _write(self, series: ReceivedSeries, sop_uid: str, data: bytes) -> Path:
+        path = self._series_dir(series) / f"{sop_uid}.dcm"
+        path.write_bytes(data)
+        return path
+
+    def _spill(self, series: ReceivedSeries) -> None:
+        """
+        Writes the instances of `series` held in memory to disk.
+        """
+        for sop_uid, (instance, data) in list(series.instances.items()):
+            if isinstance(data, bytes):
+                series.instances[sop_uid] = (instance, self._write(series, sop_uid, data))
+        series.memory = 0
+        series.spilled = True
+
+    def add(self, data: bytes, ds: pydicom.Dataset, now: float | None = None) -> bool:
+        """
+        Adds a received instance.
+
+        Parameters
+        ----------
+        data : bytes
+            The instance encoded as a DICOM file.
+        ds : pydicom.Dataset
+            The header of the instance.
+        now : float or None, optional
+            The `time.monotonic` time received (default is None).
+
+        Returns
+        -------
+        bool
+            False if the instance is not kept, as it is not an image of a matching series.
+        """
+        if now is None:
+            now = time.monotonic()
+        if "Rows" not in ds or "SeriesInstanceUID" not in ds:
+            return False
+        description = str(ds.get("SeriesDescription", ""))
+        protocol = str(ds.get("ProtocolName", ""))
+        if not self._matches(description, protocol):
+            return False
+
+        series_uid = str(ds.SeriesInstanceUID)
+        sop_uid = str(ds.get("SOPInstanceUID", "")) or str(len(data))
+        instance = int(ds.get("InstanceNumber", 0) or 0)
+        with self._lock:
+            series = self._open.get(series_uid)
+            if series is None:
+                series = ReceivedSeries(series_uid, description, protocol)
+                self._open[series_uid] = series
+                self._held.append(series)
+            series.last_change = now
+
+            previous = series.instances.get(sop_uid)
+            if previous is not None and isinstance(previous[1], bytes):
+                # sent again, replacing the copy held
+                series.memory -= len(previous[1])
+
+            if not series.spilled:
+                memory = sum(held.memory for held in self._held) + len(data)
+                if memory > self.max_memory:
+                    largest = max(self._held, key=lambda held: held.memory)
+                    if largest.memory < series.memory + len(data):
+                        largest = series
+                    self._spill(largest)
+
+            if series.spilled:
+                series.instances[sop_uid] = (instance, self._write(series, sop_uid, data))
+            else:
+                series.instances[sop_uid] = (instance, data)
+                series.memory += len(data)
+        return True
+
+    def complete(self, now: float | None = None) -> list[ReceivedSeries]:
+        """
+        Returns the series that have become complete, each series is only returned once.
+        The data of a series is held until it is passed to `discard`.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            complete = [series for series in self._open.values()
+                        if now - series.last_change >= self.settle]
+            for series in complete:
+                del self._open[series.series_uid]
+        return complete
+
+    def discard(self, series: ReceivedSeries) -> None:
+        """
+        Frees the data of a complete series, removing any spilled files.
+        """
+        with self._lock:
+            if series in self._held:
+                self._held.remove(series)
+            paths = [data for _, data in series.instances.values() if isinstance(data, Path)]
+            series.instances.clear()
+            series.memory = 0
+        for path in paths:
+            path.unlink(missing_ok=True)
+        if paths:
+            try:
+                paths[0].parent.rmdir()
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        """
+        Discards every series and removes the temporary spill folder.
+        """
+        with self._lock:
+            held = list(self._held)
+            self._open.clear()
+        for series in held:
+            self.discard(series)
+        if self._temporary_dir is not None:
+            shutil.rmtree(self._temporary_dir, ignore_errors=True)
+
+
+def _read_dataset(data: InstanceData) -> pydicom.Dataset:
+    """
+    Reads an instance, from memory the whole dataset, from disk only the header.
+    """
+    if isinstance(data, Path):
+        return read_header(data)
+    return pydicom.dcmread(BytesIO(data))
+
+
+def _read_frames(data: InstanceData, ds: pydicom.Dataset, frames: list[int]) -> np.ndarray:
+    """
+    Reads frames of an instance, see `dicom_frames.read_frames`.
+    """
+    if isinstance(data, Path):
+        return read_frames(data, frames, ds)
+    if num_frames(ds) == 1:
+        raw = [decode_pixels(ds)] * len(frames)
+    else:
+        raw = [decode_pixels(ds, index=frame) for frame in frames]
+    return np.stack([rescale(array, ds, frame) for array, frame in zip(raw, frames)])
+
+
+def series_job(series: ReceivedSeries, all_slices: bool = False) -> ImageJob:
+    """
+    Loads the middle slice of a complete series as `batch.load_slice` does for files.
+
+    Parameters
+    ----------
+    series : ReceivedSeries
+    all_slices : bool, optional
+        Whether to also load every slice, for the slice width of every slice (default is False).
+    """
+    sorted_data = series.sorted_data()
+    frame = 0
+    if len(sorted_data) == 1:
+        data = sorted_data[0]
+        ds = _read_dataset(data)
+        frame = num_frames(ds) // 2
+    else:
+        data = sorted_data[len(sorted_data) // 2]
+        ds = _read_dataset(data)
+
+    pixel_size = pixel_size_of(ds, frame)
+    record = {"series_uid": series.series_uid,
+              "series_description": series.description,
+              "num_files": len(sorted_data),
+              **header_record(ds, pixel_size),
+              # received instances are not kept as files
+              "file": ""}
+    image_stack = None
+    if all_slices:
+        image_stack = np.concatenate(
+            [_read_frames(item, item_ds, list(range(num_frames(item_ds))))
+             for item, item_ds in ((item, _read_dataset(item)) for item in sorted_data)])
+    return ImageJob(record, _read_frames(data, ds, [frame])[0], pixel_size, ds, image_stack)
+
+
+def _import_pynetdicom() -> Any:
+    """
+    Imports pynetdicom, which is only needed by the receiver.
+    """
+    try:
+        # pylint: disable-next=import-outside-toplevel
+        import pynetdicom
+    except ImportError as exc:
+        raise ImportError("The DICOM receiver needs pynetdicom, "
+                          "install it with `pip install pynetdicom`") from exc
+    return pynetdicom
+
+
+def handle_store(event: Any, assembler: SeriesAssembler) -> int:
+    """
+    Handles a C-STORE request, adding the instance to `assembler`.
+    Instances that are not images of a matching series are accepted and not kept.
+
+    Returns
+    -------
+    int
+        The C-STORE status.
+    """
+    try:
+        data = event.encoded_dataset(include_meta=True)
+        ds = pydicom.dcmread(BytesIO(data), stop_before_pixels=True)
+    except (InvalidDicomError, ValueError, EOFError, AttributeError):
+        return STATUS_CANNOT_UNDERSTAND
+    try:
+        assembler.add(data, ds)
+    except OSError:
+        return STATUS_OUT_OF_RESOURCES
+    return STATUS_SUCCESS
+
+
+def start_server(assembler: SeriesAssembler,
+                 port: int = DEFAULT_PORT,
+                 ae_title: str = DEFAULT_AE_TITLE,
+                 host: str = "") -> Any:
+    """
+    Starts a storage SCP accepting every storage SOP class and transfer syntax
+    on a background thread, adding the received instances to `assembler`.
+
+    Returns
+    -------
+    pynetdicom.transport.ThreadedAssociationServer
+        The running server, stopped with its `shutdown` method.
+    """
+    pynetdicom = _import_pynetdicom()
+    ae = pynetdicom.AE(ae_title=ae_title)
+    for context in pynetdicom.AllStoragePresentationContexts:
+        ae.add_supported_context(context.abstract_syntax, pynetdicom.ALL_TRANSFER_SYNTAXES)
+    ae.add_supported_context(pynetdicom.sop_class.Verification)
+    return ae.start_server((host, port),
+                           block=False,
+                           evt_handlers=[(pynetdicom.evt.EVT_C_STORE,
+                                          handle_store,
+                                          [assembler])])
+
+
+def _init_worker() -> None:
+    """
+    Sets up a worker process, interrupts are handled by the receiver
+    so the series received are finished.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def receive(port: int = DEFAULT_PORT,
+            ae_title: str = DEFAULT_AE_TITLE,
+            host: str = "",
+            workers: int | None = None,
+            settle: float = DEFAULT_SETTLE,
+            max_memory: int = DEFAULT_MAX_MEMORY,
+            spill_dir: Path | None = None,
+            series_filter: str | None = None,
+            cache_dir: Path | None = None,
+            store: Path | None = None,
+            output: Path | None = None,
+            all_slices: bool = False,
+            max_pending: int | None = None,
+            stop: threading.Event | None = None) -> None:
+    """
+    Receives and analyses series until `stop` is set, or the process is interrupted,
+    then analyses the series already received.
+
+    Parameters
+    ----------
+    port : int, optional
+        The port listened on (default is `DEFAULT_PORT`).
+    ae_title : str, optional
+        The AE title of the receiver (default is `DEFAULT_AE_TITLE`).
+    host : str, optional
+        The address listened on, all addresses if empty (default is "").
+    workers : int or None, optional
+        Number of worker processes, defaults to the number of CPUs (default is None).
+    settle : float, optional
+        Seconds without new instances before a series is complete (default is `DEFAULT_SETTLE`).
+    max_memory : int, optional
+        Bytes of instances held in memory before series are spilled to disk
+        (default is `DEFAULT_MAX_MEMORY`).
+    spill_dir : Path or None, optional
+        The folder spilled series are written to, a temporary folder if None (default is None).
+    series_filter : str or None, optional
+        Regular expression to select series, see `batch.find_series` (default is None).
+    cache_dir : Path or None, optional
+        The folder of the context cache, the cache is not used if None (default is None).
+    store : Path or None, optional
+        The results database, records are not stored if None (default is None).
+    output : Path or None, optional
+        JSON lines file each record is appended to (default is None).
+    all_slices : bool, optional
+        Whether to also calculate the slice width of every slice (default is False).
+    max_pending : int or None, optional
+        The most series in the pool at once, twice the number of workers if None,
+        complete series wait with their data held until the pool has room (default is None).
+    stop : threading.Event or None, optional
+        Set to stop receiving (default is None).
+    """
+    if stop is None:
+        stop = threading.Event()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    def request_stop(*_):
+        stop.set()
+
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            previous_handlers[signum] = signal.signal(signum, request_stop)
+
+    assembler = SeriesAssembler(settle, max_memory, spill_dir, series_filter)
+    queued: deque[ReceivedSeries] = deque()
+    pending: dict[Future, list[SharedMemory]] = {}
+    server = None
+    try:
+        with ((nullcontext() if store is None else ResultsStore(store)) as results_store,
+              (nullcontext() if output is None
+               else open(output, "a", encoding="utf-8")) as output_file,
+              ProcessPoolExecutor(max_workers=workers,
+                                  initializer=_init_worker) as executor):
+            server = start_server(assembler, port, ae_title, host)
+            print(f"Receiving as {ae_title} on port {port}", file=sys.stderr)
+
+            def finish(record: dict) -> None:
+                if output_file is not None:
+                    output_file.write(json.dumps(record) + "\n")
+                    output_file.flush()
+                if results_store is not None and record.get("skipped") is None:
+                    results_store.add_batch_record(record, source="receiver")
+                print(f"{record['series_description']} ({record['series_uid']}): "
+                      + record_status(record),
+                      file=sys.stderr)
+
+            while True:
+                if stop.is_set() and server is not None:
+                    server.shutdown()
+                    server = None
+                    # everything received is complete once no more can arrive
+                    queued.extend(assembler.complete(float("inf")))
+                else:
+                    queued.extend(assembler.complete())
+
+                while queued and len(pending) < max_pending:
+                    series = queued.popleft()
+                    try:
+                        job = series_job(series, all_slices)
+                    # pylint: disable-next=broad-exception-caught
+                    except Exception as exc:
+                        finish({"series_uid": series.series_uid,
+                                "series_description": series.description,
+                                "num_files": len(series.instances),
+                                "error": f"{type(exc).__name__}: {exc}",
+                                "traceback": traceback.format_exc()})
+                        continue
+                    finally:
+                        assembler.discard(series)
+                    future, blocks = submit_shared(executor, job, cache_dir)
+                    pending[future] = blocks
+                    del job
+
+                if server is None and not pending and not queued:
+                    break
+                if not pending:
+                    stop.wait(CHECK_INTERVAL)
+                    continue
+                done, _ = wait(pending, timeout=CHECK_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for block in pending.pop(future):
+                        release(block)
+                    finish(future.result())
+    finally:
+        if server is not None:
+            server.shutdown()
+        for blocks in pending.values():
+            for block in blocks:
+                release(block)
+        assembler.close()
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Command line entry point for the DICOM receiver.
+    """
+    parser = argparse.ArgumentParser(description="Receive TO2A series over DICOM and analyse them.")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT,
+                        help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("-a", "--ae-title", default=DEFAULT_AE_TITLE,
+                        help=f"AE title of the receiver (default: {DEFAULT_AE_TITLE})")
+    parser.add_argument("--host", default="",
+                        help="address to listen on (default: all addresses)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("-f", "--series-filter", default=None,
+                        help="regular expression matched against series description/protocol")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE,
+                        help=f"seconds without new instances before a series is complete "
+                        f"(default: {DEFAULT_SETTLE})")
+    parser.add_argument("--max-memory", type=int, default=DEFAULT_MAX_MEMORY // 2**20,
+                        help="megabytes of instances held in memory before series are "
+                        f"spilled to disk (default: {DEFAULT_MAX_MEMORY // 2**20})")
+    parser.add_argument("--spill-dir", type=Path, default=None,
+                        help="folder series are spilled to (default: a temporary folder)")
+    parser.add_argument("-o", "--output", type=Path, default=None,
+                        help="JSON lines file to append the results to")
+    parser.add_argument("--all-slices", action="store_true",
+                        help="also calculate the slice width of every slice of each series")
+    parser.add_argument("--cache-dir", type=Path, default=default_cache_dir(),
+                        help="folder of the context cache (default: user cache folder)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always find the context, ignoring the context cache")
+    parser.add_argument("--store", type=Path, default=default_store_path(),
+                        help="results database to add each record to (default: user data folder)")
+    parser.add_argument("--no-store", action="store_true",
+                        help="do not add the results to the results database")
+    args = parser.parse_args(argv)
+
+    receive(args.port,
+            args.ae_title,
+            args.host,
+            args.workers,
+            args.settle,
+            args.max_memory * 2**20,
+            args.spill_dir,
+            args.series_filter,
+            None if args.no_cache else args.cache_dir,
+            None if args.no_store else args.store,
+            args.output,
+            args.all_slices)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
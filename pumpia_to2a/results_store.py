@@ -0,0 +1,396 @@
+"""
+Local SQLite database of TO2A results for trend analysis.
+
+Each analysis is stored as a run holding the key DICOM tags (scanner, coil, date, protocol),
+the context and the ROI coordinates,
+with every module output stored as a row of the outputs table.
+Runs are indexed by scanner and study date and outputs by module and name,
+so the history of one output for a scanner over a date range is a single indexed query.
+No tkinter is imported.
+"""
+import os
+import sys
+import json
+import math
+import sqlite3
+from pathlib import Path
+from datetime import date, datetime, timezone
+from collections.abc import Mapping
+
+import pydicom
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    recorded TEXT NOT NULL,
+    source TEXT NOT NULL,
+    station_name TEXT NOT NULL DEFAULT '',
+    manufacturer TEXT NOT NULL DEFAULT '',
+    model TEXT NOT NULL DEFAULT '',
+    coil TEXT NOT NULL DEFAULT '',
+    study_date TEXT NOT NULL DEFAULT '',
+    protocol TEXT NOT NULL DEFAULT '',
+    series_description TEXT NOT NULL DEFAULT '',
+    series_uid TEXT NOT NULL DEFAULT '',
+    sop_instance_uid TEXT NOT NULL DEFAULT '',
+    file TEXT NOT NULL DEFAULT '',
+    tags TEXT,
+    context TEXT,
+    rois TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    module TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL,
+    text TEXT,
+    PRIMARY KEY (run_id, module, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS runs_station_date ON runs(station_name, study_date);
+CREATE INDEX IF NOT EXISTS runs_date ON runs(study_date);
+CREATE INDEX IF NOT EXISTS outputs_module_name ON outputs(module, name, run_id);
+"""
+
+# DICOM keywords stored in the tags column of each run
+TAG_KEYWORDS = ("StationName",
+                "Manufacturer",
+                "ManufacturerModelName",
+                "DeviceSerialNumber",
+                "MagneticFieldStrength",
+                "ReceiveCoilName",
+                "StudyDate",
+                "SeriesDate",
+                "AcquisitionDate",
+                "ProtocolName",
+                "SeriesDescription",
+                "SeriesInstanceUID",
+                "SOPInstanceUID",
+                "InstanceNumber")
+
+
+def default_store_path() -> Path:
+    """
+    Returns the default results database, under the users data folder.
+    """
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA")
+        if base is None:
+            base = str(Path.home() / "AppData" / "Local")
+    else:
+        base = os.environ.get("XDG_DATA_HOME")
+        if base is None:
+            base = str(Path.home() / ".local" / "share")
+    return Path(base) / "pumpia_to2a" / "results.sqlite3"
+
+
+def date_key(value: str | date | None) -> str | None:
+    """
+    Returns a date as the DICOM "YYYYMMDD" string used for the study date column,
+    accepting dates and "YYYYMMDD" or ISO "YYYY-MM-DD" strings.
+    """
+    if value is None:
+        return None
+    if isinstance(value, date):
+        return value.strftime("%Y%m%d")
+    return str(value).replace("-", "")
+
+
+def dicom_tags(ds: pydicom.Dataset | None) -> dict[str, str]:
+    """
+    Returns the `TAG_KEYWORDS` in a dataset as strings,
+    the receive coil is taken from the MR receive coil sequence of enhanced files
+    if it is not in the dataset.
+    """
+    if ds is None:
+        return {}
+    tags = {keyword: str(ds.get(keyword, "") or "") for keyword in TAG_KEYWORDS}
+    if not tags["ReceiveCoilName"]:
+        for groups_name in ("SharedFunctionalGroupsSequence", "PerFrameFunctionalGroupsSequence"):
+            groups = ds.get(groups_name)
+            if groups and "MRReceiveCoilSequence" in groups[0]:
+                tags["ReceiveCoilName"] = str(
+                    groups[0].MRReceiveCoilSequence[0].get("ReceiveCoilName", "") or "")
+                break
+    return tags
+
+
+def _output_row(value: object) -> tuple[float | None, str | None]:
+    """
+    Returns the (value, text) columns for an output value,
+    numbers are stored as values, strings as text and anything else as JSON text.
+    """
+    if isinstance(value, bool):
+        return float(value), None
+    if isinstance(value, (int, float)):
+        value = float(value)
+        return (None if math.isnan(value) else value), None
+    if isinstance(value, str):
+        return None, value
+    if value is None:
+        return None, None
+    return None, json.dumps(value, default=float)
+
+
+class ResultsStore:
+    """
+    SQLite database of TO2A results.
+
+    Parameters
+    ----------
+    path : Path or None, optional
+        The database file, created if it does not exist,
+        defaults to `default_store_path()` (default is None).
+
+    Methods
+    -------
+    add_run(outputs, tags, context, rois, source, error, recorded) -> int
+    add_batch_record(record: dict, source: str = "batch") -> int
+    trend(module: str, name: str, station: str | None = None,
+          start: str | date | None = None, end: str | date | None = None) -> list[dict]
+    runs(station: str | None = None,
+         start: str | date | None = None, end: str | date | None = None) -> list[dict]
+    run_outputs(run_id: int) -> dict[str, dict[str, float | str | None]]
+    stations() -> list[str]
+    close()
+    """
+
+    def __init__(self, path: Path | None = None):
+        if path is None:
+            path = default_store_path()
+        self.path: Path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Closes the database connection.
+        """
+        self.connection.close()
+
+    def add_run(self,
+                outputs: Mapping[str, Mapping[str, object]],
+                tags: Mapping[str, str] | None = None,
+                context: dict | None = None,
+                rois: dict | None = None,
+                source: str = "gui",
+                error: str | None = None,
+                recorded: str | None = None) -> int:
+        """
+        Stores the results of one analysis.
+
+        Parameters
+        ----------
+        outputs : Mapping[str, Mapping[str, object]]
+            Output values keyed by module then output name.
+        tags : Mapping[str, str] or None, optional
+            DICOM tags as returned by `dicom_tags` (default is None).
+        context : dict or None, optional
+            The context record, see `context_cache.context_to_record` (default is None).
+        rois : dict or None, optional
+            JSON serialisable ROI coordinates (default is None).
+        source : str, optional
+            What ran the analysis, e.g. "gui" or "batch" (default is "gui").
+        error : str or None, optional
+            The error if the analysis failed (default is None).
+        recorded : str or None, optional
+            ISO time of the analysis, defaults to now (default is None).
+
+        Returns
+        -------
+        int
+            The id of the run.
+        """
+        if tags is None:
+            tags = {}
+        if recorded is None:
+            recorded = datetime.now(timezone.utc).isoformat()
+        study_date = (tags.get("StudyDate")
+                      or tags.get("SeriesDate")
+                      or tags.get("AcquisitionDate")
+                      or "")
+
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (recorded, source, station_name, manufacturer, model, coil, "
+                "study_date, protocol, series_description, series_uid, sop_instance_uid, file, "
+                "tags, context, rois, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (recorded,
+                 source,
+                 tags.get("StationName", ""),
+                 tags.get("Manufacturer", ""),
+                 tags.get("ManufacturerModelName", ""),
+                 tags.get("ReceiveCoilName", ""),
+                 study_date,
+                 tags.get("ProtocolName", ""),
+                 tags.get("SeriesDescription", ""),
+                 tags.get("SeriesInstanceUID", ""),
+                 tags.get("SOPInstanceUID", ""),
+                 tags.get("file", ""),
+                 json.dumps(dict(tags)),
+                 None if context is None else json.dumps(context, default=float),
+                 None if rois is None else json.dumps(rois, default=float),
+                 error))
+            run_id = int(cursor.lastrowid)  # type: ignore
+            self.connection.executemany(
+                "INSERT INTO outputs (run_id, module, name, value, text) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, module, name, *_output_row(value))
+                 for module, module_outputs in outputs.items()
+                 for name, value in module_outputs.items()])
+        return run_id
+
+    def add_batch_record(self, record: dict, source: str = "batch") -> int:
+        """
+        Stores a record returned by `batch.analyse_series`.
+        """
+        tags = dict(record.get("tags", {}))
+        tags.setdefault("SeriesInstanceUID", record.get("series_uid", ""))
+        tags.setdefault("SeriesDescription", record.get("series_description", ""))
+        tags.setdefault("SOPInstanceUID", record.get("sop_instance_uid", ""))
+        tags.setdefault("StationName", record.get("station_name", ""))
+        tags.setdefault("StudyDate", record.get("study_date", ""))
+        tags["file"] = record.get("file", "")
+
+        outputs = {module: {name: value for name, value in record[module].items()}
+                   for module in ("slice_width", "phantom_width", "resolution", "mtf")
+                   if isinstance(record.get(module), dict)}
+        if isinstance(record.get("slice_width_slices"), dict):
+            outputs["slice_width_slices"] = record["slice_width_slices"]
+
+        return self.add_run(outputs,
+                            tags,
+                            record.get("context"),
+                            record.get("rois"),
+                            source=source,
+                            error=record.get("error"))
+
+    @staticmethod
+    def _run_filters(station: str | None,
+                     start: str | date | None,
+                     end: str | date | None) -> tuple[list[str], list[str]]:
+        clauses: list[str] = []
+        params: list[str] = []
+        if station is not None:
+            clauses.append("runs.station_name = ?")
+            params.append(station)
+        start = date_key(start)
+        if start is not None:
+            clauses.append("runs.study_date >= ?")
+            params.append(start)
+        end = date_key(end)
+        if end is not None:
+            clauses.append("runs.study_date <= ?")
+            params.append(end)
+        return clauses, params
+
+    def trend(self,
+              module: str,
+              name: str,
+              station: str | None = None,
+              start: str | date | None = None,
+              end: str | date | None = None) -> list[dict]:
+        """
+        Returns the values of an output over time,
+        optionally for one scanner (station name) and a study date range (inclusive).
+
+        Returns
+        -------
+        list[dict]
+            Dicts of "run_id", "study_date", "station_name", "coil", "protocol", "value" and "text",
+            ordered by study date.
+        """
+        clauses, params = self._run_filters(station, start, end)
+        query = ("SELECT runs.id AS run_id, runs.study_date, runs.station_name, runs.coil, "
+                 "runs.protocol, outputs.value, outputs.text "
+                 "FROM runs JOIN outputs ON outputs.run_id = runs.id "
+                 "WHERE outputs.module = ? AND outputs.name = ?"
+                 + "".join(" AND " + clause for clause in clauses)
+                 + " ORDER BY runs.study_date, runs.id")
+        rows = self.connection.execute(query, [module, name, *params])
+        return [dict(row) for row in rows]
+
+    def runs(self,
+             station: str | None = None,
+             start: str | date | None = None,
+             end: str | date | None = None) -> list[dict]:
+        """
+        Returns the runs, optionally for one scanner and a study date range (inclusive),
+        ordered by study date, with the context, ROIs and tags decoded from JSON.
+        """
+        clauses, params = self._run_filters(station, start, end)
+        query = ("SELECT * FROM runs"
+                 + (" WHERE " + " AND ".join(clauses) if clauses else "")
+                 + " ORDER BY runs.study_date, runs.id")
+        runs: list[dict] = []
+        for row in self.connection.execute(query, params):
+            run = dict(row)
+            for column in ("tags", "context", "rois"):
+                if run[column] is not None:
+                    run[column] = json.loads(run[column])
+            runs.append(run)
+        return runs
+
+    def run_outputs(self, run_id: int) -> dict[str, dict[str, float | str | None]]:
+        """
+        Returns the outputs of a run keyed by module then name,
+        the value of numeric outputs and the text of others.
+        """
+        outputs: dict[str, dict[str, float | str | None]] = {}
+        rows = self.connection.execute(
+            "SELECT module, name, value, text FROM outputs WHERE run_id = ?", (run_id,))
+        for row in rows:
+            outputs.setdefault(row["module"], {})[row["name"]] = (
+                row["value"] if row["text"] is None else row["text"])
+        return outputs
+
+    def stations(self) -> list[str]:
+        """
+        Returns the station names of all stored runs.
+        """
+        rows = self.connection.execute(
+            "SELECT DISTINCT station_name FROM runs ORDER BY station_name")
+        return [row[0] for row in rows]
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Prints the trend of an output as tab separated study date, station, coil and value rows.
+    """
+    import argparse  # pylint: disable=import-outside-toplevel
+    parser = argparse.ArgumentParser(description="Query the TO2A results database.")
+    parser.add_argument("module", help="module of the output, e.g. slice_width")
+    parser.add_argument("name", help="name of the output, e.g. slice_width")
+    parser.add_argument("--station", default=None, help="only runs from this station name")
+    parser.add_argument("--start", default=None, help="first study date, YYYYMMDD")
+    parser.add_argument("--end", default=None, help="last study date, YYYYMMDD")
+    parser.add_argument("--db", type=Path, default=default_store_path(),
+                        help="results database (default: user data folder)")
+    args = parser.parse_args(argv)
+
+    if not args.db.exists():
+        print(f"No results database at {args.db}", file=sys.stderr)
+        return 1
+    with ResultsStore(args.db) as store:
+        for row in store.trend(args.module, args.name, args.station, args.start, args.end):
+            value = row["text"] if row["value"] is None else f"{row['value']:g}"
+            print(f"{row['study_date']}\t{row['station_name']}\t{row['coil']}\t{value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Results derived from a single ROI, kept until the ROI or the settings they use change.
+
+Each result is stored under the ROI name with a signature of the image, the ROI position
+and the settings it was calculated with.
+When a module is analysed again only the results whose signature has changed are recomputed,
+so moving one ROI only recomputes the profile and outputs of that ROI.
+"""
+from collections.abc import Callable, Hashable
+from typing import TypeVar
+
+from pumpia.image_handling.roi_structures import BaseROI, RectangleROI, LineROI
+
+from pumpia_to2a.pixel_buffer import image_key
+
+ResultT = TypeVar("ResultT")
+
+
+def roi_signature(roi: BaseROI) -> tuple:
+    """
+    Returns a hashable signature of the image, slice and position of an ROI,
+    which changes when the ROI is moved or resized.
+    """
+    image = roi.image
+    try:
+        key: Hashable = image_key(image)  # type: ignore
+    except AttributeError:
+        key = id(image)
+    if isinstance(roi, RectangleROI):
+        position: tuple = (roi.xmin, roi.xmax, roi.ymin, roi.ymax)
+    elif isinstance(roi, LineROI):
+        position = (roi.x1, roi.y1, roi.x2, roi.y2)
+    else:
+        position = (roi.id_string,)
+    return (key, roi.slice_num, type(roi).__name__, *position)
+
+
+class RoiResults:
+    """
+    The latest result for each ROI name with the signature it was calculated with.
+
+    Methods
+    -------
+    get(name: str, signature: Hashable, compute: Callable[[], ResultT]) -> ResultT
+    is_current(name: str, signature: Hashable) -> bool
+    result(name: str) -> object
+    put(name: str, signature: Hashable, result: object)
+    """
+
+    def __init__(self):
+        self._results: dict[str, tuple[Hashable, object]] = {}
+
+    def get(self, name: str, signature: Hashable, compute: Callable[[], ResultT]) -> ResultT:
+        """
+        Returns the result stored for `name` if it was calculated with `signature`,
+        otherwise calls `compute` and stores its result.
+        """
+        if self.is_current(name, signature):
+            return self._results[name][1]  # type: ignore
+        result = compute()
+        self.put(name, signature, result)
+        return result
+
+    def is_current(self, name: str, signature: Hashable) -> bool:
+        """
+        Returns whether the result stored for `name` was calculated with `signature`.
+        """
+        stored = self._results.get(name)
+        return stored is not None and stored[0] == signature
+
+    def result(self, name: str) -> object:
+        """
+        Returns the result stored for `name`, check it is current with `is_current` first.
+        """
+        return self._results[name][1]
+
+    def put(self, name: str, signature: Hashable, result: object) -> None:
+        """
+        Stores a result for `name` calculated with `signature`,
+        for results calculated together for several ROIs.
+        """
+        self._results[name] = (signature, result)
@@ -0,0 +1,101 @@
+"""
+Numpy arrays in shared memory for passing images to worker processes without copying.
+
+The process holding an image copies it once into a shared memory block with `share_array`
+and sends the small, picklable `SharedArray` to the worker,
+which attaches to the block with `attach_array` and uses the pixels in place.
+The creating process unlinks the block with `release` once the worker has finished.
+No tkinter is imported.
+"""
+import sys
+from contextlib import contextmanager
+from collections.abc import Iterator
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class SharedArray:
+    """
+    Describes an array in a shared memory block, sent to worker processes in place of the array.
+
+    Attributes
+    ----------
+    name : str
+        The name of the shared memory block.
+    shape : tuple[int, ...]
+    dtype : str
+    """
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The size of the array in bytes.
+        """
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+
+def share_array(array: np.ndarray) -> tuple[shared_memory.SharedMemory, SharedArray]:
+    """
+    Copies `array` into a new shared memory block.
+
+    Returns
+    -------
+    tuple[shared_memory.SharedMemory, SharedArray]
+        The block, which must be passed to `release` once no longer used,
+        and its description to send to workers.
+    """
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    shared[...] = array
+    del shared
+    return block, SharedArray(block.name, array.shape, array.dtype.str)
+
+
+def release(block: shared_memory.SharedMemory) -> None:
+    """
+    Closes and removes a block created by `share_array`.
+    """
+    block.close()
+    try:
+        block.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _open_block(name: str) -> shared_memory.SharedMemory:
+    """
+    Opens an existing block.
+    Worker processes share the resource tracker of the process that started them,
+    so the block is only removed by `release` or when all of them have exited.
+    """
+    if sys.version_info >= (3, 13):
+        # pylint: disable-next=unexpected-keyword-arg
+        return shared_memory.SharedMemory(name=name, track=False)  # type: ignore
+    return shared_memory.SharedMemory(name=name)
+
+
+@contextmanager
+def attach_array(shared: SharedArray) -> Iterator[np.ndarray]:
+    """
+    Yields a read only view of a shared array without copying it.
+    The view must not be used after the block is closed on leaving the context.
+    """
+    block = _open_block(shared.name)
+    array = np.ndarray(shared.shape, dtype=np.dtype(shared.dtype), buffer=block.buf)
+    array.flags.writeable = False
+    try:
+        yield array
+    finally:
+        del array
+        try:
+            block.close()
+        except BufferError:
+            # views kept by the caller, the block is closed when they are freed
+            pass
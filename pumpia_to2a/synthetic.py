@@ -0,0 +1,250 @@
+"""
+Synthetic TO2A Phantom images for benchmarking and checking the analysis without scanner data.
+
+The phantom is drawn in mm in the phantom frame used by `kernels.rotation.TEMPLATE_REGIONS`,
+where x points away from the MTF block and y towards the wedges,
+so any matrix size, pixel spacing, orientation and rotation can be made.
+No tkinter is imported.
+"""
+import math
+
+import numpy as np
+from scipy import ndimage
+
+from pumpia.utilities.typing import SideType
+
+from pumpia_to2a.kernels.rotation import SIDE_VECTORS
+
+# distances in mm
+FIELD_OF_VIEW = 250
+BODY_RADIUS = 95
+
+# (xmin, xmax, ymin, ymax) in mm in the phantom frame
+MTF_BLOCK = (-80, -45, -15, 15)
+WEDGES_BLOCK = (-45, 45, 38, 78)
+INSIDE_WEDGE = (-40, 40, 40, 54)
+OUTSIDE_WEDGE = (-40, 40, 61, 75)
+
+# (bar width, insert length, offset) in mm for the resolution inserts
+HORIZONTAL_INSERTS = ((2, 24, 20), (1.5, 20, 41), (1, 16, 61))
+VERTICAL_INSERTS = ((2, 24, 31), (1.5, 20, 51), (1, 16, 71))
+INSERT_WIDTH = 11
+INSERT_HORIZONTAL_OFFSET = 43
+INSERT_VERTICAL_OFFSET = 10
+NUM_BARS = 6
+# block around each insert, so the ends of the ROIs of `kernels.resolution.insert_rois`
+# are in the block rather than the body after rounding to pixels or rotating
+INSERT_MARGIN = 2
+
+# signal of each material relative to the body
+BLOCK_SIGNAL = 0.1
+MTF_SIGNAL = 0.05
+
+# points sampled along each side of a pixel
+SUPERSAMPLE = 4
+# rows of pixels drawn at once, limiting the memory used when supersampling large matrices
+CHUNK_ROWS = 64
+
+
+def _in_box(x: np.ndarray, y: np.ndarray, box: tuple[float, float, float, float]) -> np.ndarray:
+    xmin, xmax, ymin, ymax = box
+    return (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+
+
+def _bars(position: np.ndarray, start: float, bar_width: float) -> np.ndarray:
+    """
+    Returns where `position` is in one of `NUM_BARS` bars of `bar_width`,
+    separated by gaps of the same width, starting at `start`.
+    """
+    relative = position - start
+    in_pattern = (relative >= 0) & (relative < (2 * NUM_BARS - 1) * bar_width)
+    return in_pattern & (np.floor(relative / bar_width) % 2 == 0)
+
+
+def _draw_regions(image_x: np.ndarray,
+                  image_y: np.ndarray,
+                  x_dir: np.ndarray,
+                  y_dir: np.ndarray,
+                  slice_thickness: float,
+                  tan_theta: float) -> np.ndarray:
+    """
+    Returns the phantom, relative to the body signal, at the image coordinates in mm
+    given by the row `image_x` and column `image_y`,
+    with the phantom x and y axes along `x_dir` and `y_dir`.
+    """
+    phantom_x = image_x * x_dir[0] + image_y * x_dir[1]
+    phantom_y = image_x * y_dir[0] + image_y * y_dir[1]
+
+    body = image_x**2 + image_y**2 <= BODY_RADIUS**2
+    image = body.astype(float)
+
+    image[_in_box(phantom_x, phantom_y, MTF_BLOCK)] = MTF_SIGNAL
+    image[_in_box(phantom_x, phantom_y, WEDGES_BLOCK)] = BLOCK_SIGNAL
+
+    # the wedges ramp in opposite directions so the profile edges are offset by the slice
+    ramp = np.clip(phantom_x * tan_theta / slice_thickness + 0.5, 0, 1)
+    inside = _in_box(phantom_x, phantom_y, INSIDE_WEDGE)
+    image[inside] = BLOCK_SIGNAL + (1 - BLOCK_SIGNAL) * ramp[inside]
+    ramp = 1 - ramp
+    outside = _in_box(phantom_x, phantom_y, OUTSIDE_WEDGE)
+    image[outside] = BLOCK_SIGNAL + (1 - BLOCK_SIGNAL) * ramp[outside]
+
+    # the bars run across the whole block so every row of the ROIs sees all of them
+    for bar_width, length, offset in HORIZONTAL_INSERTS:
+        region = _in_box(phantom_x,
+                         phantom_y,
+                         (INSERT_HORIZONTAL_OFFSET - INSERT_MARGIN,
+                          INSERT_HORIZONTAL_OFFSET + length + INSERT_MARGIN,
+                          -offset - INSERT_MARGIN,
+                          INSERT_WIDTH - offset + INSERT_MARGIN))
+        image[region] = BLOCK_SIGNAL
+        start = INSERT_HORIZONTAL_OFFSET + (length - (2 * NUM_BARS - 1) * bar_width) / 2
+        image[region & _bars(phantom_x, start, bar_width)] = 1
+
+    for bar_width, length, offset in VERTICAL_INSERTS:
+        region = _in_box(phantom_x,
+                         phantom_y,
+                         (offset - INSERT_MARGIN,
+                          offset + INSERT_WIDTH + INSERT_MARGIN,
+                          INSERT_VERTICAL_OFFSET - INSERT_MARGIN,
+                          INSERT_VERTICAL_OFFSET + length + INSERT_MARGIN))
+        image[region] = BLOCK_SIGNAL
+        start = INSERT_VERTICAL_OFFSET + (length - (2 * NUM_BARS - 1) * bar_width) / 2
+        image[region & _bars(phantom_y, start, bar_width)] = 1
+
+    image[~body] = 0
+    return image
+
+
+def phantom_image(matrix: int = 256,
+                  pixel_spacing: float | None = None,
+                  slice_thickness: float = 5,
+                  rotation: float = 0,
+                  wedges_side: SideType = "bottom",
+                  mtf_side: SideType = "left",
+                  flip_horizontal: bool = False,
+                  flip_vertical: bool = False,
+                  noise: float = 0,
+                  blur: float = 0.5,
+                  signal: float = 1000,
+                  tan_theta: float = 0.25,
+                  centre_offset: tuple[float, float] = (0, 0),
+                  seed: int | None = None,
+                  supersample: int = SUPERSAMPLE
+                  ) -> tuple[np.ndarray, tuple[float, float, float]]:
+    """
+    Draws a synthetic TO2A phantom image.
+
+    Parameters
+    ----------
+    matrix : int, optional
+        The number of rows and columns (default is 256).
+    pixel_spacing : float or None, optional
+        The pixel size in mm, if None the field of view is 250 mm (default is None).
+    slice_thickness : float, optional
+        The slice thickness in mm shown by the wedges (default is 5).
+    rotation : float, optional
+        The in plane rotation of the phantom in degrees,
+        using the convention of `kernels.rotation` (default is 0).
+    wedges_side : SideType, optional
+        The side of the wedges before rotation (default is "bottom").
+    mtf_side : SideType, optional
+        The side of the MTF block before rotation, must be on the other axis to `wedges_side`
+        (default is "left").
+    flip_horizontal : bool, optional
+        Whether to mirror the image left to right (default is False).
+    flip_vertical : bool, optional
+        Whether to mirror the image top to bottom (default is False).
+    noise : float, optional
+        The standard deviation of gaussian noise added (default is 0).
+    blur : float, optional
+        The standard deviation in mm of the gaussian blur applied before the noise (default is 0.5).
+    signal : float, optional
+        The signal of the body of the phantom (default is 1000).
+    tan_theta : float, optional
+        The tangent of the wedge angle (default is 0.25).
+    centre_offset : tuple[float, float], optional
+        The (x, y) offset of the phantom centre from the image centre in mm (default is (0, 0)).
+    seed : int or None, optional
+        The seed for the noise (default is None).
+    supersample : int, optional
+        Each pixel is the mean of `supersample` by `supersample` points,
+        so edges at an angle to the pixel grid are partial volumed rather than stepped,
+        1 samples only the pixel centres (default is `SUPERSAMPLE`).
+
+    Returns
+    -------
+    tuple[np.ndarray, tuple[float, float, float]]
+        (2D image array, pixel size as (slice_thickness, row_spacing, column_spacing))
+    """
+    if pixel_spacing is None:
+        pixel_spacing = FIELD_OF_VIEW / matrix
+    supersample = max(1, supersample)
+
+    theta = math.radians(rotation)
+    cos = math.cos(theta)
+    sin = math.sin(theta)
+    x_dir = -np.array(SIDE_VECTORS[mtf_side], dtype=float)
+    y_dir = np.array(SIDE_VECTORS[wedges_side], dtype=float)
+    x_dir = np.array([x_dir[0] * cos - x_dir[1] * sin, x_dir[0] * sin + x_dir[1] * cos])
+    y_dir = np.array([y_dir[0] * cos - y_dir[1] * sin, y_dir[0] * sin + y_dir[1] * cos])
+
+    # the centres of `supersample` by `supersample` sub-pixels in each pixel
+    offsets = (np.arange(supersample) + 0.5) / supersample - 0.5
+    pixel_coords = (np.arange(matrix) - (matrix - 1) / 2) * pixel_spacing
+    coords = (pixel_coords[:, np.newaxis] + offsets * pixel_spacing).ravel()
+
+    # only pixels that can overlap the body are drawn, the rest are 0
+    reach = BODY_RADIUS + pixel_spacing
+    columns = np.flatnonzero(np.abs(pixel_coords - centre_offset[0]) <= reach)
+    rows = np.flatnonzero(np.abs(pixel_coords - centre_offset[1]) <= reach)
+
+    image = np.zeros((matrix, matrix))
+    if columns.size > 0 and rows.size > 0:
+        col_first, col_last = columns[0], columns[-1] + 1
+        image_x = coords[np.newaxis, col_first * supersample:col_last * supersample]
+        image_x = image_x - centre_offset[0]
+        for first in range(rows[0], rows[-1] + 1, CHUNK_ROWS):
+            last = min(rows[-1] + 1, first + CHUNK_ROWS)
+            image_y = coords[first * supersample:last * supersample, np.newaxis]
+            image_y = image_y - centre_offset[1]
+            regions = _draw_regions(image_x, image_y, x_dir, y_dir, slice_thickness, tan_theta)
+            image[first:last, col_first:col_last] = regions.reshape(last - first,
+                                                                    supersample,
+                                                                    col_last - col_first,
+                                                                    supersample).mean(axis=(1, 3))
+
+    if blur > 0:
+        image = ndimage.gaussian_filter(image, blur / pixel_spacing)
+    image = image * signal
+    if noise > 0:
+        image = image + np.random.default_rng(seed).normal(0, noise, image.shape)
+
+    if flip_horizontal:
+        image = image[:, ::-1]
+    if flip_vertical:
+        image = image[::-1, :]
+
+    return np.ascontiguousarray(image), (float(slice_thickness), pixel_spacing, pixel_spacing)
+
+
+def phantom_stack(num_slices: int,
+                  matrix: int = 256,
+                  seed: int | None = None,
+                  **kwargs) -> tuple[np.ndarray, tuple[float, float, float]]:
+    """
+    Draws `num_slices` synthetic images with independent noise,
+    other keyword arguments are passed to `phantom_image`.
+
+    Returns
+    -------
+    tuple[np.ndarray, tuple[float, float, float]]
+        (3D image array (slices, rows, columns), pixel size)
+    """
+    noise = kwargs.pop("noise", 0)
+    noiseless, pixel_size = phantom_image(matrix, **kwargs)
+    stack = np.repeat(noiseless[np.newaxis], num_slices, axis=0)
+    if noise > 0:
+        for image, slice_seed in zip(stack, np.random.SeedSequence(seed).spawn(num_slices)):
+            image += np.random.default_rng(slice_seed).normal(0, noise, noiseless.shape)
+    return stack, pixel_size
@@ -0,0 +1,133 @@
+"""
+Output frame showing the timings recorded by `instrumentation.profiler`.
+"""
+import queue
+import tkinter as tk
+from tkinter import ttk, filedialog
+from pathlib import Path
+
+from pumpia.module_handling.module_collections import OutputFrame
+
+from pumpia_to2a.instrumentation import profiler, RunRecord
+
+# milliseconds between checks for new records
+POLL_INTERVAL = 200
+
+
+class TimingsFrame(OutputFrame):
+    """
+    Output frame showing the stages of the last run recorded by the profiler,
+    with options to turn recording on and set the JSON lines log file.
+    The copy buttons copy the stages as "name, milliseconds, peak KiB" rows.
+    Runs recorded on a worker thread are queued and shown from the main thread.
+    """
+
+    def setup(self, *, parent: tk.Misc | None = None, verbose_name: str | None = None):
+        if self.is_setup:
+            return
+        super().setup(parent=parent, verbose_name=verbose_name)
+
+        self._rows: list[tuple[str, float, float | None]] = []
+
+        self.record_var = tk.BooleanVar(self, value=profiler.enabled)
+        self.memory_var = tk.BooleanVar(self, value=profiler.memory)
+        self.log_var = tk.StringVar(self, value=str(profiler.log_path or ""))
+
+        self.record_check = ttk.Checkbutton(self.output_frame,
+                                            text="Record Timings",
+                                            variable=self.record_var,
+                                            command=self._on_options_change)
+        self.record_check.grid(column=0, row=0, sticky="nsw")
+        self.memory_check = ttk.Checkbutton(self.output_frame,
+                                            text="Record Memory",
+                                            variable=self.memory_var,
+                                            command=self._on_options_change)
+        self.memory_check.grid(column=1, row=0, sticky="nsw")
+
+        self.tree = ttk.Treeview(self.output_frame,
+                                 columns=("time", "memory"),
+                                 height=12)
+        self.tree.heading("#0", text="Stage")
+        self.tree.heading("time", text="Time (ms)")
+        self.tree.heading("memory", text="Peak (KiB)")
+        self.tree.column("time", width=80, anchor="e")
+        self.tree.column("memory", width=80, anchor="e")
+        self.tree.grid(column=0, row=1, columnspan=2, sticky="nsew")
+
+        self.log_button = ttk.Button(self.output_frame,
+                                     text="Set Timings Log",
+                                     command=self.set_log_path)
+        self.log_button.grid(column=0, row=2, sticky="nsew")
+        self.log_label = ttk.Label(self.output_frame, textvariable=self.log_var)
+        self.log_label.grid(column=1, row=2, sticky="nsw")
+
+        self.output_frame.columnconfigure(1, weight=1)
+        self.output_frame.rowconfigure(1, weight=1)
+
+        self._records: queue.SimpleQueue[RunRecord] = queue.SimpleQueue()
+        profiler.add_listener(self._records.put)
+        if profiler.records:
+            self.show_record(profiler.records[-1])
+        self.after(POLL_INTERVAL, self._show_queued)
+
+    def _show_queued(self) -> None:
+        """
+        Shows the latest queued record, checking again after `POLL_INTERVAL`.
+        """
+        try:
+            if not self.winfo_exists():
+                raise tk.TclError
+        except tk.TclError:
+            profiler.remove_listener(self._records.put)
+            return
+
+        record = None
+        while not self._records.empty():
+            record = self._records.get()
+        if record is not None:
+            self.show_record(record)
+        self.after(POLL_INTERVAL, self._show_queued)
+
+    def _on_options_change(self) -> None:
+        profiler.enabled = self.record_var.get()
+        profiler.memory = self.memory_var.get()
+
+    def set_log_path(self) -> None:
+        """
+        Asks for the JSON lines file each run is appended to,
+        cancelling stops writing to a file.
+        """
+        path = filedialog.asksaveasfilename(parent=self,
+                                            title="Timings Log",
+                                            defaultextension=".jsonl",
+                                            filetypes=[("JSON lines", "*.jsonl")])
+        if path:
+            profiler.log_path = Path(path)
+            self.log_var.set(path)
+        else:
+            profiler.log_path = None
+            self.log_var.set("")
+
+    def show_record(self, record: RunRecord) -> None:
+        """
+        Shows the spans of a run record, nested spans are shown under the span they are in.
+        """
+        self.tree.delete(*self.tree.get_children())
+        self._rows = []
+        parents: list[str] = [""]
+        for span in record.spans:
+            del parents[span.depth + 1:]
+            memory = None if span.peak_bytes is None else span.peak_bytes / 1024
+            item = self.tree.insert(parents[-1],
+                                    "end",
+                                    text=span.name,
+                                    values=(f"{span.duration * 1000:.2f}",
+                                            "" if memory is None else f"{memory:.0f}"),
+                                    open=True)
+            parents.append(item)
+            self._rows.append((span.name, span.duration * 1000, memory))
+
+    @property
+    def var_strings(self) -> list[str]:
+        return [f"{name}, {time:.2f}, {'' if memory is None else f'{memory:.0f}'}"
+                for name, time, memory in self._rows]
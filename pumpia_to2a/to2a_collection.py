@@ -2,33 +2,89 @@
 Collection for TO2A phantom.
 """
 
+import sys
+import sqlite3
+import warnings
+import traceback
+import tkinter as tk
+from pathlib import Path
+from functools import partial
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
 from pumpia.module_handling.module_collections import (OutputFrame,
                                                        BaseCollection)
+from pumpia.module_handling.modules import BaseModule
+from pumpia.module_handling.manager import Manager
 from pumpia.module_handling.in_outs.viewer_ios import MonochromeDicomViewerIO
+from pumpia.module_handling.in_outs.simple import BaseOutput
+from pumpia.image_handling.roi_structures import BaseROI, RectangleROI, LineROI
 from pumpia.widgets.viewers import BaseViewer
-from pumpia.file_handling.dicom_structures import Series
+from pumpia.file_handling.dicom_structures import Series, Instance
 
-from pumpia_to2a.to2a_context import TO2AContextManagerGenerator
+from pumpia_to2a.to2a_context import TO2AContextManagerGenerator, TO2AContextManager
+from pumpia_to2a.kernels.context import TO2AContext
+from pumpia_to2a.context_cache import context_to_record
+from pumpia_to2a.results_store import ResultsStore, default_store_path, dicom_tags
+from pumpia_to2a.instrumentation import profiler, timed
+from pumpia_to2a.background import (BackgroundRunner,
+                                    BackgroundTask,
+                                    Cancelled,
+                                    ApplyFunction,
+                                    JobFunction,
+                                    run_jobs)
+from pumpia_to2a.timings_frame import TimingsFrame
+from pumpia_to2a.progress_frame import ProgressFrame
 from pumpia_to2a.modules.slice_width import TO2ASliceWidth
 from pumpia_to2a.modules.phantom_width import TO2APhantomWidth
 from pumpia_to2a.modules.resolution import TO2AResolution
+from pumpia_to2a.modules.mtf import TO2AMTF
 
 
 class TO2ACollection(BaseCollection):
     """
     Collection for TO2A phantom.
+
+    When `lazy_loading` is True an image loaded into the main viewer is only loaded
+    into a module's viewer when its tab is shown or ROIs are drawn or analysed from the collection.
+
+    Each analysis run from the collection is added to the results database at `results_path`,
+    see `results_store`, results are not stored if it is None.
+
+    When `background` is True the context is found and the modules analysed on a worker thread,
+    see `background`, so the interface stays responsive, with the progress shown in `progress`.
+    The results are shown when the analysis finishes, it can be cancelled between stages.
+
+    When `parallel_modules` is True the modules are analysed together on a thread pool,
+    only setting their outputs is done one module at a time on the main thread.
     """
     context_manager_generator = TO2AContextManagerGenerator()
     name = "TO2A Collection"
+    lazy_loading: bool = True
+    background: bool = True
+    parallel_modules: bool = True
+    results_path: Path | None = default_store_path()
 
     viewer = MonochromeDicomViewerIO(row=0, column=0)
 
     slice_width = TO2ASliceWidth()
     phantom_width = TO2APhantomWidth()
     resolution = TO2AResolution()
+    mtf = TO2AMTF()
 
     summary = OutputFrame()
     results = OutputFrame()
+    timings = TimingsFrame()
+    progress = ProgressFrame()
+
+    def __init__(self, parent: tk.Misc, manager: Manager, **kwargs):
+        self._pending_image: Instance | None = None
+        self._pending_modules: list[BaseModule] = []
+        self._runner = BackgroundRunner()
+        self._module_pool = ThreadPoolExecutor(max_workers=4,
+                                               thread_name_prefix="pumpia_to2a_module")
+        super().__init__(parent, manager, **kwargs)
+        self.bind("<Destroy>", self._on_destroy, add=True)
 
     def load_outputs(self):
         self.summary.register_output(self.slice_width.slice_width)
@@ -40,6 +96,8 @@ class TO2ACollection(BaseCollection):
         self.summary.register_output(self.resolution.freq_2)
         self.summary.register_output(self.resolution.freq_1_5)
         self.summary.register_output(self.resolution.freq_1)
+        self.summary.register_output(self.mtf.phase_mtf50)
+        self.summary.register_output(self.mtf.freq_mtf50)
 
         self.results.register_output(self.slice_width.expected_width)
         self.results.register_output(self.slice_width.inside_wedge_width)
@@ -61,14 +119,314 @@ class TO2ACollection(BaseCollection):
         self.results.register_output(self.resolution.freq_2)
         self.results.register_output(self.resolution.freq_1_5)
         self.results.register_output(self.resolution.freq_1)
+        self.results.register_output(self.mtf.phase_mtf50)
+        self.results.register_output(self.mtf.phase_mtf10)
+        self.results.register_output(self.mtf.phase_edge_angle)
+        self.results.register_output(self.mtf.phase_edge_status)
+        self.results.register_output(self.mtf.freq_mtf50)
+        self.results.register_output(self.mtf.freq_mtf10)
+        self.results.register_output(self.mtf.freq_edge_angle)
+        self.results.register_output(self.mtf.freq_edge_status)
+
+    @timed("collection.create_rois")
+    def create_rois(self) -> None:
+        self.load_pending_images()
+        if not self._create_rois_background(None):
+            super().create_rois()
+
+    @timed("collection.run_analysis")
+    def run_analysis(self) -> None:
+        self.load_pending_images()
+        if self.background:
+            jobs = self._analysis_jobs()
+            self._submit("Analysing", partial(self._run_jobs, jobs), self._apply_analysis)
+        elif self.parallel_modules:
+            self._apply_analysis(self._run_jobs(self._analysis_jobs(), None))
+        else:
+            super().run_analysis()
+            self.store_results()
+
+    @property
+    def named_modules(self) -> dict[str, BaseModule]:
+        """
+        The modules keyed by the names used in the results and timings.
+        """
+        return {"slice_width": self.slice_width,
+                "phantom_width": self.phantom_width,
+                "resolution": self.resolution,
+                "mtf": self.mtf}
+
+    @timed("collection.create_and_run")
+    def create_and_run(self) -> None:
+        self.load_pending_images()
+        if not self._create_rois_background(self.run_analysis):
+            super().create_and_run()
+
+    def _create_rois_background(self, on_drawn: Callable[[], None] | None) -> bool:
+        """
+        Finds the context on the worker thread then draws the ROIs, followed by calling `on_drawn`.
+        Returns False, doing nothing, if the context can not be found in the background.
+        """
+        if (not self.background
+            or self.main_viewer is None
+            or self.main_viewer.image is None
+                or not isinstance(self.context_manager, TO2AContextManager)):
+            return False
+        job = self.context_manager.context_job(self.main_viewer.image)
+        if job is None:
+            return False
+
+        def find_context(task: BackgroundTask) -> ApplyFunction:
+            task.report(0, "Finding context")
+            return job()
+
+        def draw_rois(apply: ApplyFunction) -> None:
+            apply()
+            BaseCollection.create_rois(self)
+            if on_drawn is not None:
+                on_drawn()
+
+        self._submit("Drawing ROIs", find_context, draw_rois)
+        return True
+
+    def _analysis_jobs(self) -> list[tuple[BaseModule, JobFunction]]:
+        """
+        Resets the outputs and prepares the analysis job of each module with its ROIs drawn,
+        modules without `analysis_job` are analysed straight away.
+        """
+        names = {module: name for name, module in self.named_modules.items()}
+        jobs: list[tuple[BaseModule, JobFunction]] = []
+        for module in self.modules:
+            if not hasattr(module, "analysis_job"):
+                try:
+                    module.run_analysis(batch=True)
+                # pylint: disable-next=broad-exception-caught
+                except Exception as exc:
+                    self._warn_module(module, exc, "on analysis")
+                continue
+            if not module.rois_loaded:
+                continue
+            for output in module.outputs:
+                if output.reset_on_analysis:
+                    output.reset_value()
+            try:
+                job = module.analysis_job()
+            # pylint: disable-next=broad-exception-caught
+            except Exception as exc:
+                self._warn_module(module, exc, "on analysis")
+                continue
+            if job is not None:
+                span_name = f"{names.get(module, module.name)}.analyse"
+                jobs.append((module, partial(_timed_job, span_name, job)))
+        return jobs
+
+    def _run_jobs(self,
+                  jobs: list[tuple[BaseModule, JobFunction]],
+                  task: BackgroundTask | None
+                  ) -> list[tuple[BaseModule, ApplyFunction | Exception]]:
+        """
+        Runs the analysis jobs, together if `parallel_modules` is True,
+        returning the function applying the results of each module or the error it raised.
+        """
+        executor = self._module_pool if self.parallel_modules else None
+        with profiler.span("collection.analyse_modules"):
+            results = run_jobs([(str(module.verbose_name), job) for module, job in jobs],
+                               task,
+                               executor)
+        if task is not None:
+            task.report(1, "Showing results")
+        return [(module, result) for (module, _), result in zip(jobs, results)]
+
+    def _apply_analysis(self, results: list[tuple[BaseModule, ApplyFunction | Exception]]) -> None:
+        """
+        Sets the outputs of each module from the results of `_run_jobs` and stores the results.
+        """
+        for module, apply in results:
+            if isinstance(apply, Exception):
+                self._warn_module(module, apply, "on analysis", print_traceback=False)
+                continue
+            try:
+                apply()
+            # pylint: disable-next=broad-exception-caught
+            except Exception as exc:
+                self._warn_module(module, exc, "on analysis")
+                continue
+            module.analysed = True
+        self.store_results()
+
+    def _submit(self,
+                name: str,
+                work: Callable[[BackgroundTask], object],
+                on_result: Callable) -> None:
+        """
+        Runs `work` on the worker thread, cancelling any task already running,
+        and calls `on_result` with its result on the main thread when it finishes.
+        """
+        task = self._runner.submit(name, work)
+        self.progress.track(task, partial(self._finish_task, on_result=on_result))
+
+    def _finish_task(self, task: BackgroundTask, on_result: Callable) -> None:
+        """
+        Calls `on_result` with the result of a finished task,
+        warning if it raised an error and doing nothing if it was cancelled.
+        """
+        exception = task.future.exception()
+        if isinstance(exception, Cancelled):
+            return
+        if exception is not None:
+            warning = UserWarning(f"{task.name} had an error: {exception}")
+            warning.with_traceback(exception.__traceback__)
+            traceback.print_exception(exception)
+            warnings.warn(warning, stacklevel=2)
+            return
+        on_result(task.future.result())
+
+    @staticmethod
+    def _warn_module(module: BaseModule,
+                     exc: Exception,
+                     action: str,
+                     print_traceback: bool = True) -> None:
+        """
+        Warns that a module had an error, as `BaseCollection` does.
+        """
+        filters = warnings.filters
+        warnings.simplefilter("always")
+        warning = UserWarning(f"{module.verbose_name} module had an error {action}.")
+        warning.with_traceback(exc.__traceback__)
+        if print_traceback:
+            traceback.print_exception(exc)
+        warnings.warn(warning, stacklevel=2)
+        warnings.filters = filters
 
+    def _on_destroy(self, event: tk.Event) -> None:
+        if event.widget is self:
+            self._runner.shutdown()
+            self._module_pool.shutdown(wait=False, cancel_futures=True)
+
+    @timed("on_image_load")
     def on_image_load(self, viewer: BaseViewer) -> None:
         if viewer is self.viewer:
+            # results of the previous image are no longer wanted
+            self._runner.cancel()
             if self.viewer.image is not None:
                 image = self.viewer.image
                 if isinstance(image, Series):
                     slice_index = image.num_slices // 2
                     image = image.instances[slice_index]
-                self.slice_width.viewer.load_image(image)
-                self.phantom_width.viewer.load_image(image)
-                self.resolution.viewer.load_image(image)
+                if self.lazy_loading:
+                    self._pending_image = image
+                    self._pending_modules = [self.slice_width,
+                                             self.phantom_width,
+                                             self.resolution,
+                                             self.mtf]
+                    self._load_selected_module()
+                else:
+                    self.slice_width.viewer.load_image(image)
+                    self.phantom_width.viewer.load_image(image)
+                    self.resolution.viewer.load_image(image)
+                    self.mtf.viewer.load_image(image)
+
+    def store_results(self) -> int | None:
+        """
+        Adds the outputs, ROI coordinates, context and DICOM tags of the current analysis
+        to the results database.
+
+        Returns
+        -------
+        int or None
+            The id of the stored run, None if the results were not stored.
+        """
+        if self.results_path is None:
+            return None
+
+        modules = self.named_modules
+        if not any(module.analysed for module in modules.values()):
+            return None
+
+        outputs: dict[str, dict[str, object]] = {}
+        rois: dict[str, dict | None] = {}
+        for module_name, module in modules.items():
+            outputs[module_name] = {}
+            for name, attr in vars(module).items():
+                if isinstance(attr, BaseOutput):
+                    try:
+                        outputs[module_name][name] = attr.value
+                    except ValueError:
+                        outputs[module_name][name] = None
+            for roi_input in module.rois:
+                rois[f"{module_name}.{roi_input.name}"] = roi_record(roi_input.roi)
+
+        image = self.slice_width.viewer.image
+        tags = dicom_tags(image.dicom_dataset if isinstance(image, Instance) else None)
+        if isinstance(image, Instance):
+            tags["file"] = str(image.filepath)
+
+        context = None
+        try:
+            found = self.get_context()
+            if isinstance(found, TO2AContext):
+                context = context_to_record(found)
+        # pylint: disable-next=broad-exception-caught
+        except Exception:
+            pass
+
+        try:
+            with ResultsStore(self.results_path) as store:
+                return store.add_run(outputs, tags, context, rois, source="gui")
+        except (sqlite3.Error, OSError) as exc:
+            print(f"Could not store results in {self.results_path}: {exc}", file=sys.stderr)
+            return None
+
+    def load_module_image(self, module: BaseModule) -> None:
+        """
+        Loads the image waiting to be loaded into `module`, if there is one.
+        """
+        if module in self._pending_modules:
+            self._pending_modules.remove(module)
+            if self._pending_image is not None:
+                module.viewer.load_image(self._pending_image)  # type: ignore
+
+    def load_pending_images(self) -> None:
+        """
+        Loads the image into every module still waiting for it.
+        """
+        for module in list(self._pending_modules):
+            self.load_module_image(module)
+
+    def _load_selected_module(self) -> None:
+        """
+        Loads the image into the module of the selected tab, if it is waiting for it.
+        """
+        try:
+            selected = self.notebook.select()
+        except tk.TclError:
+            return
+        for module in list(self._pending_modules):
+            if str(module) == selected:
+                self.load_module_image(module)
+
+    def _on_tab_change(self, event: tk.Event):
+        self._load_selected_module()
+        super()._on_tab_change(event)
+
+
+def _timed_job(name: str, job: JobFunction) -> ApplyFunction:
+    """
+    Runs a job in a profiler span, recorded as a run of the thread it is run on.
+    """
+    with profiler.span(name):
+        return job()
+
+
+def roi_record(roi: BaseROI | None) -> dict | None:
+    """
+    Returns the slice and pixel coordinates of an ROI as a JSON serialisable dict.
+    """
+    if roi is None:
+        return None
+    record: dict = {"slice": roi.slice_num}
+    if isinstance(roi, RectangleROI):
+        record.update({"xmin": roi.xmin, "xmax": roi.xmax, "ymin": roi.ymin, "ymax": roi.ymax})
+    elif isinstance(roi, LineROI):
+        record.update({"x1": roi.x1, "y1": roi.y1, "x2": roi.x2, "y2": roi.y2})
+    return record
@@ -13,46 +13,44 @@ from pumpia.file_handling.dicom_structures import Series, Instance
 from pumpia.module_handling.manager import Manager
 from pumpia.utilities.typing import DirectionType, SideType
 from pumpia.widgets.typing import ScreenUnits, Cursor, Padding, Relief, TakeFocusValue
+from pumpia.widgets.entry_boxes import FloatEntry
 from pumpia.widgets.context_managers import (PhantomContextManager,
                                              AutoPhantomManager,
                                              PhantomContextManagerGenerator,
                                              side_map,
                                              inv_side_map,
                                              side_opts)
-from pumpia.module_handling.context import PhantomContext
 
-# offsets in mm (dicom standard units)
-FOUR_BOX_OFFSET = 54
-FOUR_BOX_SL = 10
-
-
-class TO2AContext(PhantomContext):
-    """
-    Context for TO2A Phantom.
-    """
-
-    def __init__(self,
-                 xmin: int,
-                 xmax: int,
-                 ymin: int,
-                 ymax: int,
-                 wedges_side: SideType = "bottom",
-                 mtf_side: SideType = "left"):
-        super().__init__(xmin, xmax, ymin, ymax, 'ellipse')
-
-        if ((mtf_side in ["top", "bottom"]
-             and wedges_side in ["top", "bottom"])
-            or (mtf_side in ["left", "right"]
-                and wedges_side in ["left", "right"])):
-            raise ValueError("wedges/MTF sides must not be on the same axis")
-
-        self.mtf_side: SideType = mtf_side
-        self.wedges_side: SideType = wedges_side
+from pumpia_to2a.kernels.context import (TO2AContext,
+                                         four_box_bounds,
+                                         find_insert_sides,
+                                         find_rotation,
+                                         detect_context)
+from pumpia_to2a.kernels.geometry import (PlaneGeometry,
+                                          plane_geometry,
+                                          map_context,
+                                          context_consistent)
+from pumpia_to2a.kernels.profiles import BoxBounds
+from pumpia_to2a.context_cache import ContextCache, detection_params
+from pumpia_to2a.instrumentation import profiler, timed
+from pumpia_to2a.pixel_buffer import pixel_buffer, image_key
+from pumpia_to2a.background import ApplyFunction, JobFunction
+
+# number of contexts kept by each context manager
+CONTEXT_CACHE_SIZE = 32
 
 
 class TO2AContextManager(PhantomContextManager):
     """
     Context Manager for TO2A Phantom.
+
+    Contexts are cached per image and settings, so the collection and its modules,
+    which share the collections context manager, only find the context once per image.
+    Contexts found in auto mode are also stored in an on disk cache
+    so they are not found again in later sessions,
+    and are shared with series imaged in the same plane, e.g. the other sequences of a session,
+    which use it mapped to their pixel grid if it passes a quick check,
+    see `kernels.geometry`.
     """
     @overload
     def __init__(self,
@@ -162,6 +160,35 @@ class TO2AContextManager(PhantomContextManager):
                                                  variable=self.show_boxes_var)
         self.show_boxes_button.grid(column=0, row=3, columnspan=2, sticky="nsew")
 
+        self.estimate_rotation_var = tk.BooleanVar(self, True)
+        self.estimate_rotation_button = ttk.Checkbutton(self.inserts_frame,
+                                                        text="Estimate Rotation",
+                                                        variable=self.estimate_rotation_var)
+        self.estimate_rotation_button.grid(column=0, row=6, columnspan=2, sticky="nsew")
+
+        self.rotation_var = tk.DoubleVar(self, 0)
+        self.rotation_entry = FloatEntry(self.inserts_frame, textvariable=self.rotation_var)
+        self.rotation_label = ttk.Label(self.inserts_frame, text="Rotation (°)")
+        self.rotation_label.grid(column=0, row=7, sticky="nsew")
+        self.rotation_entry.grid(column=1, row=7, sticky="nsew")
+
+        self.disk_cache = ContextCache()
+        self.use_disk_cache_var = tk.BooleanVar(self, True)
+        self.use_disk_cache_button = ttk.Checkbutton(self.inserts_frame,
+                                                     text="Use Context Cache",
+                                                     variable=self.use_disk_cache_var)
+        self.use_disk_cache_button.grid(column=0, row=4, columnspan=2, sticky="nsew")
+        self.clear_cache_button = ttk.Button(self.inserts_frame,
+                                             text="Clear Context Cache",
+                                             command=self._clear_all_caches)
+        self.clear_cache_button.grid(column=0, row=5, columnspan=2, sticky="nsew")
+
+        self.share_context_var = tk.BooleanVar(self, True)
+        self.share_context_button = ttk.Checkbutton(self.inserts_frame,
+                                                    text="Share Context Between Series",
+                                                    variable=self.share_context_var)
+        self.share_context_button.grid(column=0, row=8, columnspan=2, sticky="nsew")
+
         if self.direction[0].lower() == "h":
             self.auto_phantom_manager.grid(column=0, row=0, sticky="nsew")
             self.inserts_frame.grid(column=1, row=0, sticky="nsew")
@@ -169,18 +196,260 @@ class TO2AContextManager(PhantomContextManager):
             self.auto_phantom_manager.grid(column=0, row=0, sticky="nsew")
             self.inserts_frame.grid(column=0, row=1, sticky="nsew")
 
+        self._context_cache: dict[tuple, TO2AContext] = {}
+        # contexts keyed by plane geometry group and settings, with the plane they were found on
+        self._shared_contexts: dict[tuple, tuple[PlaneGeometry, TO2AContext]] = {}
+
+    def _settings_key(self) -> tuple:
+        """
+        Returns the current settings which affect the context.
+        """
+        apm = self.auto_phantom_manager
+        mode = apm.mode_var.get()
+        settings: tuple = (mode,
+                           apm.sensitivity_var.get(),
+                           apm.top_perc_var.get(),
+                           self.show_boxes_var.get(),
+                           self.estimate_rotation_var.get())
+        if mode == "auto":
+            settings += (apm.iterations_var.get(),
+                         apm.cull_perc_var.get(),
+                         tuple(var.get() for var in apm.shape_vars))
+        elif mode == "manual":
+            settings += (apm.bubble_offset_var.get(),
+                         apm.bubble_side_var.get(),
+                         apm.man_shape_var.get())
+        elif mode == "fine tune":
+            fine_tune = apm.fine_tune_frame
+            settings += (fine_tune.xmin_var.get(),
+                         fine_tune.xmax_var.get(),
+                         fine_tune.ymin_var.get(),
+                         fine_tune.ymax_var.get(),
+                         self.mtf_var.get(),
+                         self.wedge_var.get(),
+                         self.rotation_var.get())
+        return settings
+
+    @staticmethod
+    def image_key(image: Instance) -> tuple[str, str, int]:
+        """
+        Returns the key identifying an image in the context cache,
+        (series UID, SOP instance UID, slice number).
+        """
+        return image_key(image)
+
+    def clear_context_cache(self) -> None:
+        """
+        Clears the cached contexts so the next call to `get_context` finds them again.
+        """
+        self._context_cache.clear()
+        self._shared_contexts.clear()
+
+    def _clear_all_caches(self) -> None:
+        """
+        Clears the cached contexts in memory and on disk.
+        """
+        self.clear_context_cache()
+        self.disk_cache.clear()
+
+    def _detection_params(self) -> dict:
+        """
+        Returns the auto mode settings, see `context_cache.detection_params`.
+        """
+        apm = self.auto_phantom_manager
+        shapes = [apm.shape_map[var.get()] for var in apm.shape_vars if var.get() != ""]
+        return detection_params(apm.sensitivity_var.get(),
+                                apm.top_perc_var.get(),
+                                apm.iterations_var.get(),
+                                apm.cull_perc_var.get(),
+                                [shape for shape in shapes if shape is not None],
+                                self.estimate_rotation_var.get())
+
+    def _disk_cache_key(self, image: Instance, image_array: np.ndarray) -> str:
+        """
+        Returns the on disk cache key for an image using the auto mode settings.
+        """
+        return self.disk_cache.key(self.image_key(image)[1], image_array, self._detection_params())
+
+    def _store_context(self, key: tuple, context: TO2AContext) -> None:
+        """
+        Stores a context in the in memory cache, removing the oldest if it is full.
+        """
+        self._context_cache.pop(key, None)
+        if len(self._context_cache) >= CONTEXT_CACHE_SIZE:
+            del self._context_cache[next(iter(self._context_cache))]
+        self._context_cache[key] = context
+
+    @staticmethod
+    def plane_geometry(image: Instance) -> PlaneGeometry | None:
+        """
+        Returns the plane geometry of an image, None if its header does not give it.
+        """
+        frame = image.slice_number - 1 if image.is_frame else 0
+        return plane_geometry(image.dicom_dataset, frame)
+
+    def _shared_context(self,
+                        geometry: PlaneGeometry | None,
+                        settings: tuple,
+                        image_array: np.ndarray,
+                        pixel_size: tuple[float, float, float]) -> TO2AContext | None:
+        """
+        Returns the context found with the same settings on an image in the same plane,
+        mapped to the pixel grid of `geometry`,
+        or None if there is not one or it does not pass `context_consistent`.
+        """
+        if geometry is None:
+            return None
+        shared = self._shared_contexts.get((geometry.group_key(), settings))
+        if shared is None:
+            return None
+        with profiler.span("context.shared"):
+            context = map_context(shared[1], shared[0], geometry)
+            if context_consistent(image_array, context, pixel_size):
+                return context
+        return None
+
+    def _share_context(self,
+                       geometry: PlaneGeometry | None,
+                       settings: tuple,
+                       context: TO2AContext) -> None:
+        """
+        Stores a context for images in the same plane, removing the oldest if full.
+        """
+        if geometry is None:
+            return
+        key = (geometry.group_key(), settings)
+        self._shared_contexts.pop(key, None)
+        if len(self._shared_contexts) >= CONTEXT_CACHE_SIZE:
+            del self._shared_contexts[next(iter(self._shared_contexts))]
+        self._shared_contexts[key] = (geometry, context)
+
+    def _show_context(self, context: TO2AContext) -> None:
+        """
+        Shows the insert sides and rotation of a context in the options.
+        """
+        self.mtf_var.set(inv_side_map[context.mtf_side])
+        self.wedge_var.set(inv_side_map[context.wedges_side])
+        self.rotation_var.set(context.rotation)
+
+    def _show_boxes(self,
+                    image: Instance,
+                    box_bounds: dict[SideType, BoxBounds],
+                    xcent: float,
+                    ycent: float) -> None:
+        """
+        Shows the four boxes used to find the inserts and the centre of the phantom.
+        """
+        for side, (xmin, xmax, ymin, ymax) in box_bounds.items():
+            roi = RectangleROI(image,
+                               xmin,
+                               ymin,
+                               xmax - xmin,
+                               ymax - ymin,
+                               replace=True,
+                               name=inv_side_map[side])
+            self.manager.add_roi(roi)
+
+        cent = PointROI(image,
+                        round(xcent),
+                        round(ycent),
+                        name="Centre",
+                        replace=True)
+        self.manager.add_roi(cent)
+
+    @timed("get_context")
     def get_context(self, image: Series | Instance) -> TO2AContext:
 
         if isinstance(image, Series):
             slice_index = image.num_slices // 2
             image = image.instances[slice_index]
 
-        boundary_context = self.auto_phantom_manager.get_context(image)
+        # "on image" uses the boundary ROI which can be moved so is never cached
+        if self.auto_phantom_manager.mode_var.get() == "on image":
+            return self._find_context(image)
+
+        key = (self.image_key(image), self._settings_key())
+        context = self._context_cache.get(key)
+        if context is None:
+            context = self._find_context(image)
+        else:
+            self._show_context(context)
+
+        self._store_context(key, context)
+        return context
+
+    def context_job(self, image: Series | Instance) -> JobFunction | None:
+        """
+        Returns a job finding the context of `image` on a worker thread, see `background`.
+        Applying its result stores the context so `get_context` does not find it again.
+        Returns None if the context is already cached,
+        or when it can only be found on the main thread,
+        i.e. when not in auto mode or when showing the boxes.
+        """
+        if isinstance(image, Series):
+            slice_index = image.num_slices // 2
+            image = image.instances[slice_index]
 
+        if (self.auto_phantom_manager.mode_var.get() != "auto"
+                or self.show_boxes_var.get()):
+            return None
+        key = (self.image_key(image), self._settings_key())
+        if key in self._context_cache:
+            return None
+
+        params = self._detection_params()
+        use_disk_cache = self.use_disk_cache_var.get()
+        settings = key[1]
+        geometry = self.plane_geometry(image) if self.share_context_var.get() else None
+        instance = image
+
+        def find_context() -> ApplyFunction:
+            with profiler.span("get_context"):
+                with profiler.span("decode"):
+                    image_array = pixel_buffer.array(instance)
+                disk_key = None
+                context = None
+                if use_disk_cache:
+                    disk_key = self.disk_cache.key(self.image_key(instance)[1], image_array, params)
+                    context = self.disk_cache.get(disk_key)
+                if context is None:
+                    context = self._shared_context(geometry,
+                                                   settings,
+                                                   image_array,
+                                                   instance.pixel_size)
+                    if context is not None and disk_key is not None:
+                        self.disk_cache.put(disk_key, context)
+                if context is None:
+                    context = detect_context(image_array,
+                                             instance.pixel_size,
+                                             params["sensitivity"],
+                                             params["top_perc"],
+                                             params["iterations"],
+                                             params["cull_perc"],
+                                             params["rotation"],
+                                             params["shapes"])
+                    if disk_key is not None:
+                        self.disk_cache.put(disk_key, context)
+
+            def apply() -> None:
+                self._store_context(key, context)
+                self._share_context(geometry, settings, context)
+                # pylint: disable-next=protected-access
+                self.auto_phantom_manager._show_fine_tune(context)
+                self._show_context(context)
+            return apply
+
+        return find_context
+
+    def _find_context(self, image: Instance) -> TO2AContext:
+        """
+        Finds the context for an image without using the in memory cache.
+        """
         mtf_side: SideType
         wedge_side: SideType
 
         if self.auto_phantom_manager.mode_var.get() == "fine tune":
+            boundary_context = self.auto_phantom_manager.get_context(image)
             mtf_side = side_map[self.mtf_var.get()]
             wedge_side = side_map[self.wedge_var.get()]
             return TO2AContext(boundary_context.xmin,
@@ -188,141 +457,90 @@ class TO2AContextManager(PhantomContextManager):
                                boundary_context.ymin,
                                boundary_context.ymax,
                                wedge_side,
-                               mtf_side)
+                               mtf_side,
+                               self.rotation_var.get())
 
         pixel_size = image.pixel_size
         pixel_height = pixel_size[1]
         pixel_width = pixel_size[2]
 
-        image_array = image.array[0]
-
-        xcent = boundary_context.xcent
-        ycent = boundary_context.ycent
-
-        four_box_offset_x = FOUR_BOX_OFFSET / pixel_width
-        four_box_offset_y = FOUR_BOX_OFFSET / pixel_height
-
-        four_box_width = FOUR_BOX_SL / pixel_width
-        four_box_height = FOUR_BOX_SL / pixel_height
-
-        top_box_xmin = round(xcent - four_box_width / 2)
-        top_box_xmax = round(xcent + four_box_width / 2) + 1
-        top_box_ymin = round(ycent - four_box_offset_y - four_box_height)
-        top_box_ymax = round(ycent - four_box_offset_y) + 1
-
-        bottom_box_xmin = round(xcent - four_box_width / 2)
-        bottom_box_xmax = round(xcent + four_box_width / 2) + 1
-        bottom_box_ymin = round(ycent + four_box_offset_y)
-        bottom_box_ymax = round(ycent + four_box_offset_y + four_box_height) + 1
-
-        left_box_xmin = round(xcent - four_box_offset_x - four_box_width)
-        left_box_xmax = round(xcent - four_box_offset_x) + 1
-        left_box_ymin = round(ycent - four_box_height / 2)
-        left_box_ymax = round(ycent + four_box_height / 2) + 1
-
-        right_box_xmin = round(xcent + four_box_offset_x)
-        right_box_xmax = round(xcent + four_box_offset_x + four_box_width) + 1
-        right_box_ymin = round(ycent - four_box_height / 2)
-        right_box_ymax = round(ycent + four_box_height / 2) + 1
-
-        box_means = [np.mean(image_array[top_box_ymin:top_box_ymax,
-                                         top_box_xmin:top_box_xmax]),
-                     np.mean(image_array[bottom_box_ymin:bottom_box_ymax,
-                                         bottom_box_xmin:bottom_box_xmax]),
-                     np.mean(image_array[left_box_ymin:left_box_ymax,
-                                         left_box_xmin:left_box_xmax]),
-                     np.mean(image_array[right_box_ymin:right_box_ymax,
-                                         right_box_xmin:right_box_xmax])]
-        sort_box_means = sorted(box_means)
-
-        mtf_mean = sort_box_means[0]
-        wedge_mean = sort_box_means[1]
-
-        if mtf_mean == box_means[0]:
-            mtf_side = "top"
-        elif mtf_mean == box_means[1]:
-            mtf_side = "bottom"
-        elif mtf_mean == box_means[2]:
-            mtf_side = "left"
-        elif mtf_mean == box_means[3]:
-            mtf_side = "right"
-
-        if wedge_mean == box_means[0]:
-            wedge_side = "top"
-        elif wedge_mean == box_means[1]:
-            wedge_side = "bottom"
-        elif wedge_mean == box_means[2]:
-            wedge_side = "left"
-        elif wedge_mean == box_means[3]:
-            wedge_side = "right"
-
-        if ((mtf_side in ["top", "bottom"]
-             and wedge_side in ["top", "bottom"])
-            or (mtf_side in ["left", "right"]
-                and wedge_side in ["left", "right"])):
-            wedge_mean = sort_box_means[2]
-            if wedge_mean == box_means[0]:
-                wedge_side = "top"
-            elif wedge_mean == box_means[1]:
-                wedge_side = "bottom"
-            elif wedge_mean == box_means[2]:
-                wedge_side = "left"
-            elif wedge_mean == box_means[3]:
-                wedge_side = "right"
-
-        self.mtf_var.set(inv_side_map[mtf_side])
-        self.wedge_var.set(inv_side_map[wedge_side])
+        with profiler.span("decode"):
+            image_array = pixel_buffer.array(image)
+
+        auto = self.auto_phantom_manager.mode_var.get() == "auto"
+        settings = self._settings_key()
+        geometry = None
+        if auto and self.share_context_var.get():
+            geometry = self.plane_geometry(image)
+
+        disk_key: str | None = None
+        if auto:
+            context = None
+            if self.use_disk_cache_var.get():
+                disk_key = self._disk_cache_key(image, image_array)
+                context = self.disk_cache.get(disk_key)
+            if context is None:
+                context = self._shared_context(geometry, settings, image_array, pixel_size)
+                if context is not None and disk_key is not None:
+                    self.disk_cache.put(disk_key, context)
+            if context is not None:
+                self._share_context(geometry, settings, context)
+                # pylint: disable-next=protected-access
+                self.auto_phantom_manager._show_fine_tune(context)
+                self._show_context(context)
+                if self.show_boxes_var.get():
+                    self._show_boxes(image,
+                                     four_box_bounds(context.xcent,
+                                                     context.ycent,
+                                                     pixel_height,
+                                                     pixel_width),
+                                     context.xcent,
+                                     context.ycent)
+                return context
+
+        with profiler.span("context.boundary"):
+            boundary_context = self.auto_phantom_manager.get_context(image)
+
+        with profiler.span("context.insert_sides"):
+            mtf_side, wedge_side = find_insert_sides(image_array,
+                                                     boundary_context.xcent,
+                                                     boundary_context.ycent,
+                                                     pixel_height,
+                                                     pixel_width)
+
+        rotation: float = 0
+        if self.estimate_rotation_var.get():
+            with profiler.span("context.rotation"):
+                rotation = find_rotation(image_array,
+                                         boundary_context.xcent,
+                                         boundary_context.ycent,
+                                         pixel_height,
+                                         pixel_width,
+                                         mtf_side,
+                                         wedge_side)
 
         if self.show_boxes_var.get():
-            top_roi = RectangleROI(image,
-                                   top_box_xmin,
-                                   top_box_ymin,
-                                   top_box_xmax - top_box_xmin,
-                                   top_box_ymax - top_box_ymin,
-                                   replace=True,
-                                   name="Top")
-            self.manager.add_roi(top_roi)
-
-            bottom_roi = RectangleROI(image,
-                                      bottom_box_xmin,
-                                      bottom_box_ymin,
-                                      bottom_box_xmax - bottom_box_xmin,
-                                      bottom_box_ymax - bottom_box_ymin,
-                                      replace=True,
-                                      name="Bottom")
-            self.manager.add_roi(bottom_roi)
-
-            left_roi = RectangleROI(image,
-                                    left_box_xmin,
-                                    left_box_ymin,
-                                    left_box_xmax - left_box_xmin,
-                                    left_box_ymax - left_box_ymin,
-                                    replace=True,
-                                    name="Left")
-            self.manager.add_roi(left_roi)
-
-            right_roi = RectangleROI(image,
-                                     right_box_xmin,
-                                     right_box_ymin,
-                                     right_box_xmax - right_box_xmin,
-                                     right_box_ymax - right_box_ymin,
-                                     replace=True,
-                                     name="Right")
-            self.manager.add_roi(right_roi)
-
-            cent = PointROI(image,
-                            round(boundary_context.xcent),
-                            round(boundary_context.ycent),
-                            name="Centre",
-                            replace=True)
-            self.manager.add_roi(cent)
-
-        return TO2AContext(boundary_context.xmin,
-                           boundary_context.xmax,
-                           boundary_context.ymin,
-                           boundary_context.ymax,
-                           wedge_side,
-                           mtf_side)
+            self._show_boxes(image,
+                             four_box_bounds(boundary_context.xcent,
+                                             boundary_context.ycent,
+                                             pixel_height,
+                                             pixel_width),
+                             boundary_context.xcent,
+                             boundary_context.ycent)
+
+        context = TO2AContext(boundary_context.xmin,
+                              boundary_context.xmax,
+                              boundary_context.ymin,
+                              boundary_context.ymax,
+                              wedge_side,
+                              mtf_side,
+                              rotation)
+        self._show_context(context)
+        if disk_key is not None:
+            self.disk_cache.put(disk_key, context)
+        if auto:
+            self._share_context(geometry, settings, context)
+        return context
 
 
 class TO2AContextManagerGenerator(PhantomContextManagerGenerator[TO2AContextManager]):
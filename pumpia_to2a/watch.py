@@ -0,0 +1,474 @@
+"""
+Watches a folder for TO2A series exported by a scanner and analyses each series once it is complete.
+
+The folder is scanned every `interval` seconds.
+A file is only read once its size and modification time are the same in two scans,
+then only its header is read to find its series.
+A series is complete once no files have been added to it for `settle` seconds,
+it is then queued and analysed by `batch.analyse_series` in a process pool,
+with at most `max_pending` series being analysed at once.
+Results are written to the results database and optionally a JSON lines file.
+
+The files read and the series analysed are kept in a state database,
+so on restart known files are not read again, finished series are not analysed again,
+and series that were queued or being analysed when stopped are analysed.
+A series that gains files after it was analysed is analysed again.
+No tkinter is imported.
+"""
+import os
+import re
+import sys
+import json
+import time
+import signal
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+from collections import deque
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import pydicom
+from pydicom.errors import InvalidDicomError
+
+from pumpia_to2a.batch import SeriesFiles, analyse_series, record_status
+from pumpia_to2a.results_store import ResultsStore, default_store_path
+from pumpia_to2a.context_cache import default_cache_dir
+
+DEFAULT_SETTLE = 30
+DEFAULT_INTERVAL = 2
+
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    series_uid TEXT,
+    description TEXT NOT NULL DEFAULT '',
+    protocol TEXT NOT NULL DEFAULT '',
+    instance INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS files_series ON files(series_uid);
+CREATE TABLE IF NOT EXISTS series (
+    series_uid TEXT PRIMARY KEY,
+    num_files INTEGER NOT NULL,
+    analysed TEXT NOT NULL,
+    error TEXT
+);
+"""
+
+
+def default_state_path() -> Path:
+    """
+    Returns the default state database, next to the default results database.
+    """
+    return default_store_path().parent / "watch_state.sqlite3"
+
+
+@dataclass
+class PendingSeries:
+    """
+    A series whose files are still arriving or that is waiting to be queued.
+
+    Attributes
+    ----------
+    series_uid : str
+    description : str
+    protocol : str
+    files : dict[Path, int]
+        The instance number of each file.
+    last_change : float
+        The `time.monotonic` time a file was last added.
+    """
+    series_uid: str
+    description: str = ""
+    protocol: str = ""
+    files: dict[Path, int] = field(default_factory=dict)
+    last_change: float = 0
+
+    def series_files(self) -> SeriesFiles:
+        """
+        Returns the series as used by `batch.analyse_series`.
+        """
+        return SeriesFiles(self.series_uid,
+                           self.description,
+                           sorted(self.files, key=lambda path: self.files[path]))
+
+
+class WatchState:
+    """
+    SQLite database of the files read and series analysed by a `FolderWatcher`.
+
+    Methods
+    -------
+    file_signatures() -> dict[Path, tuple[int, int]]
+    add_file(path, size, mtime_ns, series_uid, description, protocol, instance)
+    commit()
+    series_files(series_uid: str) -> PendingSeries
+    unfinished() -> list[PendingSeries]
+    is_done(series_uid: str, num_files: int) -> bool
+    mark_done(series_uid: str, num_files: int, error: str | None)
+    close()
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        with self.connection:
+            self.connection.executescript(STATE_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Closes the database connection.
+        """
+        self.connection.close()
+
+    def file_signatures(self) -> dict[Path, tuple[int, int]]:
+        """
+        Returns the (size, mtime_ns) each file had when it was read.
+        """
+        return {Path(path): (size, mtime_ns) for path, size, mtime_ns in
+                self.connection.execute("SELECT path, size, mtime_ns FROM files")}
+
+    def add_file(self,
+                 path: Path,
+                 size: int,
+                 mtime_ns: int,
+                 series_uid: str | None,
+                 description: str = "",
+                 protocol: str = "",
+                 instance: int = 0) -> None:
+        """
+        Records a file that has been read, `series_uid` is None if it is not a DICOM image.
+        Not saved until `commit` is called.
+        """
+        self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (str(path), size, mtime_ns, series_uid,
+                                 description, protocol, instance))
+
+    def commit(self) -> None:
+        """
+        Saves the files added.
+        """
+        self.connection.commit()
+
+    def series_files(self, series_uid: str) -> PendingSeries:
+        """
+        Returns a series with every file read for it that still exists.
+        """
+        series = PendingSeries(series_uid)
+        for path, description, protocol, instance in self.connection.execute(
+                "SELECT path, description, protocol, instance FROM files WHERE series_uid = ?",
+                (series_uid,)):
+            if os.path.exists(path):
+                series.description = description
+                series.protocol = protocol
+                series.files[Path(path)] = instance
+        return series
+
+    def unfinished(self) -> list[PendingSeries]:
+        """
+        Returns the series with files read that have not been analysed with all of them.
+        """
+        rows = self.connection.execute(
+            "SELECT files.series_uid FROM files "
+            "LEFT JOIN series ON files.series_uid = series.series_uid "
+            "WHERE files.series_uid IS NOT NULL "
+            "GROUP BY files.series_uid "
+            "HAVING MAX(series.num_files) IS NULL OR COUNT(*) > MAX(series.num_files)").fetchall()
+        return [self.series_files(row[0]) for row in rows]
+
+    def is_done(self, series_uid: str, num_files: int) -> bool:
+        """
+        Returns whether a series has been analysed with at least `num_files` files.
+        """
+        row = self.connection.execute("SELECT num_files FROM series WHERE series_uid = ?",
+                                      (series_uid,)).fetchone()
+        return row is not None and row[0] >= num_files
+
+    def mark_done(self, series_uid: str, num_files: int, error: str | None = None) -> None:
+        """
+        Records that a series has been analysed with `num_files` files.
+        """
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?)",
+                                    (series_uid, num_files,
+                                     datetime.now(timezone.utc).isoformat(), error))
+
+
+class FolderWatcher:
+    """
+    Finds the complete series in a folder, see the module documentation.
+
+    Parameters
+    ----------
+    folder : Path
+    state : WatchState
+    settle : float, optional
+        Seconds without new files before a series is complete (default is `DEFAULT_SETTLE`).
+    series_filter : str or None, optional
+        Regular expression matched against the series description and protocol name,
+        if given only matching series are returned (default is None).
+
+    Methods
+    -------
+    scan(now: float | None = None) -> list[SeriesFiles]
+    """
+
+    def __init__(self,
+                 folder: Path,
+                 state: WatchState,
+                 settle: float = DEFAULT_SETTLE,
+                 series_filter: str | None = None):
+        self.folder = Path(folder)
+        self.state = state
+        self.settle = settle
+        self.pattern = None if series_filter is None else re.compile(series_filter, re.IGNORECASE)
+        self._known = state.file_signatures()
+        # files seen changing, waiting for them to be the same in the next scan
+        self._changing: dict[Path, tuple[int, int]] = {}
+        now = time.monotonic()
+        self._pending: dict[str, PendingSeries] = {}
+        for series in state.unfinished():
+            series.last_change = now
+            self._pending[series.series_uid] = series
+
+    def _files(self):
+        """
+        Yields the path and (size, mtime_ns) of every file in the folder.
+        """
+        for root, _, names in os.walk(self.folder):
+            for name in names:
+                path = Path(root) / name
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                yield path, (stat.st_size, stat.st_mtime_ns)
+
+    def _read(self, path: Path, signature: tuple[int, int], now: float) -> None:
+        """
+        Reads the header of a file that has stopped changing and adds it to its series.
+        """
+        self._known[path] = signature
+        try:
+            ds = pydicom.dcmread(path, stop_before_pixels=True)
+        except (InvalidDicomError, OSError, ValueError, EOFError):
+            ds = None
+        if ds is None or "Rows" not in ds or "SeriesInstanceUID" not in ds:
+            self.state.add_file(path, *signature, None)
+            return
+
+        series_uid = str(ds.SeriesInstanceUID)
+        description = str(ds.get("SeriesDescription", ""))
+        protocol = str(ds.get("ProtocolName", ""))
+        instance = int(ds.get("InstanceNumber", 0) or 0)
+        self.state.add_file(path, *signature, series_uid, description, protocol, instance)
+
+        if series_uid not in self._pending:
+            # a series analysed before gaining files is analysed again with all of them
+            self._pending[series_uid] = self.state.series_files(series_uid)
+        series = self._pending[series_uid]
+        series.description = description
+        series.protocol = protocol
+        series.files[path] = instance
+        series.last_change = now
+
+    def _matches(self, series: PendingSeries) -> bool:
+        return (self.pattern is None
+                or self.pattern.search(series.description) is not None
+                or self.pattern.search(series.protocol) is not None)
+
+    def scan(self, now: float | None = None) -> list[SeriesFiles]:
+        """
+        Reads any new files and returns the series that have become complete,
+        each series is only returned once.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        changing: dict[Path, tuple[int, int]] = {}
+        for path, signature in self._files():
+            if self._known.get(path) == signature:
+                continue
+            if self._changing.get(path) != signature:
+                changing[path] = signature
+                continue
+            self._read(path, signature, now)
+        self._changing = changing
+        self.state.commit()
+
+        complete: list[SeriesFiles] = []
+        for series_uid, series in list(self._pending.items()):
+            if now - series.last_change < self.settle:
+                continue
+            del self._pending[series_uid]
+            if (series.files
+                and self._matches(series)
+                    and not self.state.is_done(series_uid, len(series.files))):
+                complete.append(series.series_files())
+        return complete
+
+
+def _init_worker() -> None:
+    """
+    Sets up a worker process, interrupts are handled by the watcher
+    so the series being analysed are finished.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def watch(folder: Path,
+          workers: int | None = None,
+          settle: float = DEFAULT_SETTLE,
+          interval: float = DEFAULT_INTERVAL,
+          series_filter: str | None = None,
+          cache_dir: Path | None = None,
+          store: Path | None = None,
+          output: Path | None = None,
+          state_path: Path | None = None,
+          max_pending: int | None = None,
+          stop: threading.Event | None = None) -> None:
+    """
+    Analyses the series arriving in `folder` until `stop` is set,
+    or the process is interrupted, then finishes the series being analysed.
+
+    Parameters
+    ----------
+    folder : Path
+    workers : int or None, optional
+        Number of worker processes, defaults to the number of CPUs (default is None).
+    settle : float, optional
+        Seconds without new files before a series is complete (default is `DEFAULT_SETTLE`).
+    interval : float, optional
+        Seconds between scans of the folder (default is `DEFAULT_INTERVAL`).
+    series_filter : str or None, optional
+        Regular expression to select series, see `batch.find_series` (default is None).
+    cache_dir : Path or None, optional
+        The folder of the context cache, the cache is not used if None (default is None).
+    store : Path or None, optional
+        The results database, records are not stored if None (default is None).
+    output : Path or None, optional
+        JSON lines file each record is appended to (default is None).
+    state_path : Path or None, optional
+        The state database, `default_state_path()` if None (default is None).
+    max_pending : int or None, optional
+        The most series queued in the pool at once,
+        twice the number of workers if None (default is None).
+    stop : threading.Event or None, optional
+        Set to stop watching (default is None).
+    """
+    if stop is None:
+        stop = threading.Event()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    def request_stop(*_):
+        stop.set()
+
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            previous_handlers[signum] = signal.signal(signum, request_stop)
+
+    queued: deque[SeriesFiles] = deque()
+    pending: dict[Future, SeriesFiles] = {}
+    try:
+        with (WatchState(state_path or default_state_path()) as state,
+              (nullcontext() if store is None else ResultsStore(store)) as results_store,
+              (nullcontext() if output is None
+               else open(output, "a", encoding="utf-8")) as output_file,
+              ProcessPoolExecutor(max_workers=workers,
+                                  initializer=_init_worker) as executor):
+            watcher = FolderWatcher(folder, state, settle, series_filter)
+            next_scan = 0.0
+            while not stop.is_set() or pending:
+                now = time.monotonic()
+                if not stop.is_set() and now >= next_scan:
+                    queued.extend(watcher.scan(now))
+                    next_scan = now + interval
+
+                # backpressure, series wait in the queue until the pool has room
+                while queued and len(pending) < max_pending and not stop.is_set():
+                    series = queued.popleft()
+                    pending[executor.submit(analyse_series, series, cache_dir)] = series
+
+                if not pending:
+                    stop.wait(max(next_scan - time.monotonic(), 0))
+                    continue
+                done, _ = wait(pending,
+                               timeout=max(next_scan - time.monotonic(), 0.01),
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    series = pending.pop(future)
+                    record = future.result()
+                    if output_file is not None:
+                        output_file.write(json.dumps(record) + "\n")
+                        output_file.flush()
+                    if results_store is not None and record.get("skipped") is None:
+                        results_store.add_batch_record(record, source="watch")
+                    # only marked once stored so an interrupted series is analysed on restart
+                    state.mark_done(series.series_uid, len(series.files), record["error"])
+                    print(f"{record['series_description']} ({record['series_uid']}): "
+                          + record_status(record),
+                          file=sys.stderr)
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Command line entry point for the folder watcher.
+    """
+    parser = argparse.ArgumentParser(description="Analyse TO2A series as they arrive in a folder.")
+    parser.add_argument("folder", type=Path, help="folder the scanner exports to")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("-f", "--series-filter", default=None,
+                        help="regular expression matched against series description/protocol")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE,
+                        help=f"seconds without new files before a series is complete "
+                        f"(default: {DEFAULT_SETTLE})")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help=f"seconds between scans of the folder (default: {DEFAULT_INTERVAL})")
+    parser.add_argument("-o", "--output", type=Path, default=None,
+                        help="JSON lines file to append the results to")
+    parser.add_argument("--cache-dir", type=Path, default=default_cache_dir(),
+                        help="folder of the context cache (default: user cache folder)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always find the context, ignoring the context cache")
+    parser.add_argument("--store", type=Path, default=default_store_path(),
+                        help="results database to add each record to (default: user data folder)")
+    parser.add_argument("--state", type=Path, default=default_state_path(),
+                        help="database of the files read and series analysed "
+                        "(default: user data folder)")
+    args = parser.parse_args(argv)
+
+    watch(args.folder,
+          args.workers,
+          args.settle,
+          args.interval,
+          args.series_filter,
+          None if args.no_cache else args.cache_dir,
+          args.store,
+          args.output,
+          args.state)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
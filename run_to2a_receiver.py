@@ -0,0 +1,6 @@
+import sys
+
+from pumpia_to2a.receiver import main
+
+if __name__ == "__main__":
+    sys.exit(main())